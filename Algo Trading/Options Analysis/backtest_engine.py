@@ -0,0 +1,141 @@
+from typing import List
+
+import numpy
+
+from constants import Keys
+from model import BacktestValues, PriceMatrix, StrikeEntry
+
+"""
+Definitions written in this file are used to backtest option strategies on an expiry with NumPy.
+The chain of the expiry is pivoted once into a (days x contracts) price matrix. A batch of strategies is a
+(strategies x contracts) matrix of signed quantities, bought lots positive and sold lots negative, so the P&L of all
+the strategies on all the days is a single matrix product with the change in price from the start date.
+"""
+
+
+def price_matrix(timestamp, strike, option_type, close):
+    """
+    It pivots the options of an expiry into a price matrix.
+    :param timestamp: array
+            Day of each option. date objects or datetime64 values.
+    :param strike: array
+            Strike price of each option
+    :param option_type: array
+            Type of each option. Possible values: CE, PE
+    :param close: array
+            Close price of each option
+    :return: PriceMatrix
+            Contracts are sorted on option type and strike
+    """
+    days, day_index = numpy.unique(numpy.asarray(timestamp, dtype='datetime64[D]'), return_inverse=True)
+    contracts, contract_index = numpy.unique(numpy.rec.fromarrays([numpy.asarray(option_type, dtype=str),
+                                                                   numpy.asarray(strike)]), return_inverse=True)
+    prices = numpy.full((len(days), len(contracts)), numpy.nan)
+    prices[day_index.ravel(), contract_index.ravel()] = numpy.asarray(close, dtype=numpy.float64)
+    return PriceMatrix(days, contracts.f1, contracts.f0, prices)
+
+
+def contract_columns(matrix: PriceMatrix, strike, option_type):
+    """
+    It finds the columns of contracts in a price matrix.
+    :param matrix: PriceMatrix
+    :param strike: array
+            Strike of each contract
+    :param option_type: array
+            Type of each contract. Possible values: CE, PE
+    :return: array
+            Column of each contract, -1 if it is not in the matrix
+    """
+    strike, option_type = numpy.broadcast_arrays(numpy.asarray(strike), numpy.asarray(option_type, dtype=str))
+    columns = numpy.full(strike.shape, -1)
+    # Contracts are sorted on option type and then strike
+    for contract_type in numpy.unique(option_type):
+        of_type = numpy.flatnonzero(matrix.option_types == contract_type)
+        wanted = option_type == contract_type
+        if len(of_type) == 0:
+            continue
+        type_strikes = matrix.strikes[of_type]
+        position = numpy.searchsorted(type_strikes, strike[wanted]).clip(0, len(of_type) - 1)
+        columns[wanted] = numpy.where(type_strikes[position] == strike[wanted], of_type[position], -1)
+    return columns
+
+
+def from_start(matrix: PriceMatrix, start_date):
+    """
+    It returns the days of a price matrix from the start date along with the entry price of every contract.
+    :param matrix: PriceMatrix
+    :param start_date: date
+            Day the contracts are entered
+    :return: tuple(array, array, array)
+            Days, (days x contracts) prices and the close of every contract on the start date, NaN if not traded
+    """
+    start = numpy.datetime64(start_date, 'D')
+    rows = matrix.days >= start
+    days, prices = matrix.days[rows], matrix.prices[rows]
+    if len(days) == 0 or days[0] != start:
+        return days, prices, numpy.full(prices.shape[1], numpy.nan)
+    return days, prices, prices[0]
+
+
+def backtest(matrix: PriceMatrix, columns, quantity, start_date):
+    """
+    It finds the P&L of a batch of strategies from the start date. Every leg is entered at its close on the start date.
+    :param matrix: PriceMatrix
+    :param columns: array
+            (strategies x legs) column of each leg in the matrix, -1 for legs which are not there (e.g. padding)
+    :param quantity: array
+            (strategies x legs) signed quantity of each leg, positive for bought and negative for sold
+    :param start_date: date
+            Day the strategies are entered
+    :return: BacktestValues
+    """
+    columns = numpy.atleast_2d(numpy.asarray(columns, dtype=numpy.int64))
+    quantity = numpy.atleast_2d(numpy.asarray(quantity, dtype=numpy.float64))
+    days, prices, entry = from_start(matrix, start_date)
+    # Change in price of every contract from the entry, (days x contracts)
+    change = prices - entry
+
+    if prices.shape[1]:
+        # Legs are valid if they are listed and have an entry price
+        valid_legs = (columns >= 0) & numpy.isfinite(entry[columns.clip(0)])
+        leg_pl = numpy.where(valid_legs[:, None, :], change[:, columns.clip(0)].transpose(1, 0, 2) *
+                             quantity[:, None, :], numpy.nan)
+    else:
+        valid_legs = numpy.zeros(columns.shape, dtype=bool)
+        leg_pl = numpy.full((columns.shape[0], len(days), columns.shape[1]), numpy.nan)
+
+    # Signed quantities of each strategy in every contract, legs on the same contract are added
+    weights = numpy.zeros((columns.shape[0], prices.shape[1]))
+    strategy = numpy.repeat(numpy.arange(columns.shape[0]), columns.shape[1]).reshape(columns.shape)
+    numpy.add.at(weights, (strategy[valid_legs], columns[valid_legs]), quantity[valid_legs])
+    traded = numpy.isfinite(change)
+    total_pl = (numpy.where(traded, change, 0) @ weights.T).T
+    # Days on which none of the legs is traded have no P&L
+    held = numpy.zeros_like(weights, dtype=bool)
+    held[strategy[valid_legs], columns[valid_legs]] = True
+    total_pl[(traded.astype(numpy.int64) @ held.T.astype(numpy.int64)).T == 0] = numpy.nan
+    return BacktestValues(days, leg_pl, total_pl, valid_legs)
+
+
+def strategy_legs(matrix: PriceMatrix, strategies: List[List[StrikeEntry]]):
+    """
+    It converts strategies made of StrikeEntry legs to the columns and signed quantities taken by backtest.
+    Legs with a signal other than buy or sell are left out.
+    :param matrix: PriceMatrix
+    :param strategies: List[List[StrikeEntry]]
+            Legs of each strategy
+    :return: tuple(array, array)
+            (strategies x legs) columns and signed quantities, padded with column -1
+    """
+    legs = max([len(strategy) for strategy in strategies] + [0])
+    strikes = numpy.zeros((len(strategies), legs))
+    option_types = numpy.full((len(strategies), legs), Keys.call)
+    quantity = numpy.zeros((len(strategies), legs))
+    for i, strategy in enumerate(strategies):
+        for j, leg in enumerate(strategy):
+            strikes[i, j], option_types[i, j] = leg.strike, leg.option_type
+            sign = 1 if leg.signal == Keys.buy else (-1 if leg.signal == Keys.sell else 0)
+            quantity[i, j] = sign * (leg.quantity if leg.quantity is not None else 1)
+    columns = contract_columns(matrix, strikes, option_types)
+    columns[quantity == 0] = -1
+    return columns, quantity
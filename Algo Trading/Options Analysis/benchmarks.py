@@ -0,0 +1,519 @@
+import csv
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import numpy
+import pandas as pd
+
+import backtest_engine
+import black_scholes
+import chain_summary
+import data_insertion
+import database_connection
+import delta_iv
+import max_pain_engine
+import option_greeks
+import pcr_engine
+import storage
+from constants import IngestMode, Instrument, Keys
+from model import StrikeEntry
+
+"""
+Benchmarks for comparing the different code paths of the modules.
+Benchmarks which write into the database use a separate database so that the FO data is not touched.
+"""
+
+benchmark_db_name = 'fo_benchmark'
+# Database file used instead when the SQLite backend is set
+benchmark_sqlite_path = 'fo_benchmark.sqlite'
+# Table as it was created before the indexes and generated columns, used as the baseline for the query benchmark.
+# Key is the name of the backend.
+legacy_table_queries = {
+    'mysql': "CREATE TABLE %s (id int NOT NULL AUTO_INCREMENT,instrument varchar(8) ,symbol varchar(30) ,"
+             "expiry date,strike int, option_typ varchar(5), open float, high float, low float, close double, "
+             "settle_pr float, contracts int, val float, open_int int, chg_in_oi int, timestamp date, "
+             "iv float, theta float, gamma float, delta float, vega float, greeks_close double, PRIMARY KEY (id))",
+    'sqlite': "CREATE TABLE %s (id INTEGER PRIMARY KEY AUTOINCREMENT, instrument varchar(8), symbol varchar(30), "
+              "expiry date, strike int, option_typ varchar(5), open float, high float, low float, close double, "
+              "settle_pr float, contracts int, val float, open_int int, chg_in_oi int, timestamp date, "
+              "iv float, theta float, gamma float, delta float, vega float, greeks_close double)",
+}
+# Query of the analytics before the migration, functions on expiry can't use an index
+legacy_queries = {
+    'mysql': "Select * from %s where symbol='%s' and instrument like '%s%%' and MONTH(expiry)=%d and "
+             "YEAR(expiry)=%d",
+    'sqlite': "Select * from %s where symbol='%s' and instrument like '%s%%' and "
+              "CAST(strftime('%%m', expiry) AS INTEGER)=%d and CAST(strftime('%%Y', expiry) AS INTEGER)=%d",
+}
+
+
+@contextmanager
+def _benchmark_database():
+    """
+    Context manager which points database_connection to the benchmark database of the current backend.
+    :return: None
+    """
+    fo_db_name = database_connection.db_name
+    backend = database_connection.get_backend()
+    if isinstance(backend, storage.SQLiteBackend):
+        benchmark_backend = storage.SQLiteBackend(benchmark_sqlite_path, backend.timeout)
+    else:
+        benchmark_backend = storage.MySQLBackend(backend.host, backend.user, backend.password, benchmark_db_name,
+                                                 backend.pool_name, backend.pool_size, backend.ping_attempts)
+    database_connection.db_name = benchmark_db_name
+    database_connection.set_backend(benchmark_backend)
+    try:
+        yield
+    finally:
+        database_connection.db_name = fo_db_name
+        database_connection.set_backend(backend)
+
+
+def _parse_rows(csv_path: str):
+    """
+    It parses the csv file the same way as IngestMode.row does
+    :param csv_path: str
+            Path to the csv file i.e. FO bhavcopy
+    :return: int
+            Number of rows parsed
+    """
+    queries = []
+    with open(csv_path) as f:
+        for row in csv.reader(f):
+            trailer = data_insertion._read_row(row)
+            if trailer is not None:
+                queries.append(data_insertion.header + trailer)
+    return len(queries)
+
+
+def _parse_columns(csv_path: str):
+    """
+    It parses the csv file the same way as IngestMode.columnar does
+    :param csv_path: str
+            Path to the csv file i.e. FO bhavcopy
+    :return: int
+            Number of rows parsed
+    """
+    return len(data_insertion._column_rows(data_insertion._read_columns(csv_path)))
+
+
+def ingest_benchmark(csv_path: str, modes: list = None, repeat: int = 3):
+    """
+    It reports the rows/sec for parsing and loading a bhavcopy with the different ingest modes.
+    Loading is done in the benchmark database which is truncated before every run, see _benchmark_database.
+    :param csv_path: str
+            Path to the csv file i.e. FO bhavcopy
+    :param modes: list
+            Modes to be compared. Possible values in IngestMode. By default all the modes.
+    :param repeat: int
+            Number of runs for each mode. Best run is reported.
+    :return: dict
+            Key is the mode and value is a tuple of parse rows/sec and total rows/sec
+    """
+    modes = modes if modes else [IngestMode.row, IngestMode.columnar, IngestMode.infile]
+    parsers = {IngestMode.row: _parse_rows, IngestMode.columnar: _parse_columns}
+    results = {}
+    with _benchmark_database():
+        for mode in modes:
+            parse_time, total_time, rows = None, None, 0
+            for _ in range(repeat):
+                if mode in parsers:
+                    start_time = time.time()
+                    rows = parsers[mode](csv_path)
+                    elapsed = time.time() - start_time
+                    parse_time = elapsed if parse_time is None else min(parse_time, elapsed)
+
+                database_connection.bulk_entries(truncate=True)
+                start_time = time.time()
+                rows = data_insertion._insert_csv(csv_path, mode)
+                elapsed = time.time() - start_time
+                total_time = elapsed if total_time is None else min(total_time, elapsed)
+
+            parse_rate = rows / parse_time if parse_time else None
+            total_rate = rows / total_time if total_time else None
+            results[mode] = (parse_rate, total_rate)
+
+    print("%-10s %15s %15s" % ("Mode", "Parse rows/s", "Total rows/s"))
+    for mode, (parse_rate, total_rate) in results.items():
+        print("%-10s %15s %15s" % (mode, "%.0f" % parse_rate if parse_rate else "-",
+                                   "%.0f" % total_rate if total_rate else "-"))
+    return results
+
+
+def ingest_order_check(csv_paths: list, mode: str = IngestMode.row):
+    """
+    It checks that the daily aggregates of chain_summary don't depend on the order the bhavcopies are loaded in.
+    Files are loaded latest day first in the benchmark database, see _benchmark_database, and the stored aggregates
+    are compared with the aggregates of all the FO data.
+    :param csv_paths: list
+            Paths to the csv files i.e. FO bhavcopies of different days
+    :param mode: str
+            Mode for loading the data. Possible values in IngestMode.
+    :return: bool
+            True if every day is summarized and the aggregates are same
+    """
+    paths = sorted(csv_paths, key=lambda csv_path: data_insertion._file_days(csv_path)[0], reverse=True)
+    with _benchmark_database():
+        database_connection.bulk_entries(truncate=True)
+        chain_summary.clear()
+        for csv_path in paths:
+            data_insertion._insert_csv(csv_path, mode)
+        days = database_connection.execute_simple_query("SELECT DISTINCT timestamp FROM %s" %
+                                                        database_connection.table_name)
+        stored = chain_summary.summarize(database_connection.execute_typed_query("SELECT %s FROM %s" % (
+            ", ".join(chain_summary.source_fields), database_connection.table_name), chain_summary.source_fields))
+        loaded = pd.concat([chain_summary.load_summary(symbol) for symbol in stored.symbol.unique()])
+
+    loaded = loaded.sort_values(['symbol', 'expiry', 'timestamp']).reset_index(drop=True)
+    missing = set(row[0] for row in days) - set(loaded.timestamp)
+    stored['expiry'] = stored.expiry.values.astype('datetime64[D]').tolist()
+    stored['timestamp'] = stored.timestamp.values.astype('datetime64[D]').tolist()
+    same = len(loaded) == len(stored) and loaded.astype(object).where(loaded.notna(), None).equals(
+        stored.astype(object).where(stored.notna(), None))
+    print("Files loaded latest first: %s, days missing from the summary: %s, aggregates same: %s" % (
+        len(paths), sorted(missing), same))
+    return not missing and same
+
+
+def greeks_benchmark(contracts: int = 2000, spot: float = 10300.0, calculation_date: date = date(2018, 10, 3)):
+    """
+    It compares black_scholes.chain_greeks with option_greeks.get_greeks on a synthetic option chain.
+    Reports the time taken by both and the largest relative difference for each of the results.
+    :param contracts: int
+            Number of options in the chain
+    :param spot: float
+            Price of the underlying
+    :param calculation_date: date
+            Observation date
+    :return: dict
+            Key is the result name and value is the largest relative difference
+    """
+    random = numpy.random.RandomState(0)
+    strike = (numpy.round(spot / 100) + random.randint(-15, 16, contracts)) * 100.0
+    option_type = numpy.where(random.rand(contracts) < 0.5, Keys.call, Keys.put)
+    expiry = numpy.array([calculation_date + timedelta(days=int(days)) for days in random.randint(1, 90, contracts)])
+    tau = black_scholes.year_fraction(expiry, calculation_date)
+    volatility = random.uniform(0.08, 0.6, contracts)
+    price = numpy.round(black_scholes.price(spot, strike, tau, volatility, black_scholes.is_call(option_type)), 2)
+
+    start_time = time.time()
+    vectorized = black_scholes.chain_greeks(spot, strike, expiry, option_type, price, calculation_date)
+    vectorized_time = time.time() - start_time
+
+    start_time = time.time()
+    quantlib = [option_greeks.get_greeks(spot, strike[i], expiry[i], option_type[i], price[i], calculation_date,
+                                         volatility=0.13) for i in range(contracts)]
+    quantlib_time = time.time() - start_time
+
+    solved = [i for i, values in enumerate(quantlib) if values[0] != "''"]
+    quantlib = numpy.array([quantlib[i] for i in solved], dtype=numpy.float64)
+    differences = {}
+    for j, name in enumerate(['iv', 'theta', 'gamma', 'delta', 'vega']):
+        expected = quantlib[:, j]
+        difference = numpy.abs(vectorized[j][solved] - expected) / numpy.maximum(numpy.abs(expected), 1e-8)
+        differences[name] = numpy.nanmax(difference)
+
+    print("Contracts: %s, solved by QuantLib: %s, solved by NumPy: %s" % (
+        contracts, len(solved), numpy.isfinite(vectorized[0]).sum()))
+    print("QuantLib: %.4f secs, NumPy: %.4f secs (%.0fx)" % (quantlib_time, vectorized_time,
+                                                              quantlib_time / vectorized_time))
+    for name, difference in differences.items():
+        print("Largest relative difference in %s: %.2e" % (name, difference))
+    return differences
+
+
+def _synthetic_rows(first_day: date, days: int, symbols: int, strikes: int):
+    """
+    It generates FO data similar to the bhavcopy for the query benchmark.
+    Every symbol has futures and options for three monthly expiries on every day.
+    :return: generator of List[tuple]
+            Rows for data_insertion.insert_query, one list for each day
+    """
+    random = numpy.random.RandomState(0)
+    strike_offsets = numpy.arange(strikes) - strikes // 2
+    for day in range(days):
+        timestamp = first_day + timedelta(days=day)
+        rows = []
+        for symbol_id in range(symbols):
+            symbol = "SYM%03d" % symbol_id
+            spot = 1000.0 * (symbol_id + 1)
+            for month in range(3):
+                expiry_month = (timestamp.month + month - 1) % 12 + 1
+                expiry_year = timestamp.year + (timestamp.month + month - 1) // 12
+                expiry = date(expiry_year, expiry_month, 25)
+                rows.append(("FUTSTK", symbol, expiry, 0, "XX", spot, spot, spot, spot, spot, 100, 1.0, 1000, 0,
+                             timestamp))
+                for strike in (spot + strike_offsets * spot / 100).astype(int).tolist():
+                    for option_type in (Keys.call, Keys.put):
+                        close = float(random.uniform(1, 100))
+                        rows.append(("OPTSTK", symbol, expiry, strike, option_type, close, close, close, close, close,
+                                     10, 1.0, int(random.randint(0, 10000)), 0, timestamp))
+        yield rows
+
+
+def query_benchmark(days: int = 750, symbols: int = 20, strikes: int = 30, repeat: int = 3,
+                    populate: bool = True):
+    """
+    It compares the analytics queries before and after the schema migration.
+    A table with the old schema is filled with synthetic data (days * symbols * 3 * (2 * strikes + 1) rows,
+    about 2.7 million by default) in the benchmark database. The old MONTH()/YEAR() queries are timed on it,
+    then database_connection.migrate_schema is run and the range queries of database_connection.fo_query are timed.
+    It runs on the MySQL and the SQLite backends, the old queries use the date functions of each.
+    :param days: int
+            Number of days of synthetic data
+    :param symbols: int
+            Number of symbols
+    :param strikes: int
+            Number of strikes for each expiry
+    :param repeat: int
+            Number of runs for each query. Best run is reported.
+    :param populate: bool
+            If False, the table already filled by an earlier run is used.
+    :return: tuple(float, float)
+            Best time in seconds of the old and the new query
+    """
+    with _benchmark_database():
+        backend_name = database_connection.get_backend().name
+        if populate:
+            database_connection._check_database()
+            with database_connection.cursor(commit=True) as cur:
+                cur.execute("DROP TABLE IF EXISTS %s" % database_connection.table_name)
+                cur.execute(legacy_table_queries[backend_name] % database_connection.table_name)
+            start_time = time.time()
+            total_rows = 0
+            for rows in _synthetic_rows(date(2016, 1, 1), days, symbols, strikes):
+                total_rows += database_connection.insert_many(data_insertion.insert_query, rows)
+            print("Rows inserted: %s in %.1f secs" % (total_rows, time.time() - start_time))
+
+        symbol, month, year = "SYM007", 10, 2017
+        before = _time_query(legacy_queries[backend_name] % (database_connection.table_name, symbol,
+                                                             Instrument.option, month, year), repeat)
+        print("Migrating schema...")
+        start_time = time.time()
+        database_connection.migrate_schema()
+        print("Migration took %.1f secs" % (time.time() - start_time))
+        after = _time_query(database_connection.fo_query(symbol, Instrument.option, month, year), repeat)
+
+    print("Before: %.4f secs, After: %.4f secs (%.0fx)" % (before, after, before / after if after else 0))
+    return before, after
+
+
+def _time_query(query: str, repeat: int):
+    """
+    It prints the plan of the query and returns the best time of the runs.
+    :param query: str
+            SQL query
+    :param repeat: int
+            Number of runs
+    :return: float
+            Best time in seconds
+    """
+    with database_connection.cursor() as cur:
+        if database_connection.get_backend().name == 'sqlite':
+            cur.execute("EXPLAIN QUERY PLAN " + query)
+            for row in cur.fetchall():
+                print("Plan: %s" % row[-1])
+        else:
+            cur.execute("EXPLAIN " + query)
+            names = [column[0] for column in cur.description]
+            for row in cur.fetchall():
+                plan = dict(zip(names, row))
+                print("Plan: type=%s key=%s rows=%s" % (plan.get('type'), plan.get('key'), plan.get('rows')))
+    best = None
+    for _ in range(repeat):
+        start_time = time.time()
+        with database_connection.cursor() as cur:
+            cur.execute(query)
+            rows = len(cur.fetchall())
+        elapsed = time.time() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    print("%s rows in %.4f secs: %s" % (rows, best, query))
+    return best
+
+
+def _loop_max_pain(strikes: list, call_oi: list, put_oi: list):
+    """
+    Pain of every strike of a day with Python loops, the way option_strategy.max_pain did it.
+    :return: List[float]
+    """
+    values = []
+    for settle in strikes:
+        call_money = sum(oi * (settle - strike) for strike, oi in zip(strikes, call_oi) if settle > strike)
+        put_money = sum(oi * (strike - settle) for strike, oi in zip(strikes, put_oi) if strike > settle)
+        values.append(call_money + put_money)
+    return values
+
+
+def max_pain_benchmark(days: int = 250, strikes: int = 100):
+    """
+    It compares max_pain_engine.max_pain with the Python loops on a synthetic option chain.
+    :param days: int
+            Number of days
+    :param strikes: int
+            Number of strikes listed every day
+    :return: tuple(float, float)
+            Time in seconds of the loops and of the engine
+    """
+    random = numpy.random.RandomState(0)
+    strike_list = (10000 + 50 * (numpy.arange(strikes) - strikes // 2)).tolist()
+    call_oi = random.randint(0, 100000, (days, strikes))
+    put_oi = random.randint(0, 100000, (days, strikes))
+
+    start_time = time.time()
+    expected = [_loop_max_pain(strike_list, call_oi[day].tolist(), put_oi[day].tolist()) for day in range(days)]
+    loop_time = time.time() - start_time
+
+    timestamp = numpy.repeat(numpy.datetime64('2018-01-01') + numpy.arange(days), 2 * strikes)
+    strike = numpy.tile(numpy.array(strike_list * 2), days)
+    option_type = numpy.tile(numpy.repeat([Keys.call, Keys.put], strikes), days)
+    open_int = numpy.hstack([call_oi, put_oi]).ravel()
+    start_time = time.time()
+    values = max_pain_engine.max_pain(timestamp, strike, option_type, open_int)
+    engine_time = time.time() - start_time
+
+    difference = numpy.max(numpy.abs(values.pain - numpy.array(expected)))
+    print("Loops: %.4f secs, Engine: %.4f secs (%.0fx), largest difference: %s" % (
+        loop_time, engine_time, loop_time / engine_time if engine_time else 0, difference))
+    return loop_time, engine_time
+
+
+def pcr_benchmark(days: int = 250, expiries: int = 3, strikes: int = 100):
+    """
+    It compares pcr_engine.pcr with filtering a DataFrame for every day and expiry, the way
+    option_strategy.put_call_ratio did it, on a synthetic option chain.
+    :param days: int
+            Number of days
+    :param expiries: int
+            Number of expiries listed every day
+    :param strikes: int
+            Number of strikes listed for every expiry
+    :return: tuple(float, float)
+            Time in seconds of the loops and of the engine
+    """
+    random = numpy.random.RandomState(0)
+    rows = days * expiries * strikes * 2
+    day = numpy.repeat(numpy.datetime64('2018-01-01') + numpy.arange(days), expiries * strikes * 2)
+    options = {
+        'symbol': numpy.full(rows, 'NIFTY'),
+        'timestamp': day,
+        'expiry': day + numpy.tile(numpy.repeat(30 * (numpy.arange(expiries) + 1), strikes * 2), days),
+        'strike': numpy.tile(10000 + 50 * (numpy.arange(strikes) - strikes // 2), days * expiries * 2),
+        'option_typ': numpy.tile(numpy.repeat([Keys.call, Keys.put], strikes), days * expiries),
+        'open_int': random.randint(1, 100000, rows),
+        'contracts': random.randint(1, 10000, rows),
+    }
+    futures = {'symbol': numpy.full(days, 'NIFTY'), 'timestamp': numpy.unique(day),
+               'expiry': numpy.unique(day) + 30, 'close': numpy.full(days, 10000.0)}
+
+    df = pd.DataFrame(options)
+    start_time = time.time()
+    expected = []
+    for ts in df.timestamp.unique():
+        day_data = df[df.timestamp.isin([ts])]
+        for expiry in day_data.expiry.unique():
+            expiry_data = day_data[day_data.expiry.isin([expiry])]
+            call_oi = expiry_data[expiry_data.option_typ.isin([Keys.call])].open_int.sum()
+            put_oi = expiry_data[expiry_data.option_typ.isin([Keys.put])].open_int.sum()
+            expected.append(put_oi / call_oi)
+    loop_time = time.time() - start_time
+
+    start_time = time.time()
+    values = pcr_engine.pcr(options, futures)
+    engine_time = time.time() - start_time
+
+    difference = numpy.max(numpy.abs(values.oi_pcr - numpy.array(expected)))
+    print("Loops: %.4f secs, Engine: %.4f secs (%.0fx), largest difference: %s" % (
+        loop_time, engine_time, loop_time / engine_time if engine_time else 0, difference))
+    return loop_time, engine_time
+
+
+def delta_iv_benchmark(days: int = 250, strikes: int = 100, targets: list = None):
+    """
+    It compares delta_iv.delta_iv with filtering and sorting a DataFrame for every day and delta, the way
+    vol_analytics.delta_iv_analysis did it, on a synthetic option chain.
+    :param days: int
+            Number of days
+    :param strikes: int
+            Number of strikes listed every day
+    :param targets: list
+            Delta targets. Defaults to delta_iv.default_targets.
+    :return: tuple(float, float)
+            Time in seconds of the loops and of the engine
+    """
+    targets = targets if targets else delta_iv.default_targets
+    random = numpy.random.RandomState(0)
+    rows = days * strikes * 2
+    call_delta = numpy.sort(random.rand(days, strikes), axis=1)[:, ::-1]
+    df = pd.DataFrame({
+        'timestamp': numpy.repeat(numpy.datetime64('2018-01-01') + numpy.arange(days), 2 * strikes),
+        'strike': numpy.tile(10000 + 50 * (numpy.arange(2 * strikes) % strikes - strikes // 2), days),
+        'option_typ': numpy.tile(numpy.repeat([Keys.call, Keys.put], strikes), days),
+        'delta': numpy.hstack([call_delta, call_delta - 1]).ravel(),
+        'iv': 10 + 20 * random.rand(rows),
+    })
+
+    start_time = time.time()
+    for target in targets:
+        for ts in df.timestamp.unique():
+            day_df = df[df.timestamp == ts]
+            for option_type, sign in ((Keys.call, 1), (Keys.put, -1)):
+                option_df = day_df[day_df.option_typ == option_type]
+                option_df.iloc[(option_df.delta - sign * target).abs().argsort()[:1]]
+    loop_time = time.time() - start_time
+
+    start_time = time.time()
+    delta_iv.delta_iv(df.timestamp.values, df.strike.values, df.option_typ.values, df.delta.values, df.iv.values,
+                      targets)
+    engine_time = time.time() - start_time
+    print("Loops: %.4f secs, Engine: %.4f secs (%.0fx)" % (
+        loop_time, engine_time, loop_time / engine_time if engine_time else 0))
+    return loop_time, engine_time
+
+
+def backtest_benchmark(days: int = 60, strikes: int = 100, strategies: int = 200):
+    """
+    It compares backtest_engine with filtering the chain for every leg of every strategy, the way
+    option_strategy.options_strategy did it, on a synthetic expiry of straddles.
+    :param days: int
+            Number of days
+    :param strikes: int
+            Number of strikes listed every day
+    :param strategies: int
+            Number of straddles backtested
+    :return: tuple(float, float)
+            Time in seconds of the loops and of the engine
+    """
+    random = numpy.random.RandomState(0)
+    days_list = [date(2018, 1, 1) + timedelta(days=day) for day in range(days)]
+    strike_list = 10000 + 50 * (numpy.arange(strikes) - strikes // 2)
+    df = pd.DataFrame({
+        'timestamp': numpy.repeat(days_list, 2 * strikes),
+        'strike': numpy.tile(numpy.tile(strike_list, 2), days),
+        'option_typ': numpy.tile(numpy.repeat([Keys.call, Keys.put], strikes), days),
+        'close': 100 * random.rand(days * 2 * strikes),
+    })
+    legs = [[StrikeEntry(strike, option_type, Keys.sell) for option_type in (Keys.call, Keys.put)]
+            for strike in random.choice(strike_list, strategies)]
+
+    start_time = time.time()
+    for strategy in legs:
+        for leg in strategy:
+            strike_df = df[(df.strike == leg.strike) & (df.option_typ == leg.option_type)]
+            init_price = strike_df[strike_df.timestamp == days_list[0]].close.values[0]
+            [-(row.close - init_price) for row in strike_df.itertuples()]
+    loop_time = time.time() - start_time
+
+    start_time = time.time()
+    matrix = backtest_engine.price_matrix(df.timestamp.values, df.strike.values, df.option_typ.values,
+                                          df.close.values)
+    columns, quantity = backtest_engine.strategy_legs(matrix, legs)
+    backtest_engine.backtest(matrix, columns, quantity, days_list[0])
+    engine_time = time.time() - start_time
+    print("Loops: %.4f secs, Engine: %.4f secs (%.0fx)" % (
+        loop_time, engine_time, loop_time / engine_time if engine_time else 0))
+    return loop_time, engine_time
+
+
+if __name__ == '__main__':
+    ingest_benchmark('C:/Users/sb/Downloads/niftyoptionsdata/extracted/fo23OCT2018bhav.csv')
@@ -0,0 +1,279 @@
+import numpy
+
+from constants import Keys
+
+"""
+Definitions written in this file are vectorized Black-Scholes and Black-76 formulas based on NumPy.
+Inputs can be arrays or scalars, they are broadcast against each other and results are arrays.
+Volatility and rate are in decimals, time to expiry is in years (Actual/365).
+With futures=False the underlying is priced like QuantLib's BlackScholesProcess i.e. cost of carry is the rate.
+With futures=True the underlying is a futures price i.e. Black-76 with zero cost of carry.
+"""
+
+days_in_year = 365.0
+# Bounds of the implied volatility search, same as used by option_greeks.get_greeks
+min_vol = 0.001
+max_vol = 1000.0
+price_tolerance = 1e-8
+max_iterations = 100
+
+
+def norm_cdf(x):
+    """
+    Cumulative distribution function of the standard normal distribution.
+    Hart's double precision algorithm as given by West (2005), accurate to about 1e-14.
+    :param x: array
+    :return: array
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    x_abs = numpy.abs(x)
+    exponential = numpy.exp(-x_abs * x_abs / 2)
+
+    numerator = 3.52624965998911e-02 * x_abs + 0.700383064443688
+    numerator = numerator * x_abs + 6.37396220353165
+    numerator = numerator * x_abs + 33.912866078383
+    numerator = numerator * x_abs + 112.079291497871
+    numerator = numerator * x_abs + 221.213596169931
+    numerator = numerator * x_abs + 220.206867912376
+    denominator = 8.83883476483184e-02 * x_abs + 1.75566716318264
+    denominator = denominator * x_abs + 16.064177579207
+    denominator = denominator * x_abs + 86.7807322029461
+    denominator = denominator * x_abs + 296.564248779674
+    denominator = denominator * x_abs + 637.333633378831
+    denominator = denominator * x_abs + 793.826512519948
+    denominator = denominator * x_abs + 440.413735824752
+    near = exponential * numerator / denominator
+
+    fraction = x_abs + 0.65
+    fraction = x_abs + 1 / fraction
+    fraction = x_abs + 2 / fraction
+    fraction = x_abs + 3 / fraction
+    fraction = x_abs + 4 / fraction
+    far = exponential / fraction / 2.506628274631
+
+    tail = numpy.where(x_abs < 7.07106781186547, near, far)
+    tail = numpy.where(x_abs > 37, 0.0, tail)
+    return numpy.where(x > 0, 1 - tail, tail)
+
+
+def norm_pdf(x):
+    """
+    Probability density function of the standard normal distribution.
+    :param x: array
+    :return: array
+    """
+    x = numpy.asarray(x, dtype=numpy.float64)
+    return numpy.exp(-x * x / 2) / numpy.sqrt(2 * numpy.pi)
+
+
+def year_fraction(expiry_date, calculation_date):
+    """
+    It returns the time to expiry in years (Actual/365).
+    :param expiry_date: date or array
+            Expiry dates. date objects or datetime64 values.
+    :param calculation_date: date or array
+            Observation dates. date objects or datetime64 values.
+    :return: array
+            Time to expiry in years
+    """
+    expiry_date = numpy.asarray(expiry_date, dtype='datetime64[D]')
+    calculation_date = numpy.asarray(calculation_date, dtype='datetime64[D]')
+    return (expiry_date - calculation_date).astype(numpy.float64) / days_in_year
+
+
+def is_call(option_type):
+    """
+    It converts option types to a boolean array.
+    :param option_type: str or array
+            Type of option. Possible values: CE, PE
+    :return: array
+            True for calls
+    """
+    return numpy.asarray(option_type) == Keys.call
+
+
+def _d1_d2(spot, strike, tau, vol, carry):
+    """
+    Helper function for d1 and d2 of the Black-Scholes formula
+    :return: tuple(array, array)
+    """
+    vol_sqrt_tau = vol * numpy.sqrt(tau)
+    d1 = (numpy.log(spot / strike) + (carry + vol * vol / 2) * tau) / vol_sqrt_tau
+    return d1, d1 - vol_sqrt_tau
+
+
+def price(spot, strike, tau, vol, call, rate: float = 0.0, futures: bool = False):
+    """
+    It is used to find the theoretical price of the options.
+    :param spot: array
+            (S) Spot or futures price
+    :param strike: array
+            (K) Strike price
+    :param tau: array
+            (T) Time to expiry in years
+    :param vol: array
+            (sigma) Annualised volatility
+    :param call: array
+            True for calls and False for puts. See is_call.
+    :param rate: float or array
+            (r) Risk free interest rate
+    :param futures: bool
+            If True, spot is a futures price and Black-76 is used.
+    :return: array
+            Option prices
+    """
+    spot, strike, tau, vol, rate = [numpy.asarray(value, dtype=numpy.float64) for value in
+                                    (spot, strike, tau, vol, rate)]
+    carry = numpy.zeros_like(rate) if futures else rate
+    d1, d2 = _d1_d2(spot, strike, tau, vol, carry)
+    discount = numpy.exp(-rate * tau)
+    forward = spot * numpy.exp(carry * tau)
+    call_price = discount * (forward * norm_cdf(d1) - strike * norm_cdf(d2))
+    put_price = discount * (strike * norm_cdf(-d2) - forward * norm_cdf(-d1))
+    return numpy.where(call, call_price, put_price)
+
+
+def vega(spot, strike, tau, vol, rate: float = 0.0, futures: bool = False):
+    """
+    It is used to find the vega of the options. It is same for calls and puts.
+    Parameters are same as price.
+    :return: array
+            Change in price for a change of 1.0 in volatility
+    """
+    spot, strike, tau, vol, rate = [numpy.asarray(value, dtype=numpy.float64) for value in
+                                    (spot, strike, tau, vol, rate)]
+    carry = numpy.zeros_like(rate) if futures else rate
+    d1, _ = _d1_d2(spot, strike, tau, vol, carry)
+    return spot * numpy.exp((carry - rate) * tau) * norm_pdf(d1) * numpy.sqrt(tau)
+
+
+def greeks(spot, strike, tau, vol, call, rate: float = 0.0, futures: bool = False):
+    """
+    It is used to find the option greeks. Parameters are same as price.
+    Units are same as QuantLib i.e. theta is per year and vega, rho are for a change of 1.0.
+    :return: tuple(array, array, array, array, array)
+            Returns delta, gamma, theta, vega, rho
+    """
+    spot, strike, tau, vol, rate = [numpy.asarray(value, dtype=numpy.float64) for value in
+                                    (spot, strike, tau, vol, rate)]
+    carry = numpy.zeros_like(rate) if futures else rate
+    sqrt_tau = numpy.sqrt(tau)
+    d1, d2 = _d1_d2(spot, strike, tau, vol, carry)
+    discount = numpy.exp(-rate * tau)
+    carry_discount = numpy.exp((carry - rate) * tau)
+    pdf_d1 = norm_pdf(d1)
+    cdf_d1, cdf_d2 = norm_cdf(d1), norm_cdf(d2)
+    cdf_minus_d1, cdf_minus_d2 = norm_cdf(-d1), norm_cdf(-d2)
+
+    delta = numpy.where(call, carry_discount * cdf_d1, -carry_discount * cdf_minus_d1)
+    gamma = carry_discount * pdf_d1 / (spot * vol * sqrt_tau)
+    vega_value = spot * carry_discount * pdf_d1 * sqrt_tau
+
+    decay = -spot * carry_discount * pdf_d1 * vol / (2 * sqrt_tau)
+    call_theta = decay - (carry - rate) * spot * carry_discount * cdf_d1 - rate * strike * discount * cdf_d2
+    put_theta = decay + (carry - rate) * spot * carry_discount * cdf_minus_d1 + rate * strike * discount * cdf_minus_d2
+    theta = numpy.where(call, call_theta, put_theta)
+
+    if futures:
+        # Futures price doesn't depend on the rate, only the discounting does
+        rho = -tau * price(spot, strike, tau, vol, call, rate, futures)
+    else:
+        rho = numpy.where(call, strike * tau * discount * cdf_d2, -strike * tau * discount * cdf_minus_d2)
+    return delta, gamma, theta, vega_value, rho
+
+
+def implied_vol(option_price, spot, strike, tau, call, rate: float = 0.0, futures: bool = False,
+                tolerance: float = price_tolerance, iterations: int = max_iterations):
+    """
+    It solves the implied volatility for all the options at once.
+    Newton's method is used while it stays within the bracket [min_vol, max_vol] narrowed on every iteration,
+    otherwise the step falls back to bisection of the bracket.
+    Options priced within the tolerance of the price at min_vol get min_vol.
+    Options priced below the price at min_vol (e.g. below intrinsic value) or above the price at max_vol, or which
+    are expired, get NaN like QuantLib fails to solve them.
+    :param option_price: array
+            Price of the options
+    :param tolerance: float
+            Accepted error in the price, relative to the price for prices above 1.
+    :param iterations: int
+            Maximum number of iterations. Options not converged by then get NaN.
+    Other parameters are same as price.
+    :return: array
+            Implied volatility in decimals
+    """
+    target, spot, strike, tau, call, rate = numpy.broadcast_arrays(
+        *[numpy.asarray(value, dtype=numpy.float64) for value in (option_price, spot, strike, tau, call, rate)])
+    shape = target.shape
+    target, spot, strike, tau, rate = [value.ravel().copy() for value in (target, spot, strike, tau, rate)]
+    call = call.ravel() != 0
+
+    iv = numpy.full(target.shape, numpy.nan)
+    valid = numpy.isfinite(target) & numpy.isfinite(spot) & (target >= 0) & (spot > 0) & (strike > 0) & (tau > 0)
+    lower = numpy.full(target.shape, min_vol)
+    upper = numpy.full(target.shape, max_vol)
+    with numpy.errstate(all='ignore'):
+        valid &= price(spot, strike, tau, upper, call, rate, futures) >= target
+        # No time value left to solve for, volatility is the lower bound. Prices further below have no solution.
+        floor_diff = price(spot, strike, tau, lower, call, rate, futures) - target
+        floor_tolerance = tolerance * numpy.maximum(1.0, target)
+        floor = valid & (numpy.abs(floor_diff) <= floor_tolerance)
+        iv[floor] = min_vol
+        valid &= ~floor & (floor_diff < 0)
+
+        # Brenner-Subrahmanyam approximation as the initial guess
+        vol = numpy.clip(numpy.sqrt(2 * numpy.pi / numpy.where(tau > 0, tau, 1)) * target / spot, 0.05, 2.0)
+        index = numpy.flatnonzero(valid)
+        for _ in range(iterations):
+            if index.size == 0:
+                break
+            s, k, t, v, r, c = spot[index], strike[index], tau[index], vol[index], rate[index], call[index]
+            diff = price(s, k, t, v, c, r, futures) - target[index]
+            converged = numpy.abs(diff) <= tolerance * numpy.maximum(1.0, target[index])
+            iv[index[converged]] = v[converged]
+
+            # Price increases with the volatility, so the sign of the error narrows the bracket
+            upper[index] = numpy.where(diff > 0, v, upper[index])
+            lower[index] = numpy.where(diff < 0, v, lower[index])
+            lo, hi = lower[index], upper[index]
+            step = v - diff / vega(s, k, t, v, r, futures)
+            bisection = numpy.sqrt(lo * hi)
+            vol[index] = numpy.where(numpy.isfinite(step) & (step > lo) & (step < hi), step, bisection)
+
+            # Bracket can't be narrowed any further in double precision
+            exhausted = ~converged & (hi - lo <= 1e-15 * hi)
+            iv[index[exhausted]] = vol[index[exhausted]]
+            index = index[~converged & ~exhausted]
+    return iv.reshape(shape)
+
+
+def chain_greeks(spot, strike, expiry_date, option_type, option_price, calculation_date, rate: float = 0.0,
+                 futures: bool = False):
+    """
+    It is used to find the greeks of a whole option chain at once.
+    Results are based on the implied volatility found using option price, same as option_greeks.get_greeks.
+    :param spot: array
+            (S) Spot price of the underlying for each option
+    :param strike: array
+            (K) Strike price
+    :param expiry_date: array
+            (T) Expiry dates. date objects or datetime64 values.
+    :param option_type: array
+            Type of option. Possible values: CE, PE
+    :param option_price: array
+            Price of the options
+    :param calculation_date: date or array
+            Observation date
+    :param rate: float
+            (r) Risk free interest rate
+    :param futures: bool
+            If True, spot is a futures price and Black-76 is used.
+    :return: tuple(array, array, array, array, array, array)
+            Returns implied volatility (in %), theta (per day), gamma, delta, vega, rho.
+            Values are NaN where the implied volatility couldn't be found.
+    """
+    tau = year_fraction(expiry_date, calculation_date)
+    call = is_call(option_type)
+    iv = implied_vol(option_price, spot, strike, tau, call, rate, futures)
+    with numpy.errstate(all='ignore'):
+        delta, gamma, theta, vega_value, rho = greeks(spot, strike, tau, iv, call, rate, futures)
+    return iv * 100, theta / days_in_year, gamma, delta, vega_value, rho
@@ -0,0 +1,139 @@
+import os
+import shutil
+import time
+
+import pandas as pd
+import pyarrow
+import pyarrow.feather as feather
+
+import database_connection as dbc
+
+"""
+Local columnar cache of the FO data used by the analytics.
+Data is partitioned by symbol, expiry month and instrument class and kept as uncompressed Arrow IPC files,
+which are memory-mapped when read. Partitions are removed by data_insertion when new data is inserted.
+"""
+
+cache_dir = 'cache/'
+# If False, data is always read from the database
+enabled = True
+all_expiries = 'all'
+
+
+def _partition_dir(symbol: str, expiry_month: int = None, expiry_year: int = None):
+    """
+    It returns the directory of a partition.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param expiry_month: int
+            Expiry month. If None, partition with all the expiries of the symbol.
+    :param expiry_year: int
+            Year of the expiry month.
+    :return: str
+    """
+    expiry = "%04d-%02d" % (expiry_year, expiry_month) if expiry_month is not None else all_expiries
+    return os.path.join(cache_dir, symbol.upper(), expiry)
+
+
+def load(symbol: str, instrument: str, expiry_month: int = None, expiry_year: int = None, fields: list = None,
+         typed: bool = False):
+    """
+    It returns the FO data of a symbol from the cache. Data is read from the database and cached if not present.
+    Rows are sorted on timestamp and id.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param instrument: str
+            Instrument class. Possible values in Instrument.
+    :param expiry_month: int
+            Expiry month. If None, all the expiries are returned.
+    :param expiry_year: int
+            Year of the expiry month.
+    :param fields: list
+            Columns to be returned. If None, all the columns in database_connection.columns are returned.
+            Only these columns are read from the partition file.
+    :param typed: bool
+            If True, columns have the types of database_connection.column_types i.e. datetime64 dates and
+            categorical strings. Otherwise dates are date objects and strings are objects.
+    :return: DataFrame
+    """
+    fields = fields if fields else dbc.columns
+    path = os.path.join(_partition_dir(symbol, expiry_month, expiry_year), "%s.arrow" % instrument)
+    if enabled and not os.path.isfile(path):
+        # Partition is always cached with all the columns, so that it serves any projection
+        _write(path, dbc.fetch(symbol, instrument, expiry_month=expiry_month, expiry_year=expiry_year,
+                               order_by='timestamp, id'))
+    if not enabled:
+        df = dbc.fetch(symbol, instrument, fields, expiry_month=expiry_month, expiry_year=expiry_year,
+                       order_by='timestamp, id')
+        return df if typed else _untyped(pyarrow.Table.from_pandas(df, preserve_index=False))
+
+    start_time = time.time()
+    table = feather.read_table(path, columns=fields, memory_map=True)
+    df = _typed(table) if typed else _untyped(table)
+    print("Cache read in: %s secs" % (time.time() - start_time))
+    return df
+
+
+def _typed(table: pyarrow.Table):
+    """
+    It converts a partition to a DataFrame with the types of database_connection.column_types.
+    :param table: Table
+    :return: DataFrame
+    """
+    df = table.to_pandas(date_as_object=False)
+    for field in df.columns:
+        if dbc.column_types.get(field, '').startswith('datetime64'):
+            df[field] = df[field].astype(dbc.column_types[field])
+    return df
+
+
+def _untyped(table: pyarrow.Table):
+    """
+    It converts a partition to a DataFrame with date objects and plain strings, as returned by the database.
+    :param table: Table
+    :return: DataFrame
+    """
+    for i, field in enumerate(table.schema):
+        if pyarrow.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(field.type.value_type))
+        elif pyarrow.types.is_timestamp(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pyarrow.date32()))
+    return table.to_pandas(date_as_object=True)
+
+
+def _write(path: str, df: pd.DataFrame):
+    """
+    It writes a partition. File is written under a temporary name and renamed, so readers never see a partial file.
+    :param path: str
+            Path to the partition file
+    :param df: DataFrame
+            Data of the partition, as returned by database_connection.fetch
+    :return: None
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = "%s.%s.tmp" % (path, os.getpid())
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    # Dates are kept as date32, they have no time of the day
+    for i, field in enumerate(table.schema):
+        if pyarrow.types.is_timestamp(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pyarrow.date32()))
+    feather.write_feather(table, temp_path, compression='uncompressed')
+    os.replace(temp_path, path)
+
+
+def invalidate(partitions=None):
+    """
+    It removes partitions from the cache.
+    :param partitions: iterable of tuple(str, date)
+            Symbol and expiry of the data which changed. Partition of the expiry month and the partition with all
+            the expiries of the symbol are removed. If None, whole cache is removed.
+    :return: None
+    """
+    if partitions is None:
+        if os.path.isdir(cache_dir):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+        return
+    for symbol, expiry in set(partitions):
+        for partition in (_partition_dir(symbol, expiry.month, expiry.year), _partition_dir(symbol)):
+            if os.path.isdir(partition):
+                shutil.rmtree(partition, ignore_errors=True)
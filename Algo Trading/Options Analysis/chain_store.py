@@ -0,0 +1,89 @@
+import numpy
+
+import chain_cache
+from constants import Instrument
+from model import OptionChain, chain_dtype
+
+"""
+In-memory store of the option chains of a symbol, indexed on expiry, timestamp, option type and strike.
+Options are read from chain_cache one expiry month at a time, when an expiry of the month is first asked for.
+Options of each expiry are kept in one structured array sorted on timestamp, option type and strike along with the
+position where each day starts, so the chain of a day is a single slice of the array.
+"""
+
+# Columns read from the cache, a subset of model.chain_dtype
+store_fields = ['expiry', 'timestamp', 'strike', 'option_typ', 'open', 'high', 'low', 'close', 'settle_pr',
+                'contracts', 'open_int', 'chg_in_oi', 'iv', 'delta', 'gamma', 'theta', 'vega']
+
+
+class ChainStore:
+    """
+    This is used to get the option chains of a symbol without filtering its whole history.
+    """
+
+    def __init__(self, symbol: str):
+        """
+        It creates an empty store, nothing is read till a chain is asked for.
+        :param symbol: str
+                    Symbol e.g. NIFTY
+        """
+        self.symbol = symbol.upper()
+        # Expiry -> (days in ascending order, position where each day starts and ends, options)
+        self._expiries = {}
+        # Expiry months already read, as datetime64[M]
+        self._months = set()
+
+    def _load(self, expiry):
+        """
+        It reads the expiry month of an expiry from the cache, if not read already, and indexes all of its expiries.
+        :param expiry: datetime64[D]
+        :return: None
+        """
+        month = expiry.astype('datetime64[M]')
+        if month in self._months:
+            return
+        month_date = month.astype('datetime64[D]').item()
+        df = chain_cache.load(self.symbol, Instrument.option, month_date.month, month_date.year, fields=store_fields,
+                              typed=True)
+        data = OptionChain.records(df)
+        data = data[numpy.lexsort((data['strike'], data['option_typ'], data['timestamp'], data['expiry']))]
+        expiries, expiry_start = numpy.unique(data['expiry'], return_index=True)
+        for i, month_expiry in enumerate(expiries):
+            options = data[expiry_start[i]:expiry_start[i + 1] if i + 1 < len(expiries) else len(data)]
+            days, day_start = numpy.unique(options['timestamp'], return_index=True)
+            self._expiries[month_expiry] = (days, numpy.append(day_start, len(options)), options)
+        self._months.add(month)
+
+    def days(self, expiry):
+        """
+        It returns the days on which the options of an expiry are present.
+        :param expiry: date
+                    Expiry date. date object or datetime64 value.
+        :return: array
+                    Days in ascending order, datetime64[D]
+        """
+        expiry = numpy.datetime64(expiry, 'D')
+        self._load(expiry)
+        if expiry not in self._expiries:
+            return numpy.array([], dtype='datetime64[D]')
+        return self._expiries[expiry][0]
+
+    def chain(self, expiry, timestamp):
+        """
+        It returns the option chain of an expiry on a day.
+        :param expiry: date
+                    Expiry date. date object or datetime64 value.
+        :param timestamp: date
+                    Day of the chain. date object or datetime64 value.
+        :return: OptionChain
+                    Views of the options in the store, empty if the expiry is not present on the day
+        """
+        expiry, timestamp = numpy.datetime64(expiry, 'D'), numpy.datetime64(timestamp, 'D')
+        self._load(expiry)
+        if expiry not in self._expiries:
+            return OptionChain(numpy.zeros(0, dtype=chain_dtype), sort=False)
+        days, day_start, options = self._expiries[expiry]
+        position = numpy.searchsorted(days, timestamp)
+        if position == len(days) or days[position] != timestamp:
+            return OptionChain(options[:0], sort=False)
+        return OptionChain(options[day_start[position]:day_start[position + 1]], sort=False)
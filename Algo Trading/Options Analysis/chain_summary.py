@@ -0,0 +1,279 @@
+import time
+from datetime import date
+
+import numpy
+import pandas as pd
+
+import database_connection as dbc
+from constants import Instrument, Keys
+
+"""
+Definitions written in this file keep the daily aggregates of every option chain in the database.
+One row is kept for each symbol, expiry and day with the total open interest, volume and change in open interest of
+the calls and puts, the open interest and volume of the Out of Money options, the At the Money strike and the future
+of the expiry. It is filled by data_insertion as each bhavcopy is loaded, so the analytics read a few hundred rows from
+summary_table instead of scanning the FO table.
+"""
+
+summary_table = 'fo_chain_summary'
+summary_index = 'idx_summary_timestamp'
+summary_columns = ['symbol', 'expiry', 'timestamp', 'underlying', 'fut_close', 'fut_settle_pr', 'fut_open_int',
+                   'fut_chg_in_oi', 'fut_contracts', 'call_oi', 'put_oi', 'call_volume', 'put_volume',
+                   'call_chg_in_oi', 'put_chg_in_oi', 'otm_call_oi', 'otm_put_oi', 'otm_call_volume',
+                   'otm_put_volume', 'atm_strike']
+# Columns of the FO data needed for the aggregates
+source_fields = ['symbol', 'instrument_class', 'expiry', 'timestamp', 'strike', 'option_typ', 'close', 'settle_pr',
+                 'contracts', 'open_int', 'chg_in_oi']
+# Days summarized from the FO table in one query by update_summary
+days_per_query = 20
+
+
+def check_table():
+    """
+    This checks for the summary table in the database. If not present then it creates the table.
+    :return: None
+    """
+    backend = dbc.get_backend()
+    with dbc.cursor(commit=True) as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS %s (symbol varchar(30) NOT NULL, expiry date NOT NULL, "
+                    "timestamp date NOT NULL, underlying double, fut_close double, fut_settle_pr double, "
+                    "fut_open_int bigint, fut_chg_in_oi bigint, fut_contracts bigint, call_oi bigint, put_oi bigint, "
+                    "call_volume bigint, put_volume bigint, call_chg_in_oi bigint, put_chg_in_oi bigint, "
+                    "otm_call_oi bigint, otm_put_oi bigint, otm_call_volume bigint, otm_put_volume bigint, "
+                    "atm_strike int, "
+                    "PRIMARY KEY (symbol, expiry, timestamp))" % summary_table)
+        # Days are replaced as a whole
+        if summary_index not in backend.index_names(cur, summary_table):
+            cur.execute(backend.add_index_query(summary_table, summary_index, "(timestamp)"))
+
+
+def clear():
+    """
+    It removes all the aggregates, e.g. when the FO table is truncated.
+    :return: None
+    """
+    check_table()
+    with dbc.cursor(commit=True) as cur:
+        cur.execute(dbc.get_backend().truncate_query(summary_table))
+    print("Chain summary cleared")
+
+
+def summarize(df: pd.DataFrame):
+    """
+    It finds the aggregates of every symbol, expiry and day in the FO data.
+    Close of the future of the same symbol and expiry month on the day is taken as the underlying, so weekly expiries
+    have the underlying of their month. Options are Out of Money if calls are at or above and puts are at or below the
+    underlying. At the Money strike is the listed strike nearest to the underlying, lower one on ties.
+    :param df: DataFrame
+            Columns in source_fields. Dates are datetime64.
+    :return: DataFrame
+            Columns in summary_columns, sorted on symbol, expiry and timestamp. Missing values are NaN.
+    """
+    df = df.reset_index(drop=True)
+    keys = ['symbol', 'expiry', 'timestamp']
+    futures = df[df.instrument_class == Instrument.future]
+    options = df[(df.instrument_class == Instrument.option) & df.option_typ.isin([Keys.call, Keys.put])]
+
+    fut = futures.groupby(keys, sort=False).agg(fut_close=('close', 'max'), fut_settle_pr=('settle_pr', 'max'),
+                                                  fut_open_int=('open_int', 'sum'),
+                                                  fut_chg_in_oi=('chg_in_oi', 'sum'),
+                                                  fut_contracts=('contracts', 'sum'))
+    month = pd.DataFrame({'symbol': futures.symbol.values, 'timestamp': futures.timestamp.values,
+                          'month': futures.expiry.values.astype('datetime64[M]'), 'underlying': futures.close.values})
+    month = month.drop_duplicates(['symbol', 'timestamp', 'month'])
+    options = options.assign(month=options.expiry.values.astype('datetime64[M]')).merge(
+        month, how='left', on=['symbol', 'timestamp', 'month'])
+
+    call = (options.option_typ == Keys.call).values
+    put = ~call
+    # Comparisons with NaN are False, so options without the underlying are not Out of Money
+    otm_call = call & (options.strike.values >= options.underlying.values)
+    otm_put = put & (options.strike.values <= options.underlying.values)
+    open_int = options.open_int.values
+    sums = pd.DataFrame({
+        'call_oi': numpy.where(call, open_int, 0), 'put_oi': numpy.where(put, open_int, 0),
+        'call_volume': numpy.where(call, options.contracts.values, 0),
+        'put_volume': numpy.where(put, options.contracts.values, 0),
+        'call_chg_in_oi': numpy.where(call, options.chg_in_oi.values, 0),
+        'put_chg_in_oi': numpy.where(put, options.chg_in_oi.values, 0),
+        'otm_call_oi': numpy.where(otm_call, open_int, 0), 'otm_put_oi': numpy.where(otm_put, open_int, 0),
+        'otm_call_volume': numpy.where(otm_call, options.contracts.values, 0),
+        'otm_put_volume': numpy.where(otm_put, options.contracts.values, 0),
+    })
+    for key in keys:
+        sums[key] = options[key].values
+    opt = sums.groupby(keys, sort=False).sum()
+
+    # Nearest strike first in each chain
+    atm = options.assign(distance=(options.strike - options.underlying).abs()).dropna(subset=['distance'])
+    atm = atm.sort_values(keys + ['distance', 'strike']).drop_duplicates(keys).set_index(keys)
+    opt['underlying'] = atm.underlying
+    opt['atm_strike'] = atm.strike
+
+    summary = opt.join(fut, how='outer')
+    # Expiries with only the future have it as the underlying
+    summary['underlying'] = summary.underlying.fillna(summary.fut_close)
+    summary = summary.reset_index().sort_values(keys)
+    return summary.reindex(columns=summary_columns).reset_index(drop=True)
+
+
+def _rows(summary: pd.DataFrame):
+    """
+    It converts the aggregates to the rows for the parameterized insert query.
+    :param summary: DataFrame
+            As returned by summarize
+    :return: List[tuple]
+    """
+    values = []
+    for column in summary_columns:
+        series = summary[column]
+        if column == 'symbol':
+            values.append(series.astype(str).tolist())
+        elif column in ('expiry', 'timestamp'):
+            values.append(series.values.astype('datetime64[D]').tolist())
+        elif column in ('underlying', 'fut_close', 'fut_settle_pr'):
+            values.append([None if value != value else value for value in series.values.astype(float).tolist()])
+        else:
+            # Integer columns, NaN for the missing future or strike
+            values.append([None if value != value else int(value) for value in series.values.astype(float).tolist()])
+    return list(zip(*values))
+
+
+def _store_days(days: list, summary: pd.DataFrame):
+    """
+    It replaces the aggregates of the days.
+    :param days: list
+            Days to be replaced
+    :param summary: DataFrame
+            Aggregates of the days, as returned by summarize
+    :return: int
+            Number of rows stored
+    """
+    # Days are deleted and inserted in one transaction, so a failure doesn't leave them missing
+    with dbc.cursor(commit=True) as cur:
+        for data_date in days:
+            cur.execute("DELETE FROM %s WHERE timestamp = %%s" % summary_table, (data_date,))
+        return dbc.insert_many("INSERT INTO %s (%s) VALUES (%s)" % (summary_table, ", ".join(summary_columns),
+                                                                  ", ".join(["%s"] * len(summary_columns))),
+                               _rows(summary), cur=cur)
+
+
+def store(data: dict):
+    """
+    It replaces the aggregates of the days of a bhavcopy, summarized from its columns already read in memory.
+    :param data: dict
+            Columns of the bhavcopy, as returned by data_insertion._read_columns
+    :return: int
+            Number of rows stored
+    """
+    if len(data['timestamp']) == 0:
+        return 0
+    check_table()
+    df = pd.DataFrame({field: data[field] for field in source_fields if field != 'instrument_class'})
+    df['instrument_class'] = pd.Series(data['instrument']).str[:3].values
+    days = numpy.unique(data['timestamp']).astype('datetime64[D]').tolist()
+    return _store_days(days, summarize(df))
+
+
+def update_summary(restart: bool = False, days: list = None):
+    """
+    This summarizes days from the FO table, e.g. after rows were loaded without reading them in memory.
+    Files can be loaded in any order, so the days without aggregates are searched.
+    :param restart: bool
+            If True, all the days in the database are summarized again.
+    :param days: list
+            Days to be summarized again e.g. the days of a file just loaded. If None, the days in the FO table
+            without aggregates are summarized.
+    :return: int
+            Number of days updated
+    """
+    start_time = time.time()
+    if restart:
+        clear()
+    check_table()
+    if days is None:
+        query = "SELECT DISTINCT timestamp FROM %s WHERE timestamp NOT IN (SELECT timestamp FROM %s)" % (
+            dbc.table_name, summary_table)
+        days = [row[0] for row in dbc.execute_simple_query(query)]
+    days = sorted(days)
+    print("Days to summarize: %s" % len(days))
+
+    for i in range(0, len(days), days_per_query):
+        batch = days[i:i + days_per_query]
+        df = dbc.execute_typed_query("SELECT %s FROM %s WHERE timestamp BETWEEN '%s' AND '%s'" % (
+            ", ".join(source_fields), dbc.table_name, batch[0], batch[-1]), source_fields)
+        # Days in between which are not in the batch are left as they are
+        df = df[df.timestamp.isin(pd.to_datetime(batch))]
+        _store_days(batch, summarize(df))
+    print("Total time taken: %s secs" % (time.time() - start_time))
+    return len(days)
+
+
+def load_summary(symbol: str, expiry_month: int = None, expiry_year: int = None, start_date: date = None,
+                 end_date: date = None, monthly: bool = False):
+    """
+    It returns the stored aggregates of a symbol.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param expiry_month: int
+            Expiry month. If None, all the expiries are returned.
+    :param expiry_year: int
+            Year of the expiry month.
+    :param start_date: date
+            First timestamp to be returned.
+    :param end_date: date
+            Last timestamp to be returned.
+    :param monthly: bool
+            If True, only the expiries with a future are returned i.e. the monthly expiries.
+    :return: DataFrame
+            Columns in summary_columns. Dates are date objects, missing values are NaN.
+            Sorted on timestamp and expiry.
+    """
+    query = "SELECT %s FROM %s WHERE symbol = '%s'" % (", ".join(summary_columns), summary_table, symbol.upper())
+    if expiry_month is not None and expiry_year is not None:
+        first_day, last_day = dbc.expiry_range(expiry_month, expiry_year)
+        query += " AND expiry BETWEEN '%s' AND '%s'" % (first_day, last_day)
+    if start_date is not None:
+        query += " AND timestamp >= '%s'" % start_date
+    if end_date is not None:
+        query += " AND timestamp <= '%s'" % end_date
+    if monthly:
+        query += " AND fut_close IS NOT NULL"
+    query += " ORDER BY timestamp ASC, expiry ASC"
+    df = pd.DataFrame(dbc.execute_simple_query(query), columns=summary_columns)
+    for column in summary_columns[3:]:
+        df[column] = pd.to_numeric(df[column])
+    return df
+
+
+def expiry_month_summary(symbol: str, expiry_month: int = None, expiry_year: int = None, start_date: date = None,
+                         otm: bool = False):
+    """
+    It sums the open interest of the calls and puts of a symbol for every day and expiry month from the stored
+    aggregates. Weekly expiries are summed with the monthly expiry of their month. Days without the future of the
+    month are left out.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param expiry_month: int
+            Expiry month. If None, all the expiries are taken.
+    :param expiry_year: int
+            Year of the expiry month.
+    :param start_date: date
+            First timestamp to be taken. If None, all the timestamps are taken.
+    :param otm: bool
+            If True, only Out of Money options are summed.
+    :return: List[tuple]
+            Timestamp, expiry month, expiry year, futures close, call open interest and put open interest.
+            Sorted on timestamp and expiry.
+    """
+    df = load_summary(symbol, expiry_month, expiry_year, start_date)
+    # Expiries with only the future have no sums of the options
+    df = df[df.underlying.notna() & df.call_oi.notna()]
+    expiry = pd.to_datetime(df.expiry)
+    df = df.assign(expiry_month=expiry.dt.month.values, expiry_year=expiry.dt.year.values)
+    call, put = ('otm_call_oi', 'otm_put_oi') if otm else ('call_oi', 'put_oi')
+    grouped = df.groupby(['timestamp', 'expiry_year', 'expiry_month'], sort=True).agg(
+        underlying=('underlying', 'max'), call=(call, 'sum'), put=(put, 'sum'))
+    return [(timestamp, month, year, underlying, int(call_oi), int(put_oi)) for
+            (timestamp, year, month), underlying, call_oi, put_oi in
+            zip(grouped.index.tolist(), grouped.underlying.tolist(), grouped.call.tolist(), grouped.put.tolist())]
@@ -17,6 +17,26 @@ class Keys:
     sell = "sell"
 
 
+class Instrument:
+    """
+        Instrument class i.e. first three letters of the instrument e.g. OPTIDX, FUTSTK
+    """
+    future = "FUT"
+    option = "OPT"
+
+
+class IngestMode:
+    """
+        Modes available for loading the bhavcopy into the database
+    """
+    # One INSERT statement per csv row
+    row = "row"
+    # Whole file parsed into columns and loaded with batched parameterized inserts
+    columnar = "columnar"
+    # Csv file handed over to the server with LOAD DATA LOCAL INFILE
+    infile = "infile"
+
+
 class DbIndex(Enum):
     """
         This enums are used for the indexing the database columns for FO data
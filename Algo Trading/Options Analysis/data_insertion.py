@@ -1,11 +1,20 @@
 import csv
+import multiprocessing
 import os
 import shutil
 import time
 import zipfile
 from datetime import datetime, date
 
+import numpy
+import pandas as pd
+
+import chain_cache
+import chain_summary
 import database_connection
+import greeks_backfill
+import iv_surface
+from constants import IngestMode
 
 extract_dir = 'extracted/'
 default_path = 'C:/Users/sb/Downloads/niftyoptionsdata/'
@@ -13,6 +22,16 @@ default_path = 'C:/Users/sb/Downloads/niftyoptionsdata/'
 header = "INSERT INTO `%s`(`instrument`, `symbol`, `expiry`, `strike`, `option_typ`, `open`, `high`, `low`, " \
          "`close`, `settle_pr`, `contracts`, `val`, `open_int`, `chg_in_oi`, `timestamp`) VALUES " % database_connection.table_name
 delimiter = ','
+insert_columns = ['instrument', 'symbol', 'expiry', 'strike', 'option_typ', 'open', 'high', 'low', 'close',
+                  'settle_pr', 'contracts', 'val', 'open_int', 'chg_in_oi', 'timestamp']
+insert_query = "INSERT INTO `%s`(%s) VALUES (%s)" % (database_connection.table_name,
+                                                     ", ".join("`%s`" % column for column in insert_columns),
+                                                     ", ".join(["%s"] * len(insert_columns)))
+# Types of the bhavcopy columns for the columnar parsing. Dates are handled separately.
+column_types = {'instrument': str, 'symbol': str, 'option_typ': str, 'open': numpy.float64,
+                'high': numpy.float64, 'low': numpy.float64, 'close': numpy.float64, 'settle_pr': numpy.float64,
+                'contracts': numpy.int64, 'val': numpy.float64, 'open_int': numpy.int64, 'chg_in_oi': numpy.int64}
+date_format = "%d-%b-%Y"
 
 
 def _extract_files(path: str):
@@ -40,35 +59,136 @@ def _extract_files(path: str):
             zp.extractall(extract_path)
 
 
-def _read_data(path: str):
+def _read_data(path: str, mode: str = IngestMode.row):
     """
     This is used to read the csv file i.e. FO bhavcopy
     :param path: str
         Path to the csv file
+    :param mode: str
+        Mode for loading the data. Possible values in IngestMode.
     :return: None
     """
     extract = path + extract_dir
 
     csv_files = os.listdir(extract)
     for csv_file_name in csv_files:
-        queries = []
         csv_path = extract + csv_file_name
         print("Reading: %s" % csv_path)
+        _insert_csv(csv_path, mode)
+
+
+def _insert_csv(csv_path: str, mode: str = IngestMode.row):
+    """
+    This is used to insert a single csv file i.e. FO bhavcopy into the database
+    :param csv_path: str
+        Path to the csv file
+    :param mode: str
+        Mode for loading the data. Possible values in IngestMode.
+    :return: int
+        Number of rows inserted
+    """
+    if mode == IngestMode.infile and not database_connection.get_backend().supports_infile:
+        print("%s backend can't load files, using %s mode" % (database_connection.get_backend().name,
+                                                              IngestMode.columnar))
+        mode = IngestMode.columnar
+    if mode == IngestMode.infile:
+        db_start_time = time.time()
+        rows = database_connection.load_data_infile(csv_path)
+        database_connection.advance_watermark('ingest')
+        chain_cache.invalidate()
+        chain_summary.update_summary(days=_file_days(csv_path))
+        print("Rows loaded: %s" % rows)
+        print("Time taken to load file: %s seconds" % (time.time() - db_start_time))
+        return rows
+
+    file_start_time = time.time()
+    if mode == IngestMode.columnar:
+        data = _read_columns(csv_path)
+        rows = _column_rows(data)
+    else:
         # f = open(csv_path, newline='')
         # csv_reader = csv.reader(f, delimiter=' ', quotechar="|")
+        queries = []
         f = open(csv_path)
         csv_reader = csv.reader(f)
-        file_start_time = time.time()
         for row in csv_reader:
             trailer = _read_row(row)
             if trailer is not None:
                 queries.append(header + trailer)
         f.close()
-        print("Time taken to read file: %s seconds" % (time.time() - file_start_time))
-        db_start_time = time.time()
+    print("Time taken to read file: %s seconds" % (time.time() - file_start_time))
+    db_start_time = time.time()
+    if mode == IngestMode.columnar:
+        count = database_connection.insert_many(insert_query, rows)
+        if count:
+            database_connection.advance_watermark('ingest', data['timestamp'].max().tolist())
+            chain_cache.invalidate(_partitions(data))
+            # Aggregates are made from the columns already in memory
+            chain_summary.store(data)
+    else:
         database_connection.insert_data(queries)
-        print("Queries executed: %s" % len(queries))
-        print("Time taken to  execute queries: %s seconds" % (time.time() - db_start_time))
+        database_connection.advance_watermark('ingest')
+        chain_cache.invalidate()
+        chain_summary.update_summary(days=_file_days(csv_path))
+        count = len(queries)
+    print("Queries executed: %s" % count)
+    print("Time taken to  execute queries: %s seconds" % (time.time() - db_start_time))
+    return count
+
+
+def _read_columns(source):
+    """
+    It is used to read the whole csv file i.e. FO bhavcopy into typed columns.
+    :param source: str or file
+            Path to the csv file or a file like object with the csv contents
+    :return: dict
+            Key is the column name as in insert_columns.
+            Value is a numpy array. Dates are datetime64[D], strike is int64.
+    """
+    df = pd.read_csv(source, header=0, names=insert_columns, usecols=range(len(insert_columns)),
+                     dtype=dict(column_types, strike=numpy.float64), na_values={'strike': ['XX']})
+    data = {column: df[column].values for column in column_types}
+    # Expiry and timestamp have only a handful of unique values in a file, the cache parses each of them once
+    data['expiry'] = pd.to_datetime(df.expiry, format=date_format, cache=True).values.astype('datetime64[D]')
+    data['timestamp'] = pd.to_datetime(df.timestamp, format=date_format, cache=True).values.astype('datetime64[D]')
+    data['strike'] = numpy.trunc(df.strike.fillna(0).values).astype(numpy.int64)
+    return data
+
+
+def _file_days(csv_path: str):
+    """
+    It reads the days of the csv file i.e. FO bhavcopy, e.g. to summarize the days of a file loaded without reading
+    its columns. Files can be loaded in any order, so these days can be before the days already loaded.
+    :param csv_path: str
+            Path to the csv file
+    :return: List[date]
+    """
+    timestamp = pd.read_csv(csv_path, header=0, usecols=[insert_columns.index('timestamp')], dtype=str).iloc[:, 0]
+    days = pd.to_datetime(timestamp.dropna().unique(), format=date_format)
+    return sorted(days.values.astype('datetime64[D]').tolist())
+
+
+def _partitions(data: dict):
+    """
+    It returns the cache partitions changed by the columns read by _read_columns
+    :param data: dict
+            Columns of the csv file
+    :return: set(tuple(str, date))
+            Symbol and expiry pairs
+    """
+    return set(zip(data['symbol'].tolist(), data['expiry'].tolist()))
+
+
+def _column_rows(data: dict):
+    """
+    It converts the columns read by _read_columns to the rows for the parameterized insert query
+    :param data: dict
+            Columns of the csv file
+    :return: List[tuple]
+            Values of each row in the order of insert_columns
+    """
+    # tolist converts whole arrays to python objects at once, datetime64[D] is converted to date
+    return list(zip(*[data[column].tolist() for column in insert_columns]))
 
 
 def _read_row(row):
@@ -109,13 +229,15 @@ def _read_row(row):
         return None
 
 
-def insert_bulk_data(path: str = None, truncate: bool = True):
+def insert_bulk_data(path: str = None, truncate: bool = True, mode: str = IngestMode.row):
     """
     This used to insert bhavcopy in bulk into the database
     :param path: str
             Path to the folder containing all the bhavcopy zip files to be inserted into database
     :param truncate: bool
             If table is already present then truncate if True.
+    :param mode: str
+            Mode for loading the data. Possible values in IngestMode.
     :return: None
     """
     if path is not None:
@@ -124,54 +246,159 @@ def insert_bulk_data(path: str = None, truncate: bool = True):
         print("Bulk entries started...")
         _extract_files(path)
         database_connection.bulk_entries(truncate)
-        _read_data(path)
+        if truncate:
+            chain_summary.clear()
+        _read_data(path, mode)
         print("Total time taken to execute bulk entries: %s seconds" % (time.time() - start_time))
     else:
         print('No path specified')
         print(path)
 
 
-def update_option_greeks(timestamp: date = None):
+def _list_archives(path: str):
+    """
+    It lists the zip files in a directory and its sub directories.
+    :param path: str
+            Path to the directory with zip files
+    :return: List[str]
+            Paths to the zip files sorted by name
+    """
+    archives = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            file_path = os.path.join(dirpath, filename)
+            if zipfile.is_zipfile(file_path):
+                archives.append(file_path)
+    archives.sort()
+    return archives
+
+
+def _init_ingest_worker():
+    """
+    Initializer for the process pool workers of the archive ingest.
+    Each worker has its own connection pool, a single connection is enough for it.
+    :return: None
+    """
+    database_connection.configure_pool(size=1)
+
+
+def _ingest_archive(zip_path: str):
+    """
+    It inserts all the csv files of a zip file into the database without extracting them to the disk.
+    :param zip_path: str
+            Path to the zip file
+    :return: List[tuple(str, int, float, float)]
+            For each csv file: name, rows inserted, read time and insert time in seconds
+    """
+    stats = []
+    with zipfile.ZipFile(zip_path) as zp:
+        for csv_name in zp.namelist():
+            if not csv_name.lower().endswith('.csv'):
+                continue
+            read_start_time = time.time()
+            with zp.open(csv_name) as stream:
+                data = _read_columns(stream)
+            rows = _column_rows(data)
+            db_start_time = time.time()
+            database_connection.insert_many(insert_query, rows)
+            if rows:
+                database_connection.advance_watermark('ingest', data['timestamp'].max().tolist())
+                chain_cache.invalidate(_partitions(data))
+                chain_summary.store(data)
+            stats.append((csv_name, len(rows), db_start_time - read_start_time, time.time() - db_start_time))
+    return stats
+
+
+def insert_bulk_archives(path: str, truncate: bool = True, processes: int = None):
+    """
+    This is used to insert bhavcopy zip files in bulk into the database using a process pool.
+    The csv files are read straight out of the zip files, nothing is extracted to the disk.
+    :param path: str
+            Path to the folder containing all the bhavcopy zip files to be inserted into database
+    :param truncate: bool
+            If table is already present then truncate if True.
+    :param processes: int
+            Number of worker processes. If None, number of cores is taken.
+    :return: int
+            Number of rows inserted
+    """
+    start_time = time.time()
+    archives = _list_archives(path)
+    print("Total files: %s" % len(archives))
+    database_connection.bulk_entries(truncate)
+    if truncate:
+        chain_summary.clear()
+
+    total_rows, total_files = 0, 0
+    with multiprocessing.Pool(processes, initializer=_init_ingest_worker) as pool:
+        for stats in pool.imap_unordered(_ingest_archive, archives):
+            for csv_name, rows, read_time, insert_time in stats:
+                total_rows += rows
+                total_files += 1
+                print("%s: %s rows, read %.3f secs, insert %.3f secs" % (csv_name, rows, read_time, insert_time))
+
+    total_time = time.time() - start_time
+    print("Files inserted: %s" % total_files)
+    print("Rows inserted: %s" % total_rows)
+    print("Total time taken: %s seconds (%.0f rows/sec)" % (total_time, total_rows / total_time if total_time else 0))
+    return total_rows
+
+
+def update_option_greeks(timestamp: date = None, processes: int = None, restart: bool = False,
+                         incremental: bool = False, stale: bool = False):
     """
-    It is used to update the option greeks in the database.
+    It is used to update the option greeks in the database. Smiles of the updated days are fitted again by
+    iv_surface, as they are fitted from the IVs.
     :param timestamp: date
             It is to update greeks for a particular date.
-            If None, greeks are updated for whole database
+            If None, greeks are backfilled for whole database with greeks_backfill, resuming from the days pending.
+    :param processes: int
+            Number of worker processes for the backfill. If None, number of cores is taken.
+    :param restart: bool
+            If True, the backfill is done again for all the days.
+    :param incremental: bool
+            If True, only the options without greeks are updated, e.g. for the daily EOD run.
+    :param stale: bool
+            Used with incremental. If True, options whose close price changed since their greeks were calculated are
+            also updated.
     :return: None
     """
     start_time = time.time()
-    # if timestamp is None:
-    #     database_con/nection.add_greeks_column()
     database_connection.add_greeks_column()
-    database_connection.update_database_greeks(timestamp)
+    if incremental:
+        days = greeks_backfill.update_greeks_incremental(stale)
+    elif timestamp is None:
+        days = greeks_backfill.backfill_greeks(processes, restart)
+    else:
+        database_connection.update_database_greeks(timestamp)
+        days = [timestamp]
+    # Cached partitions have the greeks columns as well
+    chain_cache.invalidate()
+    if days:
+        iv_surface.update_surface(days=days)
     print("Total Time Taken for updating greeks: %s" % (time.time() - start_time))
 
 
-def insert_bhavcopy(path: str, filename: str, ):
+def insert_bhavcopy(path: str, filename: str, mode: str = IngestMode.row):
     """
     Used to insert the bhavcopy into the database
     :param path: str
             Path to the directory where file is located
     :param filename: str
             Name of the file i.e. bhavcopy zip file
+    :param mode: str
+            Mode for loading the data. Possible values in IngestMode.
     :return: None
     """
     zip_path = path + filename
     if zipfile.is_zipfile(zip_path):
-        queries = []
         zp = zipfile.ZipFile(zip_path)
         csv_name = zp.namelist()[0]
         csv_file = path + csv_name
         if not os.path.isfile(csv_file):
             print("Extracting...%s" % csv_file)
             zp.extractall(path)
-        f = open(csv_file)
-        csv_reader = csv.reader(f)
-        for rows in csv_reader:
-            trailer = _read_row(rows)
-            if trailer is not None:
-                queries.append(header + trailer)
-        database_connection.insert_data(queries)
+        _insert_csv(csv_file, mode)
     else:
         print("Not a zip file")
         print(zip_path)
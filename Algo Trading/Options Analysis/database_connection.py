@@ -1,10 +1,13 @@
+import calendar
 import time
 from datetime import date
 
-import mysql.connector
+import numpy
+import pandas as pd
 
-import option_greeks
-from constants import DbIndex
+import black_scholes
+import storage
+from constants import DbIndex, Instrument
 
 host = 'localhost'
 user = 'root'
@@ -12,31 +15,101 @@ password = ''
 
 db_name = 'fo'
 table_name = 'fo_data'
+watermark_table = 'fo_watermark'
 interest = 0.0
+batch_size = 5000
+
+pool_name = 'fo_pool'
+pool_size = 5
+# Attempts for reconnecting a pooled connection which failed the health check
+ping_attempts = 3
+# Storage backend of the queries. MySQL server given above is used if not set, see set_backend.
+_backend = None
 
 columns = ['id', 'instrument', 'symbol', 'expiry', 'strike', 'option_typ', 'open', 'high', 'low', 'close', 'settle_pr',
-           'contracts', 'val', 'open_int', 'chg_in_oi', 'timestamp', 'iv', 'theta', 'gamma', 'delta', 'vega']
+           'contracts', 'val', 'open_int', 'chg_in_oi', 'timestamp', 'iv', 'theta', 'gamma', 'delta', 'vega',
+           'greeks_close']
+select_columns = ", ".join("`%s`" % column for column in columns)
+# Types of the columns returned by fetch. Dates are datetime64, symbols and types are categorical in DataFrames.
+column_types = {'id': 'int64', 'instrument': 'category', 'symbol': 'category', 'expiry': 'datetime64[ns]',
+                'strike': 'int32', 'option_typ': 'category', 'open': 'float64', 'high': 'float64', 'low': 'float64',
+                'close': 'float64', 'settle_pr': 'float64', 'contracts': 'int32', 'val': 'float64',
+                'open_int': 'int32', 'chg_in_oi': 'int32', 'timestamp': 'datetime64[ns]', 'iv': 'float64',
+                'theta': 'float64', 'gamma': 'float64', 'delta': 'float64', 'vega': 'float64',
+                'greeks_close': 'float64'}
+# Indexes of the table. Queries filter on the instrument class (a generated column, see
+# StorageBackend.generated_columns) and ranges of expiry and timestamp so that they are served from these indexes.
+indexes = {
+    'idx_symbol_class_expiry': "(symbol, instrument_class, expiry, timestamp)",
+    'idx_timestamp_class': "(timestamp, instrument_class)",
+}
+
+
+def set_backend(backend: storage.StorageBackend):
+    """
+    It sets the storage backend used by all the queries.
+    e.g. set_backend(storage.SQLiteBackend('fo.sqlite')) to work on a local file without a MySQL server.
+    :param backend: StorageBackend
+            If None, MySQL server given by host, user, password and db_name is used.
+    :return: StorageBackend
+            Backend which was set before
+    """
+    global _backend
+    previous = _backend
+    _backend = backend
+    return previous
+
+
+def get_backend():
+    """
+    It returns the storage backend used by the queries.
+    :return: StorageBackend
+    """
+    global _backend
+    if _backend is None:
+        _backend = storage.MySQLBackend(host, user, password, db_name, pool_name, pool_size, ping_attempts)
+    return _backend
 
 
 def _check_database():
     """
-    This checks for the for the database present in the MySQL server. If not then it creates the database.
+    This checks for the database. If not present then it creates the database.
     :return: None
     """
-    conn = mysql.connector.connect(host=host, user=user, password=password)
-    cursor = conn.cursor()
-    query = "SELECT SCHEMA_NAME FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = '%s'" % db_name
-    cursor.execute(query)
-    result = cursor.fetchall()
-    if len(result) == 0:
-        query = "CREATE DATABASE IF NOT EXISTS %s" % db_name
-        cursor.execute(query)
-        print("Database created: %s" % db_name)
-    else:
-        print("Database already present")
+    get_backend().check_database()
+
 
-    cursor.close()
-    conn.close()
+def configure_pool(size: int = None, name: str = None):
+    """
+    It configures the connection pool. The pool is created again on the next use.
+    :param size: int
+            Number of connections kept in the pool.
+    :param name: str
+            Name of the pool.
+    :return: None
+    """
+    global pool_size, pool_name
+    pool_size = size if size else pool_size
+    pool_name = name if name else pool_name
+    get_backend().configure_pool(size, name)
+
+
+def connection():
+    """
+    Context manager for a connection of the storage backend e.g. a pooled MySQL connection.
+    :return: Connection
+    """
+    return get_backend().connection()
+
+
+def cursor(commit: bool = False):
+    """
+    Context manager for a cursor of the storage backend. Queries use %s placeholders for all the backends.
+    :param commit: bool
+            If True, the transaction is committed on exit. It is rolled back if an exception is raised.
+    :return: Cursor
+    """
+    return get_backend().cursor(commit)
 
 
 def _check_table(truncate: bool):
@@ -45,28 +118,31 @@ def _check_table(truncate: bool):
     :param truncate:
     :return: None
     """
-    db_conn = mysql.connector.connect(host=host, user=user, password=password, database=db_name)
-    cursor = db_conn.cursor()
-    query = "SELECT table_name FROM information_schema.tables WHERE table_name = '%s'" % table_name
-    cursor.execute(query)
-    result = cursor.fetchall()
-    # print(result)
-    if len(result) == 0:
-        print("Table not found")
-        query = "CREATE TABLE %s (id int NOT NULL AUTO_INCREMENT,instrument varchar(8) ,symbol varchar(30) ," \
-                "expiry date,strike int, option_typ varchar(5), open float, high float, low float, close double, " \
-                "settle_pr float, contracts int, val float, open_int int, chg_in_oi int, timestamp date, PRIMARY KEY " \
-                "(id))" % table_name
-        cursor.execute(query)
-        print("Table created: %s" % table_name)
-    else:
-        print("Table already present")
-        if truncate:
-            truncate = 'TRUNCATE TABLE %s' % table_name
-            cursor.execute(truncate)
-            print('Table Truncated')
-    cursor.close()
-    db_conn.close()
+    backend = get_backend()
+    with cursor(commit=True) as cur:
+        if not backend.has_table(cur, table_name):
+            print("Table not found")
+            generated = "".join(", %s %s" % (column, definition) for column, definition in
+                                backend.generated_columns.items())
+            for query in backend.fo_table_query(table_name, generated, indexes):
+                cur.execute(query)
+            print("Table created: %s" % table_name)
+        else:
+            print("Table already present")
+            if truncate:
+                cur.execute(backend.truncate_query(table_name))
+                print('Table Truncated')
+        _check_watermark_table(cur)
+
+
+def _check_watermark_table(cur):
+    """
+    This checks for the watermark table in the database. If not present then it creates the table.
+    :param cur: Cursor
+    :return: None
+    """
+    cur.execute("CREATE TABLE IF NOT EXISTS %s (name varchar(30) NOT NULL, value date, PRIMARY KEY (name))" %
+                watermark_table)
 
 
 def insert_data(queries):
@@ -76,13 +152,56 @@ def insert_data(queries):
             It should the a list of queries in str format which can be inserted directly in database.
     :return: None
     """
-    db_conn = mysql.connector.connect(host=host, user=user, password=password, database=db_name)
-    cursor = db_conn.cursor()
-    for query in queries:
-        cursor.execute(query)
-    db_conn.commit()
-    cursor.close()
-    db_conn.close()
+    with cursor(commit=True) as cur:
+        for query in queries:
+            cur.execute(query)
+
+
+def insert_many(query: str, rows: list, size: int = None, cur=None):
+    """
+    This is used to insert or update rows in the database with a parameterized query in batches.
+    :param query: str
+            Parameterized query e.g. "INSERT INTO fo_data(symbol, strike) VALUES (%s, %s)"
+    :param rows: List[tuple]
+            Values for each row in the order of the query placeholders.
+    :param size: int
+            Number of rows sent to the server in a single statement. Defaults to batch_size.
+    :param cur: Cursor
+            Cursor of an open transaction, e.g. when rows are replaced. Rows are then committed with that
+            transaction. If None, they are committed on their own.
+    :return: int
+            Number of rows executed
+    """
+    if cur is None:
+        with cursor(commit=True) as cur:
+            return insert_many(query, rows, size, cur)
+    size = size if size else batch_size
+    for i in range(0, len(rows), size):
+        # executemany rewrites the INSERT into a single multi row statement for each batch
+        cur.executemany(query, rows[i:i + size])
+    return len(rows)
+
+
+def load_data_infile(csv_path: str):
+    """
+    This is used to load the FO bhavcopy csv file directly into the table.
+    The file is parsed by the server, dates are converted with STR_TO_DATE.
+    The server should have local_infile enabled.
+    :param csv_path: str
+            Path to the csv file i.e. FO bhavcopy
+    :return: int
+            Number of rows inserted
+    """
+    query = "LOAD DATA LOCAL INFILE '%s' INTO TABLE `%s` FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n' " \
+            "IGNORE 1 LINES (`instrument`, `symbol`, @expiry, @strike, `option_typ`, `open`, `high`, `low`, `close`, " \
+            "`settle_pr`, `contracts`, `val`, `open_int`, `chg_in_oi`, @timestamp) " \
+            "SET `expiry` = STR_TO_DATE(@expiry, '%%d-%%b-%%Y'), " \
+            "`strike` = IF(@strike = 'XX', 0, TRUNCATE(@strike, 0)), " \
+            "`timestamp` = STR_TO_DATE(@timestamp, '%%d-%%b-%%Y')" % (csv_path.replace('\\', '/'), table_name)
+    with cursor(commit=True) as cur:
+        cur.execute(query)
+        rows = cur.rowcount
+    return rows
 
 
 def bulk_entries(truncate: bool):
@@ -99,21 +218,208 @@ def bulk_entries(truncate: bool):
 def add_greeks_column():
     """
     This checks and adds greeks columns to the database i.e. iv, theta, gamma, delta and vega.
+    Column greeks_close keeps the close price the greeks were calculated for, it is used to find stale greeks.
     :return: None
     """
-    db_conn = mysql.connector.connect(host=host, user=user, password=password, database=db_name)
-    cursor = db_conn.cursor()
-    check_query = "SELECT * FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = '%s' AND TABLE_NAME = '%s' AND COLUMN_NAME LIKE 'iv'" % (
-        db_name, table_name)
-    cursor.execute(check_query)
-    check = cursor.fetchall()
-    if len(check) == 0:
-        print('Adding Columns to the table...')
-        query = "ALTER TABLE %s ADD (iv float, theta float, gamma float, delta float, vega float)" % table_name
-        cursor.execute(query)
-    else:
-        print("Column already present")
-    db_conn.close()
+    with cursor(commit=True) as cur:
+        if not _has_column(cur, 'iv'):
+            print('Adding Columns to the table...')
+            for column in ['iv', 'theta', 'gamma', 'delta', 'vega']:
+                cur.execute("ALTER TABLE %s ADD COLUMN %s float" % (table_name, column))
+        else:
+            print("Column already present")
+        if not _has_column(cur, 'greeks_close'):
+            query = "ALTER TABLE %s ADD COLUMN greeks_close double" % table_name
+            cur.execute(query)
+        # Tables made before the watermarks get the watermark table here
+        _check_watermark_table(cur)
+
+
+def migrate_schema(partition: bool = False):
+    """
+    This upgrades a table created before the indexes were introduced.
+    It adds the greeks columns, the generated columns and the indexes which are missing.
+    :param partition: bool
+            If True, the table is also partitioned by the year of timestamp. The primary key becomes (id, timestamp)
+            as MySQL requires the partitioning column in every unique key. Only for the MySQL backend.
+    :return: None
+    """
+    add_greeks_column()
+    backend = get_backend()
+    with cursor(commit=True) as cur:
+        for column, definition in backend.generated_columns.items():
+            if not _has_column(cur, column):
+                print("Adding column: %s" % column)
+                cur.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table_name, column, definition))
+        present = backend.index_names(cur, table_name)
+        for index, definition in indexes.items():
+            if index not in present:
+                print("Adding index: %s" % index)
+                cur.execute(backend.add_index_query(table_name, index, definition))
+        if partition and not backend.supports_partitions:
+            print("Partitioning is not supported by the %s backend" % backend.name)
+        elif partition:
+            cur.execute("SELECT YEAR(MIN(timestamp)), YEAR(MAX(timestamp)) FROM %s" % table_name)
+            first_year, last_year = cur.fetchall()[0]
+            first_year = first_year if first_year else date.today().year
+            last_year = max(last_year if last_year else first_year, date.today().year)
+            partitions = ", ".join("PARTITION p%d VALUES LESS THAN (%d)" % (year, year + 1) for year in
+                                   range(first_year, last_year + 1))
+            print("Partitioning table by year: %s to %s" % (first_year, last_year))
+            cur.execute("ALTER TABLE %s DROP PRIMARY KEY, ADD PRIMARY KEY (id, timestamp)" % table_name)
+            cur.execute("ALTER TABLE %s PARTITION BY RANGE (YEAR(timestamp)) (%s, PARTITION pmax VALUES LESS THAN "
+                        "MAXVALUE)" % (table_name, partitions))
+
+
+def expiry_range(expiry_month: int, expiry_year: int):
+    """
+    It returns the range of expiry dates for an expiry month.
+    :param expiry_month: int
+            Expiry month e.g. 10
+    :param expiry_year: int
+            Year of the expiry month e.g. 2018
+    :return: tuple(date, date)
+            First and last day of the month
+    """
+    return date(expiry_year, expiry_month, 1), date(expiry_year, expiry_month,
+                                                    calendar.monthrange(expiry_year, expiry_month)[1])
+
+
+def fo_query(symbol: str, instrument: str, expiry_month: int = None, expiry_year: int = None, order_by: str = None,
+             fields: list = None, start_date: date = None, end_date: date = None, option_type: str = None):
+    """
+    It builds the query for the FO data of a symbol.
+    Predicates are on plain columns and ranges so that the query is served from idx_symbol_class_expiry.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param instrument: str
+            Instrument class. Possible values in Instrument.
+    :param expiry_month: int
+            Expiry month. If None, all the expiries are selected.
+    :param expiry_year: int
+            Year of the expiry month.
+    :param order_by: str
+            Column to sort the data on e.g. timestamp
+    :param fields: list
+            Columns to be selected. If None, all the columns are selected.
+    :param start_date: date
+            First timestamp to be selected.
+    :param end_date: date
+            Last timestamp to be selected.
+    :param option_type: str
+            Type of option to be selected. Possible values: CE, PE
+    :return: str
+            SQL query
+    """
+    selected = ", ".join("`%s`" % field for field in fields) if fields else select_columns
+    query = "SELECT %s FROM %s WHERE symbol='%s' AND instrument_class='%s'" % (selected, table_name, symbol,
+                                                                                instrument)
+    if expiry_month is not None and expiry_year is not None:
+        first_day, last_day = expiry_range(expiry_month, expiry_year)
+        query += " AND expiry BETWEEN '%s' AND '%s'" % (first_day, last_day)
+    if start_date is not None:
+        query += " AND timestamp >= '%s'" % start_date
+    if end_date is not None:
+        query += " AND timestamp <= '%s'" % end_date
+    if option_type is not None:
+        query += " AND option_typ = '%s'" % option_type
+    if order_by is not None:
+        query += " ORDER BY %s ASC" % order_by
+    return query
+
+
+def fetch(symbol: str, instrument: str, fields: list = None, expiry_month: int = None, expiry_year: int = None,
+          start_date: date = None, end_date: date = None, option_type: str = None, order_by: str = None,
+          arrays: bool = False):
+    """
+    It returns the FO data of a symbol with typed columns. Only the fields asked for are selected.
+    Parameters are same as fo_query.
+    :param fields: list
+            Columns to be selected. If None, all the columns in database_connection.columns are selected.
+    :param arrays: bool
+            If True, a dict of NumPy arrays is returned instead of a DataFrame.
+    :return: DataFrame or dict
+            Types are as in column_types. Arrays of dates are datetime64[D] and arrays of strings are str.
+    """
+    fields = fields if fields else columns
+    query = fo_query(symbol, instrument, expiry_month, expiry_year, order_by, fields, start_date, end_date, option_type)
+    return execute_typed_query(query, fields, arrays)
+
+
+def execute_typed_query(query: str, fields: list, arrays: bool = False):
+    """
+    This is used to execute a query and get the result as typed columns instead of rows.
+    :param query: str
+            SQL query selecting the fields in the same order
+    :param fields: list
+            Names of the selected columns. Types are taken from column_types, other columns are kept as objects.
+    :param arrays: bool
+            If True, a dict of NumPy arrays is returned instead of a DataFrame.
+    :return: DataFrame or dict
+    """
+    rows = execute_simple_query(query)
+    values = list(zip(*rows)) if rows else [()] * len(fields)
+    data = {}
+    for field, column in zip(fields, values):
+        dtype = column_types.get(field, 'object')
+        if dtype == 'category':
+            data[field] = numpy.array(column, dtype=str) if arrays else pd.Categorical(column)
+        elif dtype.startswith('datetime64'):
+            # NULL dates become NaT
+            array = numpy.array(column, dtype='datetime64[D]')
+            data[field] = array if arrays else array.astype(dtype)
+        elif dtype.startswith('float'):
+            # NULL values become NaN
+            data[field] = numpy.array(column, dtype=dtype)
+        else:
+            data[field] = numpy.array(column, dtype=dtype if None not in column else 'float64')
+    return data if arrays else pd.DataFrame(data, columns=fields)
+
+
+def _has_column(cur, column: str):
+    """
+    It checks if the column is present in the table.
+    :param cur: Cursor
+    :param column: str
+            Name of the column
+    :return: bool
+    """
+    return get_backend().has_column(cur, table_name, column)
+
+
+def get_watermark(name: str):
+    """
+    It returns a high-water mark i.e. the latest timestamp processed by a job.
+    :param name: str
+            Name of the watermark e.g. 'ingest', 'greeks'
+    :return: date
+            None if the watermark is not set
+    """
+    with cursor() as cur:
+        cur.execute("SELECT value FROM %s WHERE name = %%s" % watermark_table, (name,))
+        result = cur.fetchall()
+    return result[0][0] if result else None
+
+
+def advance_watermark(name: str, value: date = None):
+    """
+    It moves a high-water mark forward. The watermark never moves back, so repeated calls are harmless.
+    :param name: str
+            Name of the watermark e.g. 'ingest', 'greeks'
+    :param value: date
+            Latest timestamp processed. If None, the latest timestamp in the table is taken.
+    :return: None
+    """
+    with cursor(commit=True) as cur:
+        if value is None:
+            cur.execute("SELECT MAX(timestamp) FROM %s" % table_name)
+            value = cur.fetchall()[0][0]
+        if value is not None:
+            backend = get_backend()
+            new_value = backend.inserted('value')
+            query = backend.upsert_query(watermark_table, ['name', 'value'], ['name'], {
+                'value': backend.greatest("COALESCE(value, %s)" % new_value, new_value)})
+            cur.execute(query, (name, value))
 
 
 def _get_fut_data(timestamp: str):
@@ -127,11 +433,11 @@ def _get_fut_data(timestamp: str):
             Value is the close price of the future on the input timestamp.
     """
     data = {}
-    db_conn = mysql.connector.connect(host=host, user=user, password=password, database=db_name)
-    cursor = db_conn.cursor()
-    underlying_query = "SELECT * FROM %s WHERE instrument LIKE 'FUT%%' AND timestamp = '%s'" % (table_name, timestamp)
-    cursor.execute(underlying_query)
-    fut_data = cursor.fetchall()
+    underlying_query = "SELECT %s FROM %s WHERE timestamp = '%s' AND instrument_class = '%s'" % (
+        select_columns, table_name, timestamp, Instrument.future)
+    with cursor() as cur:
+        cur.execute(underlying_query)
+        fut_data = cur.fetchall()
     for fut in fut_data:
         instrument = fut[DbIndex.instrument_id.value]
         symbol = fut[DbIndex.symbol_id.value]
@@ -139,10 +445,57 @@ def _get_fut_data(timestamp: str):
         close = fut[DbIndex.close_id.value]
         key = "%s_%s_%s_%s" % (instrument[3:], symbol, expiry.month, expiry.year)
         data.update({key: close})
-    db_conn.close()
     return data
 
 
+def _nullable(values):
+    """
+    It converts a float array to a list where NaN values are None i.e. NULL in the database.
+    :param values: array
+    :return: list
+    """
+    values = values.astype(object)
+    values[values != values] = None
+    return values.tolist()
+
+
+def update_day_greeks(data_date: date, only_missing: bool = False):
+    """
+    This updates the greeks of all the options for a timestamp in the database.
+    Greeks of the whole day are calculated at once with black_scholes.chain_greeks.
+    Options whose implied volatility couldn't be found get NULL greeks.
+    Updates are idempotent, doing a day again writes the same values.
+    :param data_date: date
+            Timestamp for which the greeks are to be updated
+    :param only_missing: bool
+            If True, only the options without greeks or whose close price changed since are updated.
+    :return: int
+            Number of options updated
+    """
+    fut_data = _get_fut_data(data_date)
+    missing = " AND (greeks_close IS NULL OR greeks_close <> close)" if only_missing else ""
+    opt_query = "SELECT id, instrument, symbol, expiry, strike, option_typ, close FROM `%s` WHERE timestamp='%s' AND " \
+                "instrument_class='%s'%s ORDER BY id ASC " % (table_name, data_date, Instrument.option, missing)
+    with cursor() as cur:
+        cur.execute(opt_query)
+        opt_data = cur.fetchall()
+    if len(opt_data) == 0:
+        return 0
+
+    index, instrument, symbol, expiry, strike, option_type, price = zip(*opt_data)
+    underlying_price = numpy.array([fut_data.get("%s_%s_%s_%s" % (inst[3:], sym, exp.month, exp.year), numpy.nan)
+                                    for inst, sym, exp in zip(instrument, symbol, expiry)], dtype=numpy.float64)
+    iv, theta, gamma, delta, vega, _ = black_scholes.chain_greeks(underlying_price, strike, expiry, option_type,
+                                                                  price, data_date, rate=interest)
+    # Options without the futures on the day are left as they are
+    has_underlying = numpy.isfinite(underlying_price)
+    values = [_nullable(greek[has_underlying]) for greek in (iv, theta, gamma, delta, vega)]
+    values.append(numpy.array(index)[has_underlying].tolist())
+    update_query = "UPDATE `%s` SET `iv`=%%s,`theta`=%%s,`gamma`=%%s,`delta`=%%s,`vega`=%%s," \
+                   "`greeks_close`=`close` WHERE id=%%s" % table_name
+    return insert_many(update_query, list(zip(*values)))
+
+
 def update_database_greeks(ts: date):
     """
     This updates the greeks for the given timestamp and insert them in database.
@@ -150,63 +503,35 @@ def update_database_greeks(ts: date):
             Timestamp for which the greeks are to be updated
     :return: None
     """
-    db_conn = mysql.connector.connect(host=host, user=user, password=password, database=db_name)
-    cursor = db_conn.cursor()
     if ts is not None:
         timestamp_query = "SELECT distinct timestamp from %s where timestamp = '%s-%s-%s' ORDER BY timestamp ASC " % (
             table_name, ts.year, ts.month, ts.day)
     else:
         timestamp_query = 'SELECT distinct timestamp from %s ORDER BY timestamp ASC' % table_name
 
-    cursor.execute(timestamp_query)
-    x = cursor.fetchall()
+    with cursor() as cur:
+        cur.execute(timestamp_query)
+        x = cur.fetchall()
     for obs_ts in x:
         date_time = time.time()
         data_date = obs_ts[0]
         print("Updating options data for: %s" % data_date)
-        fut_data = _get_fut_data(data_date)
-        opt_query = "SELECT * FROM `%s` WHERE instrument LIKE 'OPT%%' AND timestamp='%s' ORDER BY id ASC " % (
-            table_name, data_date)
-        cursor.execute(opt_query)
-        opt_data = cursor.fetchall()
-        queries = []
-        for row in opt_data:
-            instrument = row[DbIndex.instrument_id.value]
-            index = row[DbIndex.index_id.value]
-            symbol = row[DbIndex.symbol_id.value]
-            strike = (row[DbIndex.strike_id.value])
-            expiry = row[DbIndex.expiry_id.value]
-            option_type = row[DbIndex.option_type_id.value]
-            price = row[DbIndex.close_id.value]
-            timestamp = row[DbIndex.timestamp_id.value]
-
-            key = "%s_%s_%s_%s" % (instrument[3:], symbol, expiry.month, expiry.year)
-            try:
-                underlying_price = fut_data[key]
-                iv, theta, gamma, delta, vega = option_greeks.get_greeks(underlying_price, strike, expiry, option_type,
-                                                                         price, timestamp, volatility=0.13)
-                update_query = "UPDATE `%s` SET `iv`=%s,`theta`=%s,`gamma`=%s,`delta`=%s,`vega`=%s WHERE id=%d" % (
-                    table_name, iv, theta, gamma, delta, vega, index)
-                queries.append(update_query)
-            except KeyError:
-                pass
-        insert_data(queries)
+        rows = update_day_greeks(data_date)
+        print("Options updated: %s" % rows)
         print("Time taken: %s secs" % (time.time() - date_time))
-    db_conn.close()
 
 
 def execute_simple_query(query):
     """
-    This used to execute a MySQL query in the database.
+    This used to execute a SQL query in the database.
+    For typed columns of the FO data use fetch or execute_typed_query.
     :param query: str
-            MySQL query to be executed
-    :return: None
+            SQL query to be executed
+    :return: List[tuple]
     """
     start_time = time.time()
-    db_conn = mysql.connector.connect(host=host, user=user, password=password, database=db_name)
-    cursor = db_conn.cursor()
-    cursor.execute(query)
-    result = cursor.fetchall()
-    db_conn.close()
+    with cursor() as cur:
+        cur.execute(query)
+        result = cur.fetchall()
     print("Query executed in: %s secs" % (time.time() - start_time))
     return result
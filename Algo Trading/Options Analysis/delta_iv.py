@@ -0,0 +1,172 @@
+from datetime import date
+
+import numpy
+
+import chain_cache
+from constants import Instrument, Keys
+from model import DeltaIVValues
+
+"""
+Definitions written in this file are used to find the IV of the options at constant deltas with NumPy.
+Options of all the days (and expiries) are sorted once on chain, option type and absolute delta. The options around
+every delta target of every chain are then found with one searchsorted over the whole sorted array, so a list of
+targets for calls and puts over many expiries takes a single pass.
+"""
+
+default_targets = [0.1, 0.25, 0.5]
+# Days after 1970 fit in these many bits of the integer chain keys
+day_bits = 20
+option_fields = ['timestamp', 'expiry', 'strike', 'option_typ', 'delta', 'iv']
+
+
+def delta_iv(timestamp, strike, option_type, delta, iv, targets: list = None, expiry=None, interpolate: bool = False,
+             delta_dev: float = None):
+    """
+    It finds the IV of the calls and puts at each delta target for every day, and every expiry if given.
+    Options without delta or with IV 0 (not calculated) are left out.
+    :param timestamp: array
+            Day of each option. date objects or datetime64 values.
+    :param strike: array
+            Strike price of each option
+    :param option_type: array
+            Type of each option. Possible values: CE, PE
+    :param delta: array
+            Delta of each option. Negative for the puts.
+    :param iv: array
+            IV of each option
+    :param targets: list
+            Absolute delta targets, from 0 to 1. Puts are taken at -target. Defaults to default_targets.
+    :param expiry: array
+            Expiry of each option. If None, all the options of a day are taken as one chain.
+    :param interpolate: bool
+            If True, IV is linearly interpolated between the options on either side of the target, NaN if the target
+            is outside the deltas of the day. Otherwise the option with the nearest delta is taken, the one with lower
+            absolute delta on ties.
+    :param delta_dev: float
+            If given, options whose delta is farther than this from the target are not taken.
+    :return: DeltaIVValues
+            One row for each day (and expiry) in ascending order
+    """
+    targets = numpy.asarray(targets if targets is not None else default_targets, dtype=numpy.float64)
+    timestamp = numpy.asarray(timestamp, dtype='datetime64[D]')
+    option_type = numpy.asarray(option_type)
+    delta = numpy.asarray(delta, dtype=numpy.float64)
+    iv = numpy.asarray(iv, dtype=numpy.float64)
+    strike = numpy.asarray(strike, dtype=numpy.float64)
+
+    # Chain of each option, day alone or expiry and day
+    chain_key = timestamp.astype(numpy.int64)
+    if expiry is not None:
+        chain_key = (numpy.asarray(expiry, dtype='datetime64[D]').astype(numpy.int64) << day_bits) + chain_key
+    chains, chain_index = numpy.unique(chain_key, return_inverse=True)
+    chain_index = chain_index.ravel()
+
+    put = option_type == Keys.put
+    valid = ((option_type == Keys.call) | put) & numpy.isfinite(delta) & numpy.isfinite(iv) & (iv > 0)
+    # Calls and puts of a chain are separate groups
+    group = (chain_index * 2 + put)[valid]
+    x = numpy.clip(numpy.abs(delta[valid]), 0, 1)
+    order = numpy.lexsort((x, group))
+    group, x = group[order], x[order]
+    iv, strike, delta = iv[valid][order], strike[valid][order], delta[valid][order]
+
+    # Absolute delta is within [0, 1], so an offset of 2 for each group keeps the groups apart in one sorted array
+    groups = numpy.arange(2 * len(chains))
+    start = numpy.searchsorted(group, groups, 'left')[:, None]
+    end = numpy.searchsorted(group, groups, 'right')[:, None]
+    position = numpy.searchsorted(group * 2.0 + x, groups[:, None] * 2.0 + targets[None, :])
+    low, high = position - 1, position
+    has_low, has_high = low >= start, high < end
+    last = max(len(x) - 1, 0)
+    low, high = numpy.clip(low, 0, last), numpy.clip(high, 0, last)
+    if len(x) == 0:
+        x = iv = strike = delta = numpy.full(1, numpy.nan)
+
+    if interpolate:
+        exact = has_high & (x[high] == targets)
+        both = has_low & has_high
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            weight = numpy.where(both, (targets - x[low]) / (x[high] - x[low]), numpy.nan)
+        weight = numpy.where(exact, 1.0, weight)
+        found = both | exact
+        distance = numpy.where(found, 0.0, numpy.inf)
+        values = [numpy.where(found, numpy.where(exact, array[high], array[low] + weight * (array[high] - array[low])),
+                              numpy.nan) for array in (iv, strike, delta)]
+    else:
+        # Lower absolute delta wins ties
+        take_high = has_high & (~has_low | (x[high] - targets < targets - x[low]))
+        found = has_low | has_high
+        chosen = numpy.where(take_high, high, low)
+        distance = numpy.where(found, numpy.abs(x[chosen] - targets), numpy.inf)
+        values = [numpy.where(found, array[chosen], numpy.nan) for array in (iv, strike, delta)]
+    if delta_dev is not None:
+        values = [numpy.where(distance <= delta_dev, array, numpy.nan) for array in values]
+
+    chain_day = (chains & ((1 << day_bits) - 1)).astype('datetime64[D]') if expiry is not None else chains.astype(
+        'datetime64[D]')
+    chain_expiry = (chains >> day_bits).astype('datetime64[D]') if expiry is not None else numpy.full(
+        len(chains), numpy.datetime64('NaT'), dtype='datetime64[D]')
+    iv_values, strike_values, delta_values = values
+    return DeltaIVValues(chain_day, chain_expiry, targets, iv_values[0::2], iv_values[1::2], strike_values[0::2],
+                         strike_values[1::2], delta_values[0::2], delta_values[1::2])
+
+
+def risk_reversal(values: DeltaIVValues, target: float = 0.25):
+    """
+    It returns the risk reversal i.e. IV of the call less IV of the put at a delta target.
+    :param values: DeltaIVValues
+    :param target: float
+            One of the targets of the values
+    :return: array
+    """
+    column = _target_column(values, target)
+    return values.call_iv[:, column] - values.put_iv[:, column]
+
+
+def butterfly(values: DeltaIVValues, target: float = 0.25, atm: float = 0.5):
+    """
+    It returns the butterfly i.e. average IV of the call and put at a delta target less the average IV at the money.
+    :param values: DeltaIVValues
+    :param target: float
+            Delta of the wings, one of the targets of the values
+    :param atm: float
+            Delta at the money, one of the targets of the values
+    :return: array
+    """
+    wing, middle = _target_column(values, target), _target_column(values, atm)
+    return (values.call_iv[:, wing] + values.put_iv[:, wing]) / 2 - (
+            values.call_iv[:, middle] + values.put_iv[:, middle]) / 2
+
+
+def _target_column(values: DeltaIVValues, target: float):
+    """
+    It returns the column of a delta target in the values.
+    :return: int
+    """
+    columns = numpy.flatnonzero(numpy.isclose(values.targets, target))
+    if len(columns) == 0:
+        raise ValueError("Delta target %s is not in %s" % (target, values.targets.tolist()))
+    return columns[0]
+
+
+def load_delta_iv(symbol: str, targets: list = None, expiry_month: int = None, expiry_year: int = None,
+                  start_date: date = None, interpolate: bool = False, delta_dev: float = None):
+    """
+    It finds the IV at constant deltas for the options of a symbol from the cache. Parameters are same as delta_iv.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param expiry_month: int
+            Expiry month. If None, all the expiries of the symbol are done at once.
+    :param expiry_year: int
+            Year of the expiry month.
+    :param start_date: date
+            First day to be taken
+    :return: DeltaIVValues
+    """
+    option_df = chain_cache.load(symbol.upper(), Instrument.option, expiry_month, expiry_year, fields=option_fields,
+                                 typed=True)
+    if start_date is not None:
+        option_df = option_df[option_df.timestamp >= numpy.datetime64(start_date)]
+    return delta_iv(option_df.timestamp.values, option_df.strike.values, option_df.option_typ.values.astype(str),
+                    option_df.delta.values, option_df.iv.values, targets, option_df.expiry.values, interpolate,
+                    delta_dev)
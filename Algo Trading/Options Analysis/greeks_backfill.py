@@ -0,0 +1,137 @@
+import multiprocessing
+import time
+
+import database_connection as dbc
+from constants import Instrument
+
+"""
+Definitions written in this file are used to maintain the option greeks of the whole database.
+For the backfill, trading days are spread over a process pool and the completed days are recorded in a checkpoint
+table, so a backfill which is stopped resumes from the days which are still pending.
+For the daily runs, the incremental update finds the days with options whose greeks are not calculated yet, so days
+loaded in any order are updated.
+"""
+
+checkpoint_table = 'greeks_checkpoint'
+
+
+def _check_checkpoint_table(restart: bool = False):
+    """
+    This checks for the checkpoint table in the database. If not present then it creates the table.
+    :param restart: bool
+            If True, the recorded days are removed so that the backfill starts over.
+    :return: None
+    """
+    query = "CREATE TABLE IF NOT EXISTS %s (timestamp date NOT NULL, options int, seconds float, " \
+            "completed_at timestamp DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (timestamp))" % checkpoint_table
+    with dbc.cursor(commit=True) as cur:
+        cur.execute(query)
+        if restart:
+            cur.execute(dbc.get_backend().truncate_query(checkpoint_table))
+            print("Checkpoints cleared")
+
+
+def _pending_days():
+    """
+    It returns the trading days whose greeks are not backfilled yet.
+    :return: List[date]
+    """
+    query = "SELECT DISTINCT f.timestamp FROM %s f LEFT JOIN %s c ON c.timestamp = f.timestamp " \
+            "WHERE c.timestamp IS NULL ORDER BY f.timestamp ASC" % (dbc.table_name, checkpoint_table)
+    with dbc.cursor() as cur:
+        cur.execute(query)
+        return [row[0] for row in cur.fetchall()]
+
+
+def _init_worker():
+    """
+    Initializer for the process pool workers. A worker handles one day at a time, a single connection is enough.
+    :return: None
+    """
+    dbc.configure_pool(size=1)
+
+
+def _backfill_day(data_date):
+    """
+    It updates the greeks for a day and records the day in the checkpoint table.
+    Updates are idempotent, a day which is done again after a crash gets the same values.
+    :param data_date: date
+            Timestamp for which the greeks are to be updated
+    :return: tuple(date, int, float)
+            Day, number of options updated and time taken in seconds
+    """
+    start_time = time.time()
+    options = dbc.update_day_greeks(data_date)
+    seconds = time.time() - start_time
+    backend = dbc.get_backend()
+    query = backend.upsert_query(checkpoint_table, ['timestamp', 'options', 'seconds'], ['timestamp'], {
+        'options': backend.inserted('options'), 'seconds': backend.inserted('seconds'),
+        'completed_at': 'CURRENT_TIMESTAMP'})
+    with dbc.cursor(commit=True) as cur:
+        cur.execute(query, (data_date, options, seconds))
+    return data_date, options, seconds
+
+
+def backfill_greeks(processes: int = None, restart: bool = False):
+    """
+    This updates the greeks for all the trading days in the database which are not backfilled yet.
+    :param processes: int
+            Number of worker processes. If None, number of cores is taken.
+    :param restart: bool
+            If True, all the days are done again.
+    :return: list
+            Days updated
+    """
+    start_time = time.time()
+    _check_checkpoint_table(restart)
+    days = _pending_days()
+    print("Days pending: %s" % len(days))
+
+    total_options = 0
+    with multiprocessing.Pool(processes, initializer=_init_worker) as pool:
+        for i, (data_date, options, seconds) in enumerate(pool.imap_unordered(_backfill_day, days), start=1):
+            total_options += options
+            print("[%s/%s] %s: %s options in %.3f secs (%.0f options/sec)" % (
+                i, len(days), data_date, options, seconds, options / seconds if seconds else 0))
+    if days:
+        dbc.advance_watermark('greeks', days[-1])
+
+    total_time = time.time() - start_time
+    print("Days updated: %s" % len(days))
+    print("Options updated: %s" % total_options)
+    print("Total time taken: %s secs (%.0f options/sec)" % (total_time, total_options / total_time if total_time else 0))
+    return days
+
+
+def update_greeks_incremental(stale: bool = False):
+    """
+    This updates the greeks only for the options which need it.
+    Days with options without greeks are updated, and within them only those options. Days are searched instead of
+    taking the days after the 'greeks' watermark, so days loaded out of date order are not missed.
+    :param stale: bool
+            If True, days with options whose close price changed since the greeks were calculated e.g. a bhavcopy
+            inserted again are also updated. This scans the table.
+    :return: list
+            Days updated
+    """
+    start_time = time.time()
+    missing = "(greeks_close IS NULL OR greeks_close <> close)" if stale else "greeks_close IS NULL"
+    query = "SELECT DISTINCT timestamp FROM %s WHERE instrument_class = '%s' AND %s" % (
+        dbc.table_name, Instrument.option, missing)
+    with dbc.cursor() as cur:
+        cur.execute(query)
+        days = sorted(row[0] for row in cur.fetchall())
+    print("Days to update: %s" % len(days))
+
+    total_options = 0
+    for data_date in days:
+        day_start_time = time.time()
+        options = dbc.update_day_greeks(data_date, only_missing=True)
+        total_options += options
+        print("%s: %s options in %.3f secs" % (data_date, options, time.time() - day_start_time))
+    if days:
+        dbc.advance_watermark('greeks', days[-1])
+
+    print("Options updated: %s" % total_options)
+    print("Total time taken: %s secs" % (time.time() - start_time))
+    return days
@@ -2,13 +2,18 @@ import logging
 from datetime import date
 
 import mibian
+import numpy
 
+import black_scholes
 from model import GreekValues
 
 _logger = logging.getLogger("greeks_calculator")
 
 """
 Definitions written in this file are based on the mibian library for greeks calculation.
+The batch variants take arrays for a whole chain and return GreekValues of arrays. They are computed with the
+vectorized formulas of black_scholes in the units of mibian i.e. interest and volatility in %, days to expiry over 365,
+theta per day and vega, rho for a change of 1%.
 """
 
 
@@ -156,3 +161,99 @@ def put_call_parity(underlying_price: float, strike_price: float, interest: floa
         _logger.warning("Enter a date greater than today")
         _logger.info("You entered: %s" % expiry_date)
         return
+
+
+def days_to_expiry_batch(expiry_date, obs_date=None):
+    """
+    It returns the number of days left for the expiry of every option from the date of observation.
+    :param expiry_date: array
+                Expiry dates. date objects or datetime64 values.
+    :param obs_date: date or array
+                Observation dates. By default the current date.
+    :return: array
+                Number of days to expiry
+    """
+    obs_date = obs_date if obs_date is not None else date.today()
+    return (numpy.asarray(expiry_date, dtype='datetime64[D]') - numpy.asarray(obs_date, dtype='datetime64[D]')).astype(
+        numpy.int64)
+
+
+def _batch_inputs(underlying_price, strike_price, interest, expiry_date, obs_date):
+    """
+    Helper function for converting the inputs of the batch variants to arrays in decimals and years
+    :return: tuple(array, array, array, array, array)
+            Returns spot, strike, rate, days to expiry and time to expiry in years
+    """
+    days = days_to_expiry_batch(expiry_date, obs_date)
+    spot, strike, rate, days = numpy.broadcast_arrays(numpy.asarray(underlying_price, dtype=numpy.float64),
+                                                      numpy.asarray(strike_price, dtype=numpy.float64),
+                                                      numpy.asarray(interest, dtype=numpy.float64) / 100, days)
+    if (days < 0).any():
+        _logger.warning("Enter a date greater than today")
+        _logger.info("Expired options: %s" % (days < 0).sum())
+    return spot, strike, rate, days, days / black_scholes.days_in_year
+
+
+def option_price_batch(underlying_price, strike_price, interest, expiry_date, volatility, obs_date=None):
+    """
+    It is used to evaluate theoretical prices and greeks of many options at once. Parameters are same as option_price
+    but can be arrays, which are broadcast against each other.
+    Values are 0 for the options which are expired or expire on the day of observation, same as option_price.
+    :return: GreekValues
+            Each value is an array
+    """
+    spot, strike, rate, days, tau = _batch_inputs(underlying_price, strike_price, interest, expiry_date, obs_date)
+    vol = numpy.broadcast_to(numpy.asarray(volatility, dtype=numpy.float64) / 100, spot.shape)
+    live = days > 0
+    with numpy.errstate(all='ignore'):
+        tau = numpy.where(live, tau, 1.0)
+        call_price = black_scholes.price(spot, strike, tau, vol, True, rate)
+        put_price = black_scholes.price(spot, strike, tau, vol, False, rate)
+        call_delta, gamma, call_theta, vega, call_rho = black_scholes.greeks(spot, strike, tau, vol, True, rate)
+        put_delta, _, put_theta, _, put_rho = black_scholes.greeks(spot, strike, tau, vol, False, rate)
+        # Dual delta is the change in price for a change of 1 in the strike
+        discount = numpy.exp(-rate * tau)
+        d2 = (numpy.log(spot / strike) + (rate - vol * vol / 2) * tau) / (vol * numpy.sqrt(tau))
+        call_dual_delta = -discount * black_scholes.norm_cdf(d2)
+        put_dual_delta = discount * black_scholes.norm_cdf(-d2)
+
+    values = [call_price, call_delta, call_dual_delta, call_theta / black_scholes.days_in_year, call_rho / 100,
+              put_price, put_delta, put_dual_delta, put_theta / black_scholes.days_in_year, put_rho / 100, vega / 100,
+              gamma]
+    return GreekValues(*[numpy.where(live, value, 0.0) for value in values])
+
+
+def implied_vol_batch(underlying_price, strike_price, interest, expiry_date, obs_date=None, call_price=None,
+                      put_price=None):
+    """
+    It is used to find the implied volatility of many options at once. All the options are solved together by
+    black_scholes.implied_vol. Parameters are same as implied_vol but can be arrays.
+    Either call_price or put_price should be given. If both are given then call is evaluated.
+    :return: array
+                Implied volatility in %, NaN for the options which are expired or couldn't be solved
+    """
+    if (call_price is None) & (put_price is None):
+        _logger.warning("Either call or put price need to be given")
+        return
+    spot, strike, rate, days, tau = _batch_inputs(underlying_price, strike_price, interest, expiry_date, obs_date)
+    call = call_price is not None
+    iv = black_scholes.implied_vol(call_price if call else put_price, spot, strike, tau, call, rate)
+    return numpy.where(days > 0, iv * 100, numpy.nan)
+
+
+def put_call_parity_batch(underlying_price, strike_price, interest, expiry_date, obs_date=None, call_price=None,
+                          put_price=None):
+    """
+    This is used to find the put call parity for many options at once. Parameters are same as put_call_parity but
+    can be arrays. Both call and put option price are required.
+    :return: tuple(array, array)
+                Returns put call parity and implied volatility of the call, NaN for the options which are expired
+    """
+    if (call_price is None) | (put_price is None):
+        _logger.warning("Both call and put price need to be given")
+        return
+    spot, strike, rate, days, tau = _batch_inputs(underlying_price, strike_price, interest, expiry_date, obs_date)
+    call_price, put_price = [numpy.asarray(value, dtype=numpy.float64) for value in (call_price, put_price)]
+    parity = call_price - put_price - spot + strike / (1 + rate) ** tau
+    iv = black_scholes.implied_vol(call_price, spot, strike, tau, True, rate)
+    return numpy.where(days > 0, parity, numpy.nan), numpy.where(days > 0, iv * 100, numpy.nan)
@@ -0,0 +1,332 @@
+import time
+
+import numpy
+import pandas as pd
+
+import black_scholes
+import chain_summary
+import database_connection as dbc
+from constants import Instrument, Keys
+
+"""
+Definitions written in this file are used to fit the implied volatility surface of the options.
+The smile of every symbol, expiry and day is fitted as a quadratic in log moneyness k = ln(strike / forward)
+    iv(k) = a + b * k + c * k^2
+by least squares, all the smiles of a batch of days at once from their summed normal equations. Only Out of Money
+options are taken i.e. puts below and calls at or above the forward, which is the underlying kept by chain_summary.
+Fitted parameters are kept in surface_table, updated for the days of chain_summary not fitted yet. IVSurface is made
+from the stored parameters and gives the IV at any strike, day and expiry, or on a moneyness x time to expiry grid.
+IV is in percent, same as the iv column of the FO table.
+"""
+
+surface_table = 'fo_iv_surface'
+surface_index = 'idx_surface_timestamp'
+surface_columns = ['symbol', 'expiry', 'timestamp', 'forward', 'a', 'b', 'c', 'points', 'rmse']
+# Options farther than this from the forward in log moneyness are not fitted
+max_log_moneyness = 0.5
+# Keeps the slope and curvature of smiles with too few strikes near 0
+ridge = 1e-8
+# Days fitted from the FO table in one query
+days_per_query = 20
+# Days after 1970 fit in these many bits of the integer keys
+day_bits = 20
+# Surfaces already read from the database, cleared when the parameters are updated
+_surfaces = {}
+
+
+def fit_smiles(group_index, groups: int, log_moneyness, iv):
+    """
+    It fits the smile of every group of options at once.
+    :param group_index: array
+            Group of each option, an integer from 0
+    :param groups: int
+            Number of groups
+    :param log_moneyness: array
+            ln(strike / forward) of each option
+    :param iv: array
+            IV of each option
+    :return: tuple(array, array, array, array, array)
+            a, b, c, number of options and root mean square error of each group. NaN for groups without options.
+    """
+    k = numpy.asarray(log_moneyness, dtype=numpy.float64)
+    iv = numpy.asarray(iv, dtype=numpy.float64)
+    powers = [numpy.bincount(group_index, weights=k ** n, minlength=groups) for n in range(5)]
+    targets = [numpy.bincount(group_index, weights=iv * k ** n, minlength=groups) for n in range(3)]
+    # Normal equations of each group, (groups x 3 x 3)
+    matrix = numpy.stack([numpy.stack(powers[row:row + 3], axis=-1) for row in range(3)], axis=1)
+    matrix[:, 1, 1] += ridge
+    matrix[:, 2, 2] += ridge
+    points = powers[0]
+    has_points = points > 0
+    matrix[~has_points] = numpy.eye(3)
+    params = numpy.linalg.solve(matrix, numpy.stack(targets, axis=-1)[..., None])[..., 0]
+    params[~has_points] = numpy.nan
+    a, b, c = params[:, 0], params[:, 1], params[:, 2]
+
+    residual = iv - (a[group_index] + b[group_index] * k + c[group_index] * k * k)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        rmse = numpy.sqrt(numpy.bincount(group_index, weights=residual * residual, minlength=groups) / points)
+    return a, b, c, points.astype(numpy.int64), rmse
+
+
+def fit_surface(df: pd.DataFrame, forward: pd.DataFrame):
+    """
+    It fits the smiles of all the symbols, expiries and days in the data.
+    :param df: DataFrame
+            Options with the columns symbol, expiry, timestamp, strike, option_typ and iv. Dates are datetime64.
+    :param forward: DataFrame
+            Columns symbol, expiry, timestamp and forward. Dates are datetime64.
+    :return: DataFrame
+            Columns in surface_columns, sorted on symbol, expiry and timestamp
+    """
+    keys = ['symbol', 'expiry', 'timestamp']
+    df = df.merge(forward, how='inner', on=keys)
+    k = numpy.log(df.strike.values / df.forward.values)
+    call = (df.option_typ == Keys.call).values
+    otm = numpy.where(call, k >= 0, k < 0) & df.option_typ.isin([Keys.call, Keys.put]).values
+    taken = otm & (df.iv.values > 0) & (numpy.abs(k) <= max_log_moneyness) & numpy.isfinite(k)
+    df, k = df[taken], k[taken]
+
+    grouped = df.groupby(keys, sort=True, observed=True)
+    group_index = grouped.ngroup().values
+    fitted = grouped.forward.first().reset_index()
+    fitted['a'], fitted['b'], fitted['c'], fitted['points'], fitted['rmse'] = fit_smiles(
+        group_index, len(fitted), k, df.iv.values)
+    return fitted[surface_columns]
+
+
+def check_table():
+    """
+    This checks for the surface table in the database. If not present then it creates the table.
+    :return: None
+    """
+    backend = dbc.get_backend()
+    with dbc.cursor(commit=True) as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS %s (symbol varchar(30) NOT NULL, expiry date NOT NULL, "
+                    "timestamp date NOT NULL, forward double, a double, b double, c double, points int, rmse double, "
+                    "PRIMARY KEY (symbol, expiry, timestamp))" % surface_table)
+        # Days are replaced as a whole
+        if surface_index not in backend.index_names(cur, surface_table):
+            cur.execute(backend.add_index_query(surface_table, surface_index, "(timestamp)"))
+
+
+def _store_days(days: list, fitted: pd.DataFrame):
+    """
+    It replaces the fitted parameters of the days.
+    :param days: list
+            Days to be replaced
+    :param fitted: DataFrame
+            As returned by fit_surface
+    :return: int
+            Number of rows stored
+    """
+    values = [fitted.symbol.astype(str).tolist(), fitted.expiry.values.astype('datetime64[D]').tolist(),
+              fitted.timestamp.values.astype('datetime64[D]').tolist()]
+    values += [fitted[column].values.astype(float).tolist() for column in surface_columns[3:]]
+    values[surface_columns.index('points')] = [int(value) for value in values[surface_columns.index('points')]]
+    rows = list(zip(*values))
+    # Days are deleted and inserted in one transaction, so a failure doesn't leave them missing
+    with dbc.cursor(commit=True) as cur:
+        for data_date in days:
+            cur.execute("DELETE FROM %s WHERE timestamp = %%s" % surface_table, (data_date,))
+        return dbc.insert_many("INSERT INTO %s (%s) VALUES (%s)" % (surface_table, ", ".join(surface_columns),
+                                                                  ", ".join(["%s"] * len(surface_columns))), rows,
+                               cur=cur)
+
+
+def update_surface(restart: bool = False, days: list = None):
+    """
+    This fits the smiles of the days in chain_summary without fitted smiles, e.g. for the daily EOD run after the
+    greeks are updated. Days are searched, so days loaded out of order are also fitted. Days without any smile are
+    fitted again on the next run.
+    :param restart: bool
+            If True, all the days in the database are fitted again.
+    :param days: list
+            Days to be fitted again e.g. the days whose IVs were updated. If None, the days without smiles are fitted.
+    :return: int
+            Number of days updated
+    """
+    start_time = time.time()
+    chain_summary.check_table()
+    check_table()
+    if restart:
+        with dbc.cursor(commit=True) as cur:
+            cur.execute(dbc.get_backend().truncate_query(surface_table))
+    if days is None or restart:
+        query = "SELECT DISTINCT timestamp FROM %s WHERE timestamp NOT IN (SELECT timestamp FROM %s)" % (
+            chain_summary.summary_table, surface_table)
+        days = sorted(row[0] for row in dbc.execute_simple_query(query))
+    else:
+        days = sorted(set(days))
+    print("Days to fit: %s" % len(days))
+
+    fields = ['symbol', 'expiry', 'timestamp', 'strike', 'option_typ', 'iv']
+    for i in range(0, len(days), days_per_query):
+        batch = days[i:i + days_per_query]
+        df = dbc.execute_typed_query("SELECT %s FROM %s WHERE timestamp BETWEEN '%s' AND '%s' AND "
+                                     "instrument_class = '%s'" % (", ".join(fields), dbc.table_name, batch[0],
+                                                                  batch[-1], Instrument.option), fields)
+        forward = dbc.execute_typed_query(
+            "SELECT symbol, expiry, timestamp, underlying FROM %s WHERE timestamp BETWEEN '%s' AND '%s' AND "
+            "underlying IS NOT NULL" % (chain_summary.summary_table, batch[0], batch[-1]),
+            ['symbol', 'expiry', 'timestamp', 'forward'])
+        # Days in between which are not in the batch are left as they are
+        df = df[df.timestamp.isin(pd.to_datetime(batch))]
+        forward = forward[forward.timestamp.isin(pd.to_datetime(batch))]
+        df['symbol'], forward['symbol'] = df.symbol.astype(str), forward.symbol.astype(str)
+        forward['forward'] = forward.forward.astype(numpy.float64)
+        count = _store_days(batch, fit_surface(df, forward))
+        print("%s to %s: %s smiles" % (batch[0], batch[-1], count))
+    _surfaces.clear()
+    print("Total time taken: %s secs" % (time.time() - start_time))
+    return len(days)
+
+
+def load_surface(symbol: str, start_date=None, end_date=None):
+    """
+    It returns the IV surface of a symbol from the stored parameters. Surfaces are kept in memory once read.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param start_date: date
+            First day to be taken
+    :param end_date: date
+            Last day to be taken
+    :return: IVSurface
+    """
+    key = (symbol.upper(), start_date, end_date)
+    if key not in _surfaces:
+        query = "SELECT %s FROM %s WHERE symbol = '%s'" % (", ".join(surface_columns), surface_table, symbol.upper())
+        if start_date is not None:
+            query += " AND timestamp >= '%s'" % start_date
+        if end_date is not None:
+            query += " AND timestamp <= '%s'" % end_date
+        rows = dbc.execute_simple_query(query + " AND points > 0")
+        values = list(zip(*rows)) if rows else [()] * len(surface_columns)
+        params = [numpy.array(column, dtype=numpy.float64) for column in values[3:7]]
+        _surfaces[key] = IVSurface(numpy.array(values[1], dtype='datetime64[D]'),
+                                   numpy.array(values[2], dtype='datetime64[D]'), *params)
+    return _surfaces[key]
+
+
+class IVSurface:
+    """
+    IV surface of a symbol made of the smiles fitted for each expiry and day.
+    Between the fitted days of an expiry, IV is interpolated linearly in time, and between expiries, total variance
+    iv^2 * t is interpolated linearly in time to expiry. Outside the fitted range, the nearest smile is taken.
+    """
+
+    def __init__(self, expiry, timestamp, forward, a, b, c):
+        """
+        It initializes a surface from the fitted parameters.
+        :param expiry: array
+                Expiry of each smile, datetime64[D]
+        :param timestamp: array
+                Day of each smile, datetime64[D]
+        :param forward: array
+                Forward of each smile
+        :param a: array
+                IV at the forward
+        :param b: array
+                Slope of the smile
+        :param c: array
+                Curvature of the smile
+        """
+        order = numpy.lexsort((timestamp, expiry))
+        self.expiry, self.timestamp = expiry[order], timestamp[order]
+        self.forward, self.a, self.b, self.c = forward[order], a[order], b[order], c[order]
+        self._keys = (self.expiry.astype(numpy.int64) << day_bits) + self.timestamp.astype(numpy.int64)
+        self.days = numpy.unique(self.timestamp)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _smile(self, row, log_moneyness):
+        """
+        IV of the smiles of the rows at the log moneyness.
+        """
+        return self.a[row] + self.b[row] * log_moneyness + self.c[row] * log_moneyness * log_moneyness
+
+    def iv(self, strike, timestamp, expiry):
+        """
+        It returns the IV at the strikes for the days and expiries. Parameters are broadcast against each other.
+        :param strike: float or array
+                Strike price
+        :param timestamp: date or array
+                Day. date objects or datetime64 values.
+        :param expiry: date or array
+                Expiry. It must be one of the fitted expiries, otherwise IV is NaN.
+        :return: array
+        """
+        strike, timestamp, expiry = numpy.broadcast_arrays(
+            numpy.asarray(strike, dtype=numpy.float64), numpy.asarray(timestamp, dtype='datetime64[D]'),
+            numpy.asarray(expiry, dtype='datetime64[D]'))
+        expiry_key = expiry.astype(numpy.int64) << day_bits
+        position = numpy.searchsorted(self._keys, expiry_key + timestamp.astype(numpy.int64))
+        # Fitted days of the expiry are from first to last - 1
+        first = numpy.searchsorted(self._keys, expiry_key)
+        last = numpy.searchsorted(self._keys, expiry_key + (1 << day_bits))
+        found = last > first
+        if len(self) == 0:
+            return numpy.full(strike.shape, numpy.nan)
+        high = numpy.clip(position, first, numpy.maximum(last - 1, first)).clip(0, len(self) - 1)
+        low = numpy.clip(position - 1, first, numpy.maximum(last - 1, first)).clip(0, len(self) - 1)
+        day = timestamp.astype(numpy.float64)
+        low_day, high_day = self.timestamp[low].astype(numpy.float64), self.timestamp[high].astype(numpy.float64)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            weight = numpy.where(high_day > low_day, (day - low_day) / (high_day - low_day), 0.0)
+        weight = numpy.clip(weight, 0, 1)
+        low_iv = self._smile(low, numpy.log(strike / self.forward[low]))
+        high_iv = self._smile(high, numpy.log(strike / self.forward[high]))
+        return numpy.where(found, low_iv + weight * (high_iv - low_iv), numpy.nan)
+
+    def grid(self, timestamp, moneyness, tenors):
+        """
+        It returns the IV on a fixed moneyness x time to expiry grid for the fitted days.
+        :param timestamp: date or array
+                Fitted days. date objects or datetime64 values.
+        :param moneyness: array
+                strike / forward e.g. [0.9, 0.95, 1.0, 1.05, 1.1]
+        :param tenors: array
+                Time to expiry in years e.g. [30 / 365, 60 / 365, 90 / 365]
+        :return: array
+                (days x tenors x moneyness) IV. NaN for days which are not fitted.
+        """
+        days = numpy.atleast_1d(numpy.asarray(timestamp, dtype='datetime64[D]'))
+        log_moneyness = numpy.log(numpy.asarray(moneyness, dtype=numpy.float64))
+        tenors = numpy.asarray(tenors, dtype=numpy.float64)
+        result = numpy.full((len(days), len(tenors), len(log_moneyness)), numpy.nan)
+        if len(self) == 0:
+            return result
+
+        # Smiles of each day, padded to the most expiries in a day and sorted on time to expiry
+        order = numpy.lexsort((self.expiry, self.timestamp))
+        day_of_row = self.timestamp[order]
+        row_days, day_start, day_count = numpy.unique(day_of_row, return_index=True, return_counts=True)
+        slot = numpy.arange(len(order)) - numpy.repeat(day_start, day_count)
+        rows = numpy.full((len(row_days), day_count.max()), -1)
+        rows[numpy.searchsorted(row_days, day_of_row), slot] = order
+        tau = numpy.where(rows >= 0, black_scholes.year_fraction(self.expiry[rows], self.timestamp[rows]), numpy.inf)
+
+        position = numpy.searchsorted(row_days, days).clip(0, len(row_days) - 1)
+        found = row_days[position] == days
+        rows, tau, count = rows[position[found]], tau[position[found]], day_count[position[found]]
+        # Expiries on either side of each tenor, (days x tenors)
+        high = (tau[:, :, None] < tenors[None, None, :]).sum(axis=1)
+        low = numpy.clip(high - 1, 0, None)
+        high = numpy.minimum(high, count[:, None] - 1)
+        day_index = numpy.arange(len(rows))[:, None]
+        low_row, high_row = rows[day_index, low], rows[day_index, high]
+        low_tau, high_tau = tau[day_index, low], tau[day_index, high]
+
+        low_iv = self._smile(low_row[..., None], log_moneyness[None, None, :])
+        high_iv = self._smile(high_row[..., None], log_moneyness[None, None, :])
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            weight = numpy.where(high_tau > low_tau, (tenors[None, :] - low_tau) / (high_tau - low_tau), 0.0)
+            weight = numpy.clip(weight, 0, 1)[..., None]
+            # Total variance between the expiries, nearest smile outside them
+            variance = (1 - weight) * low_iv ** 2 * low_tau[..., None] + weight * high_iv ** 2 * high_tau[..., None]
+            interpolated = numpy.sqrt(variance / tenors[None, :, None])
+        inside = (high_tau > low_tau)[..., None] & (weight > 0) & (weight < 1)
+        nearest = numpy.where(weight >= 1, high_iv, low_iv)
+        result[found] = numpy.where(inside, interpolated, nearest)
+        return result
@@ -1,24 +1,26 @@
+import os
+import time
+import webbrowser
+from collections import OrderedDict
 from datetime import date, datetime
 
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+import dash_table
 import pandas as pd
 import plotly.graph_objs as go
 import plotly.offline as py
 from dash.dependencies import Input, Output, State
 
-import database_connection as dbc
+import chain_store
+import chain_summary
 from constants import Keys
 
-fut_df = pd.DataFrame()
-opt_df = pd.DataFrame()
-
-strikes = []
-call_oi = []
-put_oi = []
-call_iv = []
-put_iv = []
+summary_df = pd.DataFrame()
+store = None
+# Watch last displayed, used by the OI and IV charts
+watch = None
 
 header_style = {'color': "white", "background": "black"}
 border = "2px solid black"
@@ -26,6 +28,14 @@ itm_color = '#FBF5CD'
 call_color = "#FFCCFF"
 put_color = "#CCECFF"
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
+# Columns shown for each call and put, in the order of the table header
+watch_fields = ['theta', 'gamma', 'delta', 'vega', 'iv', 'close', 'contracts', 'chg_in_oi']
+watch_headers = ["Theta", "Gamma", "Delta", "Vega", "IV", "Close", "Contracts", "Change in OI", ]
+# Watches kept in memory and the seconds for which they are valid
+cache_size = 64
+cache_ttl = 300
+# Directory of the OI and IV charts, written once for each watch
+chart_dir = 'market_watch_charts/'
 
 market_watch_app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
@@ -69,10 +79,123 @@ market_watch_app.layout = html.Div([
         ]),
     ]),
     html.Br(),
-    html.Table(id='market_watch')
+    # Only the rows in view are rendered by the browser
+    dash_table.DataTable(
+        id='market_watch',
+        columns=[{'name': head, 'id': 'call_%s' % field} for head, field in zip(watch_headers, watch_fields)] +
+                [{'name': "Strike", 'id': 'strike'}] +
+                [{'name': head, 'id': 'put_%s' % field} for head, field in
+                 reversed(list(zip(watch_headers, watch_fields)))],
+        data=[],
+        hidden_columns=['itm'],
+        virtualization=True,
+        fixed_rows={'headers': True},
+        page_action='none',
+        style_table={'height': '600px', 'overflowY': 'auto'},
+        style_header=header_style,
+        style_data={"border": border},
+        style_data_conditional=[{'if': {'column_id': 'call_%s' % field}, 'background': call_color} for field in
+                                watch_fields] +
+                               [{'if': {'column_id': 'put_%s' % field}, 'background': itm_color} for field in
+                                watch_fields] +
+                               [{'if': {'column_id': 'call_%s' % field, 'filter_query': '{itm} eq 1'},
+                                 'background': itm_color} for field in watch_fields] +
+                               [{'if': {'column_id': 'put_%s' % field, 'filter_query': '{itm} eq 1'},
+                                 'background': put_color} for field in watch_fields] +
+                               [{'if': {'column_id': 'strike'}, 'background': "#C2C2C2"}],
+    )
 ])
 
 
+class _WatchCache:
+    """
+    This is used to keep the latest watches in memory. Least recently used watches are dropped when it is full and
+    watches older than the time to live are not returned.
+    """
+
+    def __init__(self, size: int, ttl: float, on_remove=None):
+        """
+        It creates an empty cache.
+        :param size: int
+                    Number of watches kept
+        :param ttl: float
+                    Seconds for which a watch is valid
+        :param on_remove: function
+                    Called with every watch dropped from the cache. If None, nothing is called.
+        """
+        self.size = size
+        self.ttl = ttl
+        self.on_remove = on_remove
+        self._items = OrderedDict()
+
+    def _removed(self, value):
+        """
+        It is called for a watch dropped from the cache.
+        :param value: dict
+        :return: None
+        """
+        if self.on_remove is not None:
+            self.on_remove(value)
+
+    def get(self, key):
+        """
+        It returns a watch and marks it as the most recently used.
+        :param key: tuple
+        :return: dict
+                    None if not present or expired
+        """
+        item = self._items.get(key)
+        if item is None:
+            return None
+        created, value = item
+        if time.monotonic() - created > self.ttl:
+            del self._items[key]
+            self._removed(value)
+            return None
+        self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        It adds a watch, dropping the least recently used one if the cache is full.
+        :param key: tuple
+        :param value: dict
+        :return: None
+        """
+        previous = self._items.get(key)
+        if previous is not None and previous[1] is not value:
+            self._removed(previous[1])
+        self._items[key] = (time.monotonic(), value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._removed(self._items.popitem(last=False)[1][1])
+
+    def clear(self):
+        """
+        It removes all the watches.
+        :return: None
+        """
+        for created, value in self._items.values():
+            self._removed(value)
+        self._items.clear()
+
+
+def _remove_charts(watch_data: dict):
+    """
+    It deletes the chart files written for a watch, so that they don't pile up in chart_dir.
+    :param watch_data: dict
+            Watch as made by _watch
+    :return: None
+    """
+    for path in watch_data['charts'].values():
+        if os.path.isfile(path):
+            os.remove(path)
+    watch_data['charts'].clear()
+
+
+watch_cache = _WatchCache(cache_size, cache_ttl, _remove_charts)
+
+
 @market_watch_app.callback(
     Output('status', 'children'),
     inputs=[Input('fetch', 'n_clicks')], state=[State('scrip', 'value')])
@@ -85,12 +208,12 @@ def fetch_data(n_clicks, scrip_name):
             Name of the scrip for which data is required.
     :return: status of the data
     """
-    global fut_df, opt_df
+    global summary_df, store
     if n_clicks is not None:
         scrip_name = scrip_name.upper()
-        future_data, option_data = _symbol_data(scrip_name)
-        fut_df = pd.DataFrame(future_data, columns=dbc.columns)
-        opt_df = pd.DataFrame(option_data, columns=dbc.columns)
+        summary_df, store = _symbol_data(scrip_name)
+        # Watches are made again from the data just fetched
+        watch_cache.clear()
         return "Ready"
     else:
         return "Not Ready"
@@ -104,21 +227,22 @@ def get_expiry_list(n_clicks):
             Button clicks for the button id get_expiry
     :return: list of date of expiry
     """
-    global fut_df
+    global summary_df
     expiry_list = []
     if n_clicks is not None:
-        df_expiry = fut_df.sort_values('expiry').expiry.unique()
-        for expiry_date in df_expiry.tolist():
-            expiry_list.append({'label': expiry_date.strftime("%d %b %Y"), 'value': expiry_date})
+        df_expiry = summary_df.sort_values('expiry').expiry.unique()
+        for expiry_date in pd.to_datetime(df_expiry):
+            expiry_list.append({'label': expiry_date.strftime("%d %b %Y"), 'value': expiry_date.date()})
     return expiry_list
 
 
-@market_watch_app.callback(Output('market_watch', 'children'), [Input('display', 'n_clicks')],
+@market_watch_app.callback(Output('market_watch', 'data'), [Input('display', 'n_clicks')],
                            state=[State('expiry_list', 'value'), State('start_strike', 'value'),
                                   State('end_strike', 'value'), State('gap', 'value'), State('date_picker', 'date')])
 def display_watch(n_clicks, expiry_date, start_strike, end_strike, gap, obs_date):
     """
     This is used to display match watch contents after selection of expiry and observation date.
+    Watches already displayed are taken from watch_cache.
     :param n_clicks: int
             Button clicks for the id 'display'
     :param expiry_date: str
@@ -133,73 +257,62 @@ def display_watch(n_clicks, expiry_date, start_strike, end_strike, gap, obs_date
             Observation date
     :return: table rows to be displayed to table id market_watch
     """
-    global opt_df, fut_df, strikes, call_oi, put_oi, call_iv, put_iv
+    global store, watch
     if n_clicks is not None:
         fmt = "%Y-%m-%d"
-        expiry = [datetime.strptime(expiry_date, fmt).date()]
+        expiry_date_value = datetime.strptime(expiry_date, fmt).date()
         start_strike = int(start_strike) if start_strike is not None else None
         end_strike = int(end_strike) if end_strike is not None else None
         gap = int(gap) if gap is not None else None
-        timestamp = [datetime.strptime(obs_date, fmt).date()]
-        option_call = [Keys.call]
-        option_put = [Keys.put]
-        fut_data = fut_df[fut_df.expiry.isin(expiry) & fut_df.timestamp.isin(timestamp)]
-        underlying = None
-        for udrly in fut_data.itertuples():
-            underlying = udrly.close
-
-        call_data = opt_df[
-            opt_df.expiry.isin(expiry) & opt_df.timestamp.isin(timestamp) & opt_df.option_typ.isin(option_call)]
-        put_data = opt_df[
-            opt_df.expiry.isin(expiry) & opt_df.timestamp.isin(timestamp) & opt_df.option_typ.isin(option_put)]
-        strikes = []
-        call_oi = []
-        put_oi = []
-        call_iv = []
-        put_iv = []
-        for row in call_data.itertuples():
-            if start_strike or end_strike or gap:
-                if (start_strike <= row.strike <= end_strike) & (row.strike % gap == 0):
-                    strikes.append(row.strike)
-            else:
-                strikes.append(row.strike)
-        v = ["Theta", "Gamma", "Delta", "Vega", "IV", "Close", "Contracts", "Change in OI", ]
-        w = v.copy()
-        w.reverse()
-        table_header = v + ["Strike"] + w
-        header = html.Tr([html.Td(head) for head in table_header], style=header_style)
-
-        table_rows = [header]
-
-        if underlying is not None:
-            for strike in strikes:
-                strike_row = []
-                itm = True if strike < underlying else False
-
-                call = call_data[call_data.strike == strike]
-                put = put_data[put_data.strike == strike]
-
-                for ce in call.itertuples():
-                    x = [ce.theta, ce.gamma, ce.delta, ce.vega, ce.iv, ce.close, ce.contracts, ce.chg_in_oi, ]
-                    call_oi.append(ce.open_int)
-                    call_iv.append(ce.iv if ce.iv != 0 else None)
-                    call_row = [html.Td(k, style={"background": itm_color if itm else call_color, }) for k in x]
-                    strike_row.append(call_row)
-
-                strike_row[-1] += [html.Td(strike, style={"background": "#C2C2C2", "border": border})]
-
-                for pe in put.itertuples():
-                    y = [pe.theta, pe.gamma, pe.delta, pe.vega, pe.iv, pe.close, pe.contracts, pe.chg_in_oi]
-                    put_oi.append(pe.open_int)
-                    put_iv.append(pe.iv if pe.iv != 0 else None)
-                    y.reverse()
-                    put_row = [html.Td(k, style={"background": put_color if itm else itm_color}) for k in y]
-                    strike_row[-1] += put_row
-
-                row = html.Tr(strike_row[0], style={"border": border})
-                table_rows.append(row)
-
-        return table_rows
+        obs_date_value = datetime.strptime(obs_date, fmt).date()
+
+        key = (store.symbol, expiry_date_value, obs_date_value, start_strike, end_strike, gap)
+        watch = watch_cache.get(key)
+        if watch is None:
+            watch = _watch(expiry_date_value, obs_date_value, start_strike, end_strike, gap)
+            # Charts of the watch are kept in files named after the key
+            watch['name'] = "_".join(str(value) for value in key if value is not None)
+            watch_cache.put(key, watch)
+        return watch['rows']
+
+
+def _watch(expiry_date: date, obs_date: date, start_strike: int, end_strike: int, gap: int):
+    """
+    It makes the watch of an expiry on a day. Parameters are same as display_watch.
+    :return: dict
+            Rows of the table, the strikes with OI and IV of the calls and puts for the charts and the paths of the
+            charts already written
+    """
+    global summary_df, store
+    # Future of the expiry on the day from the daily aggregates
+    fut_data = summary_df[(summary_df.expiry == expiry_date) & (summary_df.timestamp == obs_date)]
+    underlying = None
+    for udrly in fut_data.itertuples():
+        underlying = udrly.fut_close
+
+    # Options of the expiry on the day are a slice of the store, looked up by strike and type
+    chain = store.chain(expiry_date, obs_date)
+    watch_data = dict(rows=[], strikes=[], call_oi=[], put_oi=[], call_iv=[], put_iv=[], charts={})
+    strikes = watch_data['strikes']
+    for strike in chain.calls['strike'].tolist():
+        strike = int(strike) if strike.is_integer() else strike
+        if start_strike or end_strike or gap:
+            if (start_strike <= strike <= end_strike) & (strike % gap == 0):
+                strikes.append(strike)
+        else:
+            strikes.append(strike)
+
+    if underlying is not None:
+        for strike in strikes:
+            row = dict(strike=strike, itm=1 if strike < underlying else 0)
+            for option_type, prefix in ((Keys.call, 'call'), (Keys.put, 'put')):
+                option = chain.get(strike, option_type)
+                if option is not None:
+                    row.update({'%s_%s' % (prefix, field): option[field].item() for field in watch_fields})
+                    watch_data['%s_oi' % prefix].append(option['open_int'].item())
+                    watch_data['%s_iv' % prefix].append(option['iv'].item() if option['iv'] != 0 else None)
+            watch_data['rows'].append(row)
+    return watch_data
 
 
 @market_watch_app.callback(
@@ -212,31 +325,9 @@ def display_oi(n_clicks):
             Button clicks for id oi_status
     :return: None
     """
-    global strikes, call_oi, put_oi
+    global watch
     if n_clicks is not None:
-        trace1 = go.Bar(
-            x=strikes,
-            y=call_oi,
-            name="Call OI",
-            textposition='outside',
-        )
-
-        trace2 = go.Bar(
-            x=strikes,
-            y=put_oi,
-            name="Put OI",
-            textposition='outside',
-        )
-
-        data = [trace1, trace2]
-        layout = go.Layout(
-            title='OI Analysis',
-            xaxis=dict(tickangle=-45),
-            barmode='group',
-        )
-        fig = go.Figure(data=data, layout=layout)
-
-        py.plot(fig, filename='oi_chart.html')
+        _open_chart(watch, 'oi', lambda data: _oi_figure(data['strikes'], data['call_oi'], data['put_oi']))
         return "Displaying OI..."
 
 
@@ -250,20 +341,94 @@ def display_iv(n_clicks):
             Button clicks for id iv_status
     :return: None
     """
-    global strikes, call_iv, put_iv
+    global watch
     if n_clicks is not None:
-        trace1 = go.Scatter(x=strikes, y=call_iv, name="Call IV")
-        trace2 = go.Scatter(x=strikes, y=put_iv, name="Put IV")
+        _open_chart(watch, 'iv', lambda data: _iv_figure(data['strikes'], data['call_iv'], data['put_iv']))
+        return "Displaying IV..."
 
-        data = [trace1, trace2]
-        layout = go.Layout(
-            title='IV Graph',
-            xaxis=dict(tickangle=-45),
-        )
-        fig = go.Figure(data=data, layout=layout)
 
-        py.plot(fig, filename='iv_chart.html')
-        return "Displaying IV..."
+def _open_chart(watch_data: dict, chart: str, make_figure):
+    """
+    It opens a chart of the watch in the browser. HTML of the chart is written by plotly once for each watch, later
+    clicks open the file already written.
+    :param watch_data: dict
+            Watch as made by _watch. If None, an empty chart is written and not kept.
+    :param chart: str
+            Name of the chart. Possible values: oi, iv
+    :param make_figure: function
+            Called with the watch, returns the Figure
+    :return: None
+    """
+    if watch_data is None:
+        empty = dict(strikes=[], call_oi=[], put_oi=[], call_iv=[], put_iv=[])
+        py.plot(make_figure(empty), filename='%s_chart.html' % chart)
+        return
+    path = watch_data['charts'].get(chart)
+    if path is not None and os.path.isfile(path):
+        webbrowser.open('file://' + os.path.abspath(path))
+        return
+    os.makedirs(chart_dir, exist_ok=True)
+    path = os.path.join(chart_dir, '%s_chart_%s.html' % (chart, watch_data['name']))
+    py.plot(make_figure(watch_data), filename=path)
+    watch_data['charts'][chart] = path
+
+
+def _oi_figure(strikes: list, call_oi: list, put_oi: list):
+    """
+    It makes the OI bar chart of the calls and puts.
+    :param strikes: list
+            Strikes of the watch
+    :param call_oi: list
+            Open interest of the calls
+    :param put_oi: list
+            Open interest of the puts
+    :return: Figure
+    """
+    trace1 = go.Bar(
+        x=strikes,
+        y=call_oi,
+        name="Call OI",
+        textposition='outside',
+    )
+
+    trace2 = go.Bar(
+        x=strikes,
+        y=put_oi,
+        name="Put OI",
+        textposition='outside',
+    )
+
+    data = [trace1, trace2]
+    layout = go.Layout(
+        title='OI Analysis',
+        xaxis=dict(tickangle=-45),
+        barmode='group',
+    )
+    fig = go.Figure(data=data, layout=layout)
+    return fig
+
+
+def _iv_figure(strikes: list, call_iv: list, put_iv: list):
+    """
+    It makes the IV line chart of the calls and puts.
+    :param strikes: list
+            Strikes of the watch
+    :param call_iv: list
+            IV of the calls
+    :param put_iv: list
+            IV of the puts
+    :return: Figure
+    """
+    trace1 = go.Scatter(x=strikes, y=call_iv, name="Call IV")
+    trace2 = go.Scatter(x=strikes, y=put_iv, name="Put IV")
+
+    data = [trace1, trace2]
+    layout = go.Layout(
+        title='IV Graph',
+        xaxis=dict(tickangle=-45),
+    )
+    fig = go.Figure(data=data, layout=layout)
+    return fig
 
 
 def _symbol_data(symbol):
@@ -271,15 +436,13 @@ def _symbol_data(symbol):
     It get the data for the given symbol
     :param symbol: str
             Symbol for which data is required. eg. NIFTY
-    :return: tuple(list, list)
-            Returns futures data and options data
+    :return: tuple(DataFrame, ChainStore)
+            Returns daily aggregates of the monthly expiries and the store of the option chains. Options are read by
+            the store when an expiry is first displayed.
     """
     print("Fetching data...")
-    option_query = "Select * from %s where symbol='%s' and instrument like 'OPT%%' " % (dbc.table_name, symbol,)
-    option_data = dbc.execute_simple_query(option_query)
-    future_query = "Select * from %s where symbol='%s' and instrument like 'FUT%%' " % (dbc.table_name, symbol,)
-    future_data = dbc.execute_simple_query(future_query)
-    return future_data, option_data
+    summary = chain_summary.load_summary(symbol, monthly=True)
+    return summary, chain_store.ChainStore(symbol)
 
 
 def get_market_watch_app():
@@ -0,0 +1,161 @@
+import numpy
+
+from constants import Keys
+from model import MaxPainValues
+
+"""
+Definitions written in this file are used to find the max pain of option chains with NumPy.
+Pain of a strike is the money paid by the option writers if the underlying settles at that strike.
+Options of any number of chains (e.g. days of an expiry, or symbols and expiries of a day) are sorted by chain and
+strike, and the pain of every strike of every chain is found at once with cumulative sums restarting at each chain.
+Only the strikes listed for both calls and puts in a chain are taken, same as option_strategy.max_pain did.
+"""
+
+default_top = 5
+
+
+def _segment_cumsum(values, starts):
+    """
+    Cumulative sum which restarts at the start of every segment.
+    :param values: array
+            Values sorted by segment
+    :param starts: array
+            Index of the first value of each segment, the first one is 0
+    :return: array
+    """
+    total = numpy.cumsum(values)
+    offsets = numpy.concatenate([[0], total[starts[1:] - 1]]).astype(total.dtype)
+    lengths = numpy.diff(numpy.append(starts, len(values)))
+    return total - numpy.repeat(offsets, lengths)
+
+
+def chain_pain(chain_index, strike, option_type, open_int):
+    """
+    It finds the pain of every strike of every chain.
+    pain(K) = sum(call_oi[i] * (K - K[i]) for K[i] < K) + sum(put_oi[i] * (K[i] - K) for K[i] > K)
+    Both sums are found with cumulative sums over the sorted strikes, so it takes O(options log options) overall.
+    Integer strikes and open interest, as kept in the database, are summed exactly in int64.
+    :param chain_index: array
+            Chain of each option, an integer from 0
+    :param strike: array
+            Strike price of each option
+    :param option_type: array
+            Type of each option. Possible values: CE, PE
+    :param open_int: array
+            Open interest of each option
+    :return: tuple(array, array, array)
+            Chain, strike and pain of the strikes listed for both calls and puts. Sorted by chain and strike.
+    """
+    strike = numpy.asarray(strike)
+    dtype = numpy.int64 if numpy.issubdtype(strike.dtype, numpy.integer) else numpy.float64
+    open_int = numpy.asarray(open_int, dtype=numpy.float64)
+    call = numpy.asarray(option_type) == Keys.call
+    put = numpy.asarray(option_type) == Keys.put
+
+    strikes, strike_index = numpy.unique(strike, return_inverse=True)
+    keys, key_index = numpy.unique(numpy.asarray(chain_index, dtype=numpy.int64) * len(strikes) + strike_index,
+                                   return_inverse=True)
+    # Sums of open interest are exact in float64 well beyond any real open interest
+    call_oi = numpy.bincount(key_index[call], weights=open_int[call], minlength=len(keys)).astype(dtype)
+    put_oi = numpy.bincount(key_index[put], weights=open_int[put], minlength=len(keys)).astype(dtype)
+    common = (numpy.bincount(key_index[call], minlength=len(keys)) > 0) & (
+            numpy.bincount(key_index[put], minlength=len(keys)) > 0)
+    keys, call_oi, put_oi = keys[common], call_oi[common], put_oi[common]
+
+    chain = keys // len(strikes)
+    strike_value = strikes[keys % len(strikes)].astype(dtype)
+    if len(keys) == 0:
+        return chain, strike_value, numpy.zeros(0)
+    starts = numpy.flatnonzero(numpy.concatenate([[True], chain[1:] != chain[:-1]]))
+    lengths = numpy.diff(numpy.append(starts, len(keys)))
+    # Calls at or below each strike
+    call_oi_below = _segment_cumsum(call_oi, starts)
+    call_value_below = _segment_cumsum(call_oi * strike_value, starts)
+    # Puts at or above each strike i.e. all the puts of the chain less the ones below the strike
+    put_value = put_oi * strike_value
+    put_oi_above = numpy.repeat(numpy.add.reduceat(put_oi, starts), lengths) - _segment_cumsum(put_oi, starts) + put_oi
+    put_value_above = numpy.repeat(numpy.add.reduceat(put_value, starts), lengths) - \
+        _segment_cumsum(put_value, starts) + put_value
+    # Strike itself adds nothing to either sum as its payoff is 0
+    pain = (strike_value * call_oi_below - call_value_below) + (put_value_above - strike_value * put_oi_above)
+    return chain, strike_value, pain.astype(numpy.float64)
+
+
+def top_strikes(chain, strike, pain, chains: int, top: int = default_top):
+    """
+    It finds the strikes with the least pain of every chain.
+    :param chain: array
+            Chain of each strike, sorted. As returned by chain_pain.
+    :param strike: array
+            Strike price
+    :param pain: array
+            Pain of the strike
+    :param chains: int
+            Number of chains
+    :param top: int
+            Number of strikes to be returned for each chain
+    :return: tuple(array, array)
+            (chains x top) strikes in ascending order, NaN if the chain has fewer strikes.
+            Average of the strikes of each chain truncated to an integer, NaN if the chain has no strikes.
+    """
+    # Least pain first, lower strike first on ties
+    order = numpy.lexsort((strike, pain, chain))
+    chain, strike = chain[order], strike[order]
+    first = numpy.flatnonzero(numpy.concatenate([[True], chain[1:] != chain[:-1]])) if len(chain) else chain
+    rank = numpy.arange(len(chain)) - numpy.repeat(first, numpy.diff(numpy.append(first, len(chain))))
+    taken = rank < top
+
+    result = numpy.full((chains, top), numpy.nan)
+    result[chain[taken], rank[taken]] = strike[taken]
+    result.sort(axis=1)
+    count = numpy.isfinite(result).sum(axis=1)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        average = numpy.trunc(numpy.where(count > 0, numpy.nansum(result, axis=1) / count, numpy.nan))
+    return result, average
+
+
+def max_pain(timestamp, strike, option_type, open_int, top: int = default_top):
+    """
+    It finds the max pain of an option chain for all the days at once.
+    Days without strikes listed for both calls and puts are left out.
+    :param timestamp: array
+            Timestamp of each option. date objects or datetime64 values.
+    :param strike: array
+            Strike price of each option
+    :param option_type: array
+            Type of each option. Possible values: CE, PE
+    :param open_int: array
+            Open interest of each option
+    :param top: int
+            Number of strikes with the least pain to be returned for each day
+    :return: MaxPainValues
+    """
+    days, day_index = numpy.unique(numpy.asarray(timestamp, dtype='datetime64[D]'), return_inverse=True)
+    strikes = numpy.unique(numpy.asarray(strike))
+    day, day_strike, pain_values = chain_pain(day_index, strike, option_type, open_int)
+    pain = numpy.full((len(days), len(strikes)), numpy.nan)
+    pain[day, numpy.searchsorted(strikes, day_strike)] = pain_values
+    top_values, average = top_strikes(day, day_strike, pain_values, len(days), top)
+
+    has_strikes = numpy.bincount(day, minlength=len(days)) > 0
+    return MaxPainValues(days[has_strikes], strikes, pain[has_strikes], top_values[has_strikes],
+                         average[has_strikes])
+
+
+def expiry_max_pain(timestamp, expiry, strike, option_type, open_int, top: int = default_top):
+    """
+    It finds the max pain of every expiry in the data. Parameters are same as max_pain.
+    :param expiry: array
+            Expiry of each option. date objects or datetime64 values.
+    :return: dict
+            Key is the expiry (datetime64[D]) and value is MaxPainValues
+    """
+    expiry = numpy.asarray(expiry, dtype='datetime64[D]')
+    timestamp = numpy.asarray(timestamp, dtype='datetime64[D]')
+    strike, option_type, open_int = numpy.asarray(strike), numpy.asarray(option_type), numpy.asarray(open_int)
+    order = numpy.argsort(expiry, kind='stable')
+    expiries, starts = numpy.unique(expiry[order], return_index=True)
+    result = {}
+    for expiry_date, rows in zip(expiries, numpy.split(order, starts[1:])):
+        result[expiry_date] = max_pain(timestamp[rows], strike[rows], option_type[rows], open_int[rows], top)
+    return result
@@ -0,0 +1,181 @@
+import time
+
+import numpy
+import pandas as pd
+
+import database_connection as dbc
+import max_pain_engine
+from constants import Instrument
+
+"""
+Definitions written in this file keep the max pain of every symbol and expiry in the database.
+For every day, the max pain strikes of each symbol and expiry are stored in summary_table and the pain of every strike
+in curve_table. Both are updated day by day for the days not done yet, so the daily run only does the new days and
+days loaded out of order are not missed.
+Dashboards and backtests look the values up with load_max_pain and load_pain_curve.
+"""
+
+summary_table = 'fo_max_pain'
+curve_table = 'fo_max_pain_curve'
+curve_index = 'idx_curve_timestamp'
+# Number of strikes with the least pain stored for each day
+top = max_pain_engine.default_top
+summary_columns = ['symbol', 'expiry', 'timestamp', 'underlying', 'max_pain_strikes', 'average']
+curve_columns = ['symbol', 'expiry', 'timestamp', 'strike', 'pain']
+
+
+def _check_tables(restart: bool = False):
+    """
+    This checks for the max pain tables in the database. If not present then it creates the tables.
+    :param restart: bool
+            If True, the stored values are removed so that all the days are done again.
+    :return: None
+    """
+    backend = dbc.get_backend()
+    with dbc.cursor(commit=True) as cur:
+        cur.execute("CREATE TABLE IF NOT EXISTS %s (symbol varchar(30) NOT NULL, expiry date NOT NULL, "
+                    "timestamp date NOT NULL, underlying double, max_pain_strikes varchar(100), average int, "
+                    "PRIMARY KEY (symbol, expiry, timestamp))" % summary_table)
+        cur.execute("CREATE TABLE IF NOT EXISTS %s (symbol varchar(30) NOT NULL, expiry date NOT NULL, "
+                    "timestamp date NOT NULL, strike int NOT NULL, pain double, "
+                    "PRIMARY KEY (symbol, expiry, timestamp, strike))" % curve_table)
+        # Days are replaced as a whole
+        if curve_index not in backend.index_names(cur, curve_table):
+            cur.execute(backend.add_index_query(curve_table, curve_index, "(timestamp)"))
+        if restart:
+            cur.execute(backend.truncate_query(summary_table))
+            cur.execute(backend.truncate_query(curve_table))
+            print("Max pain tables cleared")
+
+
+def _day_max_pain(data_date):
+    """
+    It finds the max pain of all the symbols and expiries of a day, all the chains at once.
+    :param data_date: date
+            Timestamp for which max pain is to be found
+    :return: tuple(List[tuple], List[tuple])
+            Rows for summary_table and curve_table
+    """
+    options = dbc.execute_typed_query(
+        "SELECT symbol, expiry, strike, option_typ, open_int FROM %s WHERE timestamp = '%s' AND "
+        "instrument_class = '%s'" % (dbc.table_name, data_date, Instrument.option),
+        ['symbol', 'expiry', 'strike', 'option_typ', 'open_int'], arrays=True)
+    if len(options['symbol']) == 0:
+        return [], []
+    chains, chain_index = numpy.unique(numpy.rec.fromarrays([options['symbol'], options['expiry']]),
+                                       return_inverse=True)
+    chain, strike, pain = max_pain_engine.chain_pain(chain_index, options['strike'], options['option_typ'],
+                                                     options['open_int'])
+    top_strikes, average = max_pain_engine.top_strikes(chain, strike, pain, len(chains), top)
+
+    # Futures of the same expiry month are the underlying
+    futures = dbc.execute_typed_query(
+        "SELECT symbol, expiry, close FROM %s WHERE timestamp = '%s' AND instrument_class = '%s'" % (
+            dbc.table_name, data_date, Instrument.future), ['symbol', 'expiry', 'close'], arrays=True)
+    underlying = {(symbol, month): close for symbol, month, close in
+                  zip(futures['symbol'].tolist(), futures['expiry'].astype('datetime64[M]').tolist(),
+                      futures['close'].tolist())}
+
+    summary_rows = []
+    symbols, expiries = chains.f0.tolist(), chains.f1.tolist()
+    month = chains.f1.astype('datetime64[M]').tolist()
+    for i in numpy.flatnonzero(numpy.isfinite(average)).tolist():
+        strikes = ",".join(str(int(value)) for value in top_strikes[i] if value == value)
+        summary_rows.append((symbols[i], expiries[i], data_date, underlying.get((symbols[i], month[i])), strikes,
+                             int(average[i])))
+    curve_rows = list(zip(chains.f0[chain].tolist(), chains.f1[chain].tolist(), [data_date] * len(chain),
+                          strike.astype(numpy.int64).tolist(), pain.tolist()))
+    return summary_rows, curve_rows
+
+
+def _store_day(data_date, summary_rows: list, curve_rows: list):
+    """
+    It replaces the stored max pain of a day. Day is deleted and inserted in one transaction, so a failure doesn't
+    leave it missing.
+    :return: None
+    """
+    with dbc.cursor(commit=True) as cur:
+        cur.execute("DELETE FROM %s WHERE timestamp = %%s" % summary_table, (data_date,))
+        cur.execute("DELETE FROM %s WHERE timestamp = %%s" % curve_table, (data_date,))
+        dbc.insert_many("INSERT INTO %s (%s) VALUES (%s)" % (summary_table, ", ".join(summary_columns),
+                                                             ", ".join(["%s"] * len(summary_columns))), summary_rows,
+                        cur=cur)
+        dbc.insert_many("INSERT INTO %s (%s) VALUES (%s)" % (curve_table, ", ".join(curve_columns),
+                                                             ", ".join(["%s"] * len(curve_columns))), curve_rows,
+                        cur=cur)
+
+
+def update_max_pain(restart: bool = False):
+    """
+    This stores the max pain of the days with options which have no stored max pain, e.g. for the daily EOD run.
+    Days are searched, so days loaded out of order are also done. A day is replaced as a whole, so doing it again is
+    harmless.
+    :param restart: bool
+            If True, all the days in the database are done again.
+    :return: int
+            Number of days updated
+    """
+    start_time = time.time()
+    _check_tables(restart)
+    query = "SELECT DISTINCT timestamp FROM %s WHERE instrument_class = '%s' AND timestamp NOT IN " \
+            "(SELECT timestamp FROM %s)" % (dbc.table_name, Instrument.option, summary_table)
+    days = sorted(row[0] for row in dbc.execute_simple_query(query))
+    print("Days to update: %s" % len(days))
+
+    for data_date in days:
+        day_start_time = time.time()
+        summary_rows, curve_rows = _day_max_pain(data_date)
+        _store_day(data_date, summary_rows, curve_rows)
+        print("%s: %s chains in %.3f secs" % (data_date, len(summary_rows), time.time() - day_start_time))
+
+    print("Total time taken: %s secs" % (time.time() - start_time))
+    return len(days)
+
+
+def load_max_pain(symbol: str, expiry_month: int = None, expiry_year: int = None, start_date=None, end_date=None):
+    """
+    It returns the stored max pain of a symbol.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param expiry_month: int
+            Expiry month. If None, all the expiries are returned.
+    :param expiry_year: int
+            Year of the expiry month.
+    :param start_date: date
+            First timestamp to be returned.
+    :param end_date: date
+            Last timestamp to be returned.
+    :return: DataFrame
+            Columns are summary_columns. max_pain_strikes is a list of int. Sorted on expiry and timestamp.
+    """
+    query = "SELECT %s FROM %s WHERE symbol = '%s'" % (", ".join(summary_columns), summary_table, symbol.upper())
+    if expiry_month is not None and expiry_year is not None:
+        first_day, last_day = dbc.expiry_range(expiry_month, expiry_year)
+        query += " AND expiry BETWEEN '%s' AND '%s'" % (first_day, last_day)
+    if start_date is not None:
+        query += " AND timestamp >= '%s'" % start_date
+    if end_date is not None:
+        query += " AND timestamp <= '%s'" % end_date
+    query += " ORDER BY expiry ASC, timestamp ASC"
+    df = pd.DataFrame(dbc.execute_simple_query(query), columns=summary_columns)
+    df['max_pain_strikes'] = [[int(strike) for strike in strikes.split(",")] if strikes else [] for strikes in
+                              df.max_pain_strikes]
+    return df
+
+
+def load_pain_curve(symbol: str, expiry, timestamp):
+    """
+    It returns the stored pain of every strike of a symbol and expiry on a day.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param expiry: date
+            Expiry date
+    :param timestamp: date
+            Day of the pain curve
+    :return: tuple(list, list)
+            Strikes in ascending order and their pain
+    """
+    query = "SELECT strike, pain FROM %s WHERE symbol = '%s' AND expiry = '%s' AND timestamp = '%s' " \
+            "ORDER BY strike ASC" % (curve_table, symbol.upper(), expiry, timestamp)
+    result = dbc.execute_simple_query(query)
+    return [row[0] for row in result], [row[1] for row in result]
@@ -1,6 +1,15 @@
 from decimal import Decimal
 
+import numpy
+
 PRECISION = Decimal(10) ** -2
+# Columns of an OptionChain. Prices, IV and greeks are floats so that missing values can be NaN, counts are integers.
+chain_dtype = numpy.dtype([('strike', numpy.float64), ('option_typ', 'U2'), ('expiry', 'datetime64[D]'),
+                           ('timestamp', 'datetime64[D]'), ('open', numpy.float64), ('high', numpy.float64),
+                           ('low', numpy.float64), ('close', numpy.float64), ('settle_pr', numpy.float64),
+                           ('contracts', numpy.int64), ('open_int', numpy.int64), ('chg_in_oi', numpy.int64),
+                           ('iv', numpy.float64), ('delta', numpy.float64), ('gamma', numpy.float64),
+                           ('theta', numpy.float64), ('vega', numpy.float64)])
 
 
 class GreekValues:
@@ -58,7 +67,7 @@ class StrikeEntry:
     This is used to make a option's entry for analysis
     """
 
-    def __init__(self, strike: int, option_type: str, signal: str = None, premium: float = None):
+    def __init__(self, strike: int, option_type: str, signal: str = None, premium: float = None, quantity: int = 1):
         """
         It creates an instance which refers to different properties of the option.
         :param strike: int
@@ -69,11 +78,322 @@ class StrikeEntry:
                     Signal for the option. Either 'buy' or 'sell'
         :param premium: float
                     Premium paid or received for the option.
+        :param quantity: int
+                    Number of lots of the option. Defaults to 1.
         """
         self.strike = strike
         self.option_type = option_type
         self.signal = signal
         self.premium = premium
+        self.quantity = quantity
 
     def __str__(self) -> str:
         return "%s %s%s" % (self.signal, self.strike, self.option_type)
+
+
+class MaxPainValues:
+    """
+    This class is used for the max pain of an option chain over a number of days.
+    """
+
+    def __init__(self, days, strikes, pain, top_strikes, average):
+        """
+        It initializes an instance which contains the max pain of each day.
+        :param days: array
+                Days in ascending order, datetime64[D]
+        :param strikes: array
+                Strikes in ascending order
+        :param pain: array
+                (days x strikes) money paid by the option writers if the underlying settles at the strike.
+                NaN for strikes not listed on the day.
+        :param top_strikes: array
+                (days x top) strikes with the least pain in ascending order. NaN if the day has fewer strikes.
+        :param average: array
+                Average of the top strikes of each day, truncated to an integer
+        """
+        self.days = days
+        self.strikes = strikes
+        self.pain = pain
+        self.top_strikes = top_strikes
+        self.average = average
+
+
+class PCRValues:
+    """
+    This class is used for the put call ratio of option chains, one value for each symbol, day and expiry.
+    """
+
+    def __init__(self, symbol, timestamp, expiry, underlying, call_oi, put_oi, call_volume, put_volume, oi_pcr,
+                 volume_pcr):
+        """
+        It initializes an instance which contains the open interest and volume of the calls and puts.
+        All the parameters are arrays of the same length, sorted on symbol, timestamp and expiry.
+        :param symbol: array
+                Symbol e.g. NIFTY
+        :param timestamp: array
+                Day, datetime64[D]
+        :param expiry: array
+                Expiry of the options, datetime64[D]
+        :param underlying: array
+                Close of the near month future on the day. NaN if not present.
+        :param call_oi: array
+                Open interest of the calls
+        :param put_oi: array
+                Open interest of the puts
+        :param call_volume: array
+                Contracts traded of the calls
+        :param put_volume: array
+                Contracts traded of the puts
+        :param oi_pcr: array
+                Open interest of the puts by open interest of the calls. NaN if the calls have no open interest.
+        :param volume_pcr: array
+                Contracts traded of the puts by contracts traded of the calls. NaN if no calls are traded.
+        """
+        self.symbol = symbol
+        self.timestamp = timestamp
+        self.expiry = expiry
+        self.underlying = underlying
+        self.call_oi = call_oi
+        self.put_oi = put_oi
+        self.call_volume = call_volume
+        self.put_volume = put_volume
+        self.oi_pcr = oi_pcr
+        self.volume_pcr = volume_pcr
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+
+class DeltaIVValues:
+    """
+    This class is used for the IV of the options at constant deltas, one row for each day (and expiry).
+    """
+
+    def __init__(self, timestamp, expiry, targets, call_iv, put_iv, call_strike, put_strike, call_delta, put_delta):
+        """
+        It initializes an instance which contains the IV series at each delta target.
+        Call arrays are taken at +target and put arrays at -target. Values are NaN where no option is found.
+        :param timestamp: array
+                Day of each row, datetime64[D]
+        :param expiry: array
+                Expiry of each row, datetime64[D]
+        :param targets: array
+                Absolute delta targets e.g. [0.1, 0.25, 0.5]
+        :param call_iv: array
+                (rows x targets) IV of the calls
+        :param put_iv: array
+                (rows x targets) IV of the puts
+        :param call_strike: array
+                (rows x targets) Strike of the calls the IV is taken from
+        :param put_strike: array
+                (rows x targets) Strike of the puts the IV is taken from
+        :param call_delta: array
+                (rows x targets) Delta of the calls the IV is taken from
+        :param put_delta: array
+                (rows x targets) Delta of the puts the IV is taken from
+        """
+        self.timestamp = timestamp
+        self.expiry = expiry
+        self.targets = targets
+        self.call_iv = call_iv
+        self.put_iv = put_iv
+        self.call_strike = call_strike
+        self.put_strike = put_strike
+        self.call_delta = call_delta
+        self.put_delta = put_delta
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+
+class PriceMatrix:
+    """
+    This class is used for the prices of the contracts of an option chain, one row for each day.
+    """
+
+    def __init__(self, days, strikes, option_types, prices):
+        """
+        It initializes an instance which contains a (days x contracts) price matrix.
+        :param days: array
+                Days in ascending order, datetime64[D]
+        :param strikes: array
+                Strike of each contract
+        :param option_types: array
+                Type of each contract. Possible values: CE, PE
+        :param prices: array
+                (days x contracts) close price. NaN if the contract is not traded on the day.
+        """
+        self.days = days
+        self.strikes = strikes
+        self.option_types = option_types
+        self.prices = prices
+
+
+class BacktestValues:
+    """
+    This class is used for the profit and loss of a batch of option strategies over the days of a price matrix.
+    """
+
+    def __init__(self, days, leg_pl, total_pl, valid_legs):
+        """
+        It initializes an instance which contains the P&L of each strategy and its legs.
+        :param days: array
+                Days from the start date in ascending order, datetime64[D]
+        :param leg_pl: array
+                (strategies x days x legs) P&L of each leg. NaN if the leg is not traded on the day or is not valid.
+        :param total_pl: array
+                (strategies x days) P&L of the valid legs traded on the day. NaN if none of them is traded.
+        :param valid_legs: array
+                (strategies x legs) True if the leg is listed and has a price on the start date
+        """
+        self.days = days
+        self.leg_pl = leg_pl
+        self.total_pl = total_pl
+        self.valid_legs = valid_legs
+
+
+class OptionChain:
+    """
+    This class is used for the options of one expiry on one day, kept in a NumPy structured array of chain_dtype.
+    Options are sorted on option type and then strike, so the calls and the puts are contiguous and are views of the
+    same array.
+    """
+
+    def __init__(self, data, sort: bool = True):
+        """
+        It initializes an instance from the options of a chain.
+        :param data: array
+                Structured array of chain_dtype
+        :param sort: bool
+                If False, data is taken to be sorted on option type and strike already
+        """
+        if sort:
+            data = data[numpy.lexsort((data['strike'], data['option_typ']))]
+        self.data = data
+        # Calls (CE) sort before the puts (PE)
+        self._split = int(numpy.searchsorted(data['option_typ'], 'PE'))
+        self._index = None
+
+    @staticmethod
+    def records(df):
+        """
+        It converts the rows of a DataFrame to a structured array of chain_dtype. Columns of chain_dtype which are
+        not in the DataFrame are left NaN (NaT for dates, 0 for counts).
+        :param df: DataFrame
+        :return: array
+        """
+        data = numpy.zeros(len(df), dtype=chain_dtype)
+        for name in chain_dtype.names:
+            if name in df.columns:
+                data[name] = df[name].values
+            elif data.dtype[name].kind in 'fM':
+                data[name] = numpy.datetime64('NaT') if data.dtype[name].kind == 'M' else numpy.nan
+        return data
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        It makes a chain from the rows of a DataFrame, see records.
+        :param df: DataFrame
+                Options of one expiry on one day
+        :return: OptionChain
+        """
+        return cls(cls.records(df))
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def calls(self):
+        """
+        Calls in ascending order of strike, a view of data.
+        :return: array
+        """
+        return self.data[:self._split]
+
+    @property
+    def puts(self):
+        """
+        Puts in ascending order of strike, a view of data.
+        :return: array
+        """
+        return self.data[self._split:]
+
+    @property
+    def strikes(self):
+        """
+        Strikes listed for either calls or puts in ascending order.
+        :return: array
+        """
+        return numpy.union1d(self.calls['strike'], self.puts['strike'])
+
+    def index(self, strike, option_type: str) -> int:
+        """
+        It finds the position of an option in data. Positions are hashed on the first lookup.
+        :param strike: float
+                Strike of the option
+        :param option_type: str
+                Type of the option. Possible values: CE, PE
+        :return: int
+                Position of the option, -1 if it is not listed
+        """
+        if self._index is None:
+            self._index = {key: position for position, key in enumerate(
+                zip(self.data['strike'].tolist(), self.data['option_typ'].tolist()))}
+        return self._index.get((float(strike), option_type), -1)
+
+    def get(self, strike, option_type: str):
+        """
+        It returns an option of the chain.
+        :param strike: float
+                Strike of the option
+        :param option_type: str
+                Type of the option. Possible values: CE, PE
+        :return: numpy.void
+                Record of the option, None if it is not listed
+        """
+        position = self.index(strike, option_type)
+        return self.data[position] if position >= 0 else None
+
+    def between(self, low_strike: float = None, high_strike: float = None):
+        """
+        It returns the options with strike from the low strike to the high strike, both included.
+        :param low_strike: float
+                If None, strikes are not bounded below
+        :param high_strike: float
+                If None, strikes are not bounded above
+        :return: OptionChain
+        """
+        parts = []
+        for options in (self.calls, self.puts):
+            start = numpy.searchsorted(options['strike'], low_strike, 'left') if low_strike is not None else 0
+            end = numpy.searchsorted(options['strike'], high_strike, 'right') if high_strike is not None else len(
+                options)
+            parts.append(options[start:end])
+        return OptionChain(numpy.concatenate(parts), sort=False)
+
+    def moneyness(self, underlying: float, low: float, high: float):
+        """
+        It returns the options with strike from low to high times the underlying e.g. 0.95 to 1.05.
+        :param underlying: float
+                Price of the underlying
+        :param low: float
+                Lowest strike by underlying
+        :param high: float
+                Highest strike by underlying
+        :return: OptionChain
+        """
+        return self.between(underlying * low, underlying * high)
+
+    def atm_strike(self, underlying: float):
+        """
+        It returns the listed strike nearest to the underlying, the lower one on ties.
+        :param underlying: float
+                Price of the underlying
+        :return: float
+                None if no option is listed
+        """
+        strikes = self.strikes
+        if len(strikes) == 0:
+            return None
+        return strikes[numpy.argmin(numpy.abs(strikes - underlying))]
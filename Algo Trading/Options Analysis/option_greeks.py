@@ -1,3 +1,5 @@
+import threading
+from collections import OrderedDict
 from datetime import date
 
 from QuantLib import *
@@ -6,8 +8,175 @@ from constants import Keys
 
 """
 Definitions written in this file are based on the QuantLib library for greeks calculation.
+QuantLibPricer keeps the latest options priced, each with its own spot and volatility quotes, process and engine, so
+pricing a contract again only updates its SimpleQuote handles in place. Quotes are not shared between options, as
+every option observing a quote would be recalculated on each update.
+Evaluation date of QuantLib is global to the process, so it is set under a lock for every calculation.
+QuantLib objects are not shared between threads, each thread gets its own pricer from pricer().
+Processes of a pool have their own QuantLib settings and pricers.
 """
 
+# Options kept by a pricer, least recently used are dropped
+max_cached_options = 1000
+# Yield curves of calculation dates kept by a pricer
+max_cached_dates = 32
+# Bounds of the implied volatility search
+min_vol = 0.001
+max_vol = 1000
+max_evaluations = 1000000
+accuracy = 1.0e-4
+
+_evaluation_lock = threading.RLock()
+_local = threading.local()
+
+
+def _ql_date(value: date):
+    """
+    It converts a date to a QuantLib Date.
+    :param value: date
+    :return: Date
+    """
+    return Date(value.day, value.month, value.year)
+
+
+class QuantLibPricer:
+    """
+    This is used to price European options with QuantLib without rebuilding the objects for every option.
+    """
+
+    def __init__(self, risk_free_rate: float = 0.0):
+        """
+        It creates a pricer with empty caches.
+        :param risk_free_rate: float
+                    Risk free interest rate in decimals
+        """
+        self.risk_free_rate = risk_free_rate
+        self.day_count = Actual365Fixed()
+        self.calendar = India()
+        # Serial number of the calculation date -> flat yield curve, it never changes so options can share it
+        self._curves = OrderedDict()
+        # (calculation date, expiry date, strike, option type) -> (spot quote, volatility quote, process, option)
+        self._options = OrderedDict()
+
+    def _curve(self, calculation_date: Date):
+        """
+        It returns the yield curve of a calculation date, made once.
+        :param calculation_date: Date
+        :return: YieldTermStructureHandle
+        """
+        key = calculation_date.serialNumber()
+        curve = self._curves.get(key)
+        if curve is None:
+            curve = YieldTermStructureHandle(FlatForward(calculation_date, self.risk_free_rate, self.day_count))
+            self._curves[key] = curve
+            if len(self._curves) > max_cached_dates:
+                self._curves.popitem(last=False)
+        else:
+            self._curves.move_to_end(key)
+        return curve
+
+    def _option(self, strike_price: float, expiry_date: Date, option_type: str, calculation_date: Date):
+        """
+        It returns the option of a contract priced on a calculation date with its own quotes, made once.
+        :return: tuple(SimpleQuote, SimpleQuote, BlackScholesProcess, EuropeanOption)
+        """
+        key = (calculation_date.serialNumber(), expiry_date.serialNumber(), float(strike_price), option_type)
+        graph = self._options.get(key)
+        if graph is not None:
+            self._options.move_to_end(key)
+            return graph
+        spot_quote, vol_quote = SimpleQuote(0.0), SimpleQuote(0.0)
+        flat_vol_ts = BlackVolTermStructureHandle(BlackConstantVol(calculation_date, self.calendar,
+                                                                   QuoteHandle(vol_quote), self.day_count))
+        bs_process = BlackScholesProcess(QuoteHandle(spot_quote), self._curve(calculation_date), flat_vol_ts)
+        option = Option.Put if option_type == Keys.put else Option.Call
+        european_option = EuropeanOption(PlainVanillaPayoff(option, float(strike_price)), EuropeanExercise(expiry_date))
+        european_option.setPricingEngine(AnalyticEuropeanEngine(bs_process))
+        graph = (spot_quote, vol_quote, bs_process, european_option)
+        self._options[key] = graph
+        if len(self._options) > max_cached_options:
+            self._options.popitem(last=False)
+        return graph
+
+    def _evaluate(self, calculation_date: Date, calculation):
+        """
+        It runs a calculation with the evaluation date of QuantLib set to the calculation date.
+        Evaluation date is only set when it changes and is left at the calculation date afterwards, as every change
+        notifies all the QuantLib objects alive, including the cached options.
+        :param calculation_date: Date
+        :param calculation: function
+                Called without arguments
+        :return: Result of the calculation
+        """
+        with _evaluation_lock:
+            settings = Settings.instance()
+            if settings.evaluationDate != calculation_date:
+                settings.evaluationDate = calculation_date
+            return calculation()
+
+    def greeks(self, spot_price: float, strike_price: float, expiry_date: date, option_type: str, volatility: float,
+               calculation_date: date = None):
+        """
+        It is used to find option greeks from the volatility. Parameters are same as get_option_greeks except that
+        volatility is in decimals.
+        :return: tuple(float, float, float, float, float)
+                Returns delta, gamma, theta, vega, rho for the option data entered
+        """
+        calculation_date = _ql_date(calculation_date) if calculation_date is not None else Date.todaysDate()
+        spot_quote, vol_quote, _, european_option = self._option(strike_price, _ql_date(expiry_date), option_type,
+                                                                 calculation_date)
+
+        def calculation():
+            spot_quote.setValue(float(spot_price))
+            vol_quote.setValue(float(volatility))
+            return (european_option.delta(), european_option.gamma(), european_option.thetaPerDay(),
+                    european_option.vega(), european_option.rho())
+
+        return self._evaluate(calculation_date, calculation)
+
+    def implied_greeks(self, spot_price: float, strike_price: float, expiry_date: date, option_type: str,
+                       option_price: float, calculation_date: date = None, volatility: float = None):
+        """
+        It is used to find option greeks from the implied volatility of the option price. Parameters are same as
+        get_greeks.
+        :return: tuple(float, float, float, float, float)
+                Returns implied volatility (in %), theta, gamma, delta, vega. All are "''" if the implied volatility
+                couldn't be found.
+        """
+        calculation_date = _ql_date(calculation_date) if calculation_date is not None else Date.todaysDate()
+        spot_quote, vol_quote, bs_process, european_option = self._option(strike_price, _ql_date(expiry_date),
+                                                                          option_type, calculation_date)
+
+        def calculation():
+            spot_quote.setValue(float(spot_price))
+            if volatility is not None:
+                vol_quote.setValue(float(volatility))
+            try:
+                iv = european_option.impliedVolatility(float(option_price), bs_process, accuracy, max_evaluations,
+                                                       min_vol, max_vol)
+                vol_quote.setValue(iv)
+                return (iv * 100, european_option.thetaPerDay(), european_option.gamma(), european_option.delta(),
+                        european_option.vega())
+            except RuntimeError:
+                return "''", "''", "''", "''", "''"
+
+        return self._evaluate(calculation_date, calculation)
+
+
+def pricer(risk_free_rate: float = 0.0):
+    """
+    It returns the pricer of the current thread for the rate, made on the first call.
+    :param risk_free_rate: float
+            Risk free interest rate in decimals
+    :return: QuantLibPricer
+    """
+    pricers = getattr(_local, 'pricers', None)
+    if pricers is None:
+        pricers = _local.pricers = {}
+    if risk_free_rate not in pricers:
+        pricers[risk_free_rate] = QuantLibPricer(risk_free_rate)
+    return pricers[risk_free_rate]
+
 
 def get_greeks(spot_price: float, strike_price: float, expiry_date: date, option_type: str, option_price: float,
                calculation_date: date = None, volatility: float = None):
@@ -31,56 +200,8 @@ def get_greeks(spot_price: float, strike_price: float, expiry_date: date, option
     :return: tuple(float, float, float, float, float)
             Returns implied volatility, theta, gamma, delta, vega for the option data entered
     """
-    maturity_date = Date(expiry_date.day, expiry_date.month, expiry_date.year)
-    # volatility = 0.0  # the historical vols for a year
-    # print(spot_price, strike_price, expiry_date, option_type, option_price, calculation_date)
-
-    option = Option.Call
-    if option_type == Keys.call:
-        option = Option.Call
-    if option_type == Keys.put:
-        option = Option.Put
-    risk_free_rate = 0.0
-    day_count = Actual365Fixed()
-    calendar = India()
-    if calculation_date is not None:
-        calculation_date = Date(calculation_date.day, calculation_date.month, calculation_date.year)
-        Settings.instance().evaluationDate = calculation_date
-
-    payoff = PlainVanillaPayoff(option, strike_price)
-    exercise = EuropeanExercise(maturity_date)
-    european_option = EuropeanOption(payoff, exercise)
-
-    spot_handle = QuoteHandle(SimpleQuote(spot_price))
-    flat_ts = YieldTermStructureHandle(FlatForward(calculation_date, risk_free_rate, day_count))
-    flat_vol_ts = BlackVolTermStructureHandle(BlackConstantVol(calculation_date, calendar, volatility, day_count))
-    bs_process = BlackScholesProcess(spot_handle, flat_ts, flat_vol_ts)
-
-    try:
-        iv = european_option.impliedVolatility(targetValue=option_price, process=bs_process, minVol=0.001, maxVol=1000,
-                                               maxEvaluations=1000000)
-        # iv = iv * 100
-        flat_vol_ts = BlackVolTermStructureHandle(BlackConstantVol(calculation_date, calendar, iv, day_count))
-        bs_process = BlackScholesProcess(spot_handle, flat_ts, flat_vol_ts)
-
-        european_option.setPricingEngine(AnalyticEuropeanEngine(bs_process))
-        # bs_price = european_option.NPV()
-        iv = iv * 100
-        theta = european_option.thetaPerDay()
-        gamma = european_option.gamma()
-        delta = european_option.delta()
-        vega = european_option.vega()
-        # rho = european_option.rho()
-
-    except RuntimeError:
-        iv = "''"
-        theta = "''"
-        gamma = "''"
-        delta = "''"
-        vega = "''"
-        # rho = "''"
-
-    return iv, theta, gamma, delta, vega,
+    return pricer().implied_greeks(spot_price, strike_price, expiry_date, option_type, option_price,
+                                   calculation_date, volatility)
 
 
 def get_option_greeks(spot_price, strike_price, expiry_date: date, option_type: str, volatility: float,
@@ -103,36 +224,4 @@ def get_option_greeks(spot_price, strike_price, expiry_date: date, option_type:
     :return: tuple(float, float, float, float, float)
             Returns delta, gamma, theta, vega, rho for the option data entered
     """
-    maturity_date = Date(expiry_date.day, expiry_date.month, expiry_date.year)
-
-    volatility = volatility / 100
-    option = Option.Call
-    if option_type == Keys.call:
-        option = Option.Call
-    if option_type == Keys.put:
-        option = Option.Put
-    risk_free_rate = 0.0
-    day_count = Actual365Fixed()
-    calendar = India()
-    if calculation_date is not None:
-        calculation_date = Date(calculation_date.day, calculation_date.month, calculation_date.year)
-        Settings.instance().evaluationDate = calculation_date
-
-    payoff = PlainVanillaPayoff(option, strike_price)
-    exercise = EuropeanExercise(maturity_date)
-    european_option = EuropeanOption(payoff, exercise)
-
-    spot_handle = QuoteHandle(SimpleQuote(spot_price))
-    flat_ts = YieldTermStructureHandle(FlatForward(calculation_date, risk_free_rate, day_count))
-    flat_vol_ts = BlackVolTermStructureHandle(BlackConstantVol(calculation_date, calendar, volatility, day_count))
-    bs_process = BlackScholesProcess(spot_handle, flat_ts, flat_vol_ts)
-
-    european_option.setPricingEngine(AnalyticEuropeanEngine(bs_process))
-
-    delta = european_option.delta()
-    gamma = european_option.gamma()
-    theta = european_option.thetaPerDay()
-    vega = european_option.vega()
-    rho = european_option.rho()
-
-    return delta, gamma, theta, vega, rho
+    return pricer().greeks(spot_price, strike_price, expiry_date, option_type, volatility / 100, calculation_date)
@@ -1,4 +1,4 @@
-from datetime import date, timedelta
+from datetime import date
 from typing import List
 
 import numpy
@@ -9,9 +9,9 @@ from plotly import tools
 import plotly.offline as py
 import plotly.graph_objs as go
 
-from constants import Keys
+from constants import Instrument
 from model import StrikeEntry
-import database_connection as dbc, payoff_charts
+import backtest_engine, chain_cache, chain_summary, max_pain_engine, payoff_engine, pcr_engine
 
 
 def options_strategy(symbol: str, strike_data: List[StrikeEntry], expiry_month: int, expiry_year: int, start_date: date,
@@ -40,68 +40,48 @@ def options_strategy(symbol: str, strike_data: List[StrikeEntry], expiry_month:
                 Plots the different payoffs for the strategy inputs.
     """
     symbol = symbol.upper()
-    fut_query = "Select * from %s where symbol='%s' and instrument like 'FUT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    fut_data = dbc.execute_simple_query(fut_query)
-    fut_df = pd.DataFrame(data=fut_data, columns=dbc.columns)
+    fut_df = chain_cache.load(symbol, Instrument.future, expiry_month, expiry_year, fields=['timestamp', 'close'])
     fut_timeseries_data = [[], []]
     for fut_row in fut_df.itertuples():
         timestamp = fut_row.timestamp
         if timestamp >= start_date:
             fut_timeseries_data[0].append(timestamp)
             fut_timeseries_data[1].append(fut_row.close)
-    option_query = "Select * from %s where symbol='%s' and instrument like 'OPT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    option_data = dbc.execute_simple_query(option_query)
-    option_df = pd.DataFrame(data=option_data, columns=dbc.columns)
-    payoff_data = []
+    option_df = chain_cache.load(symbol, Instrument.option, expiry_month, expiry_year,
+                                 fields=['timestamp', 'strike', 'option_typ', 'close'])
     for strikes in strike_data:
-        if type(strikes) == StrikeEntry:
-            strike = [strikes.strike]
-            option_type = [strikes.option_type]
-            strike_df = option_df[option_df.strike.isin(strike) & option_df.option_typ.isin(option_type)]
-            init_day_entry = strike_df[strike_df.timestamp == start_date]
-            if (len(init_day_entry) > 0) & (strikes.signal in [Keys.buy, Keys.sell]):
-                init_price = init_day_entry.close.values[0]
-                for row in strike_df.itertuples():
-                    timestamp = row.timestamp
-                    close = row.close
-                    if timestamp >= start_date:
-                        temp_pl = close - init_price
-                        pl = temp_pl if strikes.signal == Keys.buy else (-1 * temp_pl)
-                        payoff_data.append([timestamp, strikes.strike, strikes.option_type, pl])
-            else:
-                print("Couldn't find initial price for strike: %s%s and start date: %s" % (
-                    strikes.strike, strikes.option_type, start_date))
-        else:
+        if type(strikes) != StrikeEntry:
             print("Input can be only be of type %s given %s" % (StrikeEntry, type(strikes)))
             return
 
-    if len(payoff_data) > 0:
-        payoff_df = pd.DataFrame(payoff_data, columns=['timestamp', 'strike', 'option_typ', 'pl'])
-        timestamp_cum_pl = [[], []]
-        payoff_timestamp = payoff_df.timestamp.unique()
-        for data_timestamp in payoff_timestamp:
-            timestamp = [data_timestamp]
-            timestamp_df = payoff_df[payoff_df.timestamp.isin(timestamp)]
-            timestamp_pl = timestamp_df.pl.sum()
-            timestamp_cum_pl[0].append(data_timestamp)
-            timestamp_cum_pl[1].append(timestamp_pl)
+    # Chain is pivoted once, all the legs are done in one matrix operation
+    matrix = backtest_engine.price_matrix(option_df.timestamp.values, option_df.strike.values,
+                                          option_df.option_typ.values, option_df.close.values)
+    columns, quantity = backtest_engine.strategy_legs(matrix, [strike_data])
+    values = backtest_engine.backtest(matrix, columns, quantity, start_date)
+    for strikes, valid in zip(strike_data, values.valid_legs[0].tolist()):
+        if not valid:
+            print("Couldn't find initial price for strike: %s%s and start date: %s" % (
+                strikes.strike, strikes.option_type, start_date))
+
+    if values.valid_legs.any():
+        days = values.days.tolist()
+        traded = numpy.isfinite(values.total_pl[0])
+        timestamp_cum_pl = [[day for day, taken in zip(days, traded.tolist()) if taken],
+                            values.total_pl[0][traded].tolist()]
 
         strike_cum_pl = []
-        for strikes in strike_data:
-            strike_time_series = [[], []]
-            strike = [strikes.strike]
-            option_type = [strikes.option_type]
-            strike_payoff_df = payoff_df[payoff_df.strike.isin(strike) & payoff_df.option_typ.isin(option_type)]
-            for item in strike_payoff_df.itertuples():
-                strike_time_series[0].append(item.timestamp)
-                strike_time_series[1].append(item.pl)
+        for leg, strikes in enumerate(strike_data):
+            pl = values.leg_pl[0, :, leg]
+            traded = numpy.isfinite(pl)
+            strike_payoff_df = pd.DataFrame({'timestamp': [day for day, taken in zip(days, traded.tolist()) if taken],
+                                             'strike': strikes.strike, 'option_typ': strikes.option_type,
+                                             'pl': pl[traded]}, columns=['timestamp', 'strike', 'option_typ', 'pl'])
             strike_info = dict(
                 strike=strikes.strike,
                 option_type=strikes.option_type,
                 signal=strikes.signal,
-                timeseries=strike_time_series,
+                timeseries=[strike_payoff_df.timestamp.tolist(), strike_payoff_df.pl.tolist()],
                 df=strike_payoff_df,
             )
             strike_cum_pl.append(strike_info)
@@ -121,28 +101,10 @@ def _get_theoretical_payoffs(spot: list, strike_data: list):
     :return: tuple(list, list)
             Returns spot values and corresponding payoffs
     """
-    spot = numpy.arange(min(spot), max(spot), 100, dtype=numpy.int64).tolist()
-    payoff = []
-    for strike in strike_data:
-        premium = strike.premium if strike.premium else 100
-        if premium:
-            payoff_list = payoff_charts._get_payoff_values(spot, strike.strike, strike.option_type, premium,
-                                                           signal=strike.signal)
-            # print(payoff_list)
-            payoff.append(payoff_list)
-        else:
-            print("Parameter premium is required for %s for theoretical payoffs" % strike)
-
-    while len(payoff) > 1:
-        one = payoff[0]
-        two = payoff[1]
-        for i in range(len(one)):
-            one[i] = one[i] + two[i]
-        payoff.pop(1)
-
-    if len(payoff) == 1:
-        payoff = payoff[0]
-    return spot, payoff
+    spot = payoff_engine.spot_grid(spot)
+    # Legs without premium are taken at 100
+    payoff, _ = payoff_engine.expiry_payoff(spot, strike_data, default_premium=100)
+    return spot.tolist(), payoff.tolist()
 
 
 def _plot_options_strategy_payoffs(symbol, fut_timeseries_data, timestamp_cum_pl, strike_cum_pl, theoretical_pl,
@@ -221,6 +183,55 @@ def _plot_options_strategy_payoffs(symbol, fut_timeseries_data, timestamp_cum_pl
     py.plot(fig, filename='%s.html' % title_name)
 
 
+def strategy_value_surface(strike_data: List[StrikeEntry], spot_range: list, expiry_date: date,
+                           calculation_date: date, volatility: float, rate: float = 0.0, strategy_name: str = None):
+    """
+    It plots the P&L of the strategy at the model value of its legs for every day till expiry, along with the payoff
+    at expiry.
+    :param strike_data: List[StrikeEntry]
+                Legs of the strategy. Legs without premium are taken at 100, same as the theoretical payoffs.
+    :param spot_range: list
+                Range of spot values
+    :param expiry_date: date
+                Date of expiry of the options
+    :param calculation_date: date
+                First day of the surface
+    :param volatility: float
+                Annualised volatility in decimals, same for all the legs
+    :param rate: float
+                Risk free interest rate in decimals
+    :param strategy_name: str
+                Name of the strategy
+    :return: None
+                Plots a 3D surface for the P&L vs Spot vs Day
+    """
+    for strikes in strike_data:
+        if type(strikes) != StrikeEntry:
+            print("Input can be only be of type %s given %s" % (StrikeEntry, type(strikes)))
+            return
+    spot = payoff_engine.spot_grid(spot_range)
+    days = numpy.arange(numpy.datetime64(calculation_date, 'D'), numpy.datetime64(expiry_date, 'D') + 1)
+    z = payoff_engine.model_value(spot, strike_data, expiry_date, days, volatility, rate, default_premium=100)
+
+    trace = go.Surface(x=spot.tolist(), y=days.tolist(), z=z.tolist(), colorscale='RdBu')
+    title_name = '%s_value_surface' % (strategy_name if strategy_name else 'option_strategy')
+    layout = go.Layout(
+        title=title_name.upper(),
+        scene=dict(
+            xaxis=dict(
+                title='Spot'
+            ),
+            yaxis=dict(
+                title='Timestamp'
+            ),
+            zaxis=dict(
+                title='P&L'
+            ), )
+    )
+    fig = go.Figure(data=[trace], layout=layout)
+    py.plot(fig, filename='%s.html' % title_name)
+
+
 def oi_analytics(symbol: str, expiry_month: int, expiry_year: int, start_date: date = None):
     """
     Used for the OI Analytics of the symbol over the period of expiry
@@ -237,35 +248,16 @@ def oi_analytics(symbol: str, expiry_month: int, expiry_year: int, start_date: d
     :return: None
                 Plots the graph for oi analysis. Underlying, OI and Change in OI.
     """
-    fut_query = "Select * from %s where symbol='%s' and instrument like 'FUT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    fut_data = dbc.execute_simple_query(fut_query)
-    fut_df_current = pd.DataFrame(data=fut_data, columns=dbc.columns)
+    # Future of the expiry month from the daily aggregates
     start_date = start_date if start_date else date(expiry_year, expiry_month, 1)
-
-    timestamp_current, oi_current, settle_pr_current, chg_oi_current = [], [], [], []
-    for fut_row in fut_df_current.itertuples():
-        timestamp = fut_row.timestamp
-        if timestamp >= start_date:
-            timestamp_current.append(timestamp)
-            oi_current.append(fut_row.open_int)
-            settle_pr_current.append(fut_row.settle_pr)
-            chg_oi_current.append(fut_row.chg_in_oi)
+    current = chain_summary.load_summary(symbol, expiry_month, expiry_year, start_date, monthly=True)
+    timestamp_current, oi_current = current.timestamp.tolist(), current.fut_open_int.tolist()
+    settle_pr_current, chg_oi_current = current.fut_settle_pr.tolist(), current.fut_chg_in_oi.tolist()
 
     pre_date = start_date - relativedelta(months=1)
-    fut_query1 = "Select * from %s where symbol='%s' and instrument like 'FUT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, pre_date.month, pre_date.year)
-    fut_data_pre = dbc.execute_simple_query(fut_query1)
-    fut_df_pre = pd.DataFrame(data=fut_data_pre, columns=dbc.columns)
-
-    timestamp_pre, oi_pre, settle_pr_pre, chg_oi_pre = [], [], [], []
-    for fut_row in fut_df_pre.itertuples():
-        timestamp = fut_row.timestamp
-        if timestamp >= pre_date:
-            timestamp_pre.append(timestamp)
-            oi_pre.append(fut_row.open_int)
-            settle_pr_pre.append(fut_row.settle_pr)
-            chg_oi_pre.append(fut_row.chg_in_oi)
+    previous = chain_summary.load_summary(symbol, pre_date.month, pre_date.year, pre_date, monthly=True)
+    timestamp_pre, oi_pre = previous.timestamp.tolist(), previous.fut_open_int.tolist()
+    settle_pr_pre, chg_oi_pre = previous.fut_settle_pr.tolist(), previous.fut_chg_in_oi.tolist()
 
     trace1 = go.Scatter(x=timestamp_current, y=oi_current, name='OI', yaxis='y')
     trace2 = go.Scatter(x=timestamp_current, y=settle_pr_current, name='settle_pr', yaxis='y2')
@@ -338,32 +330,12 @@ def put_call_ratio_expiry(symbol: str, expiry_month: int, expiry_year: int, star
                 Plots the graph for PCR analysis. Underlying, and PCR are plotted.
     """
     symbol = symbol.upper()
-    fut_query = "Select * from %s where symbol='%s' and instrument like 'FUT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    fut_data = dbc.execute_simple_query(fut_query)
-    fut_df = pd.DataFrame(data=fut_data, columns=dbc.columns)
-
-    option_query = "Select * from %s where symbol='%s' and instrument like 'OPT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    option_data = dbc.execute_simple_query(option_query)
-    option_df = pd.DataFrame(data=option_data, columns=dbc.columns)
     start_date = start_date if start_date else date(expiry_year, expiry_month, 1)
-    option_expiry_df = option_df[option_df.timestamp >= start_date].sort_values('timestamp')
-    timestamp_arr = option_expiry_df.timestamp.unique()
-    call_option = [Keys.call]
-    put_option = [Keys.put]
+    # Open interest of each day is read from the daily aggregates
+    summary = chain_summary.expiry_month_summary(symbol, expiry_month, expiry_year, start_date, otm_pcr)
     x, y1, y2 = [], [], []
-    for timestamp in timestamp_arr:
-        day = [timestamp]
-        fut_price = fut_df[fut_df.timestamp == timestamp].close.values[0]
-        call_df = option_expiry_df[option_expiry_df.option_typ.isin(call_option) & option_expiry_df.timestamp.isin(day)]
-        put_df = option_expiry_df[option_expiry_df.option_typ.isin(put_option) & option_expiry_df.timestamp.isin(day)]
-        if otm_pcr:
-            call_df = call_df[call_df.strike >= fut_price]
-            put_df = put_df[put_df.strike <= fut_price]
-        call_volume = call_df.open_int.sum()
-        put_volume = put_df.open_int.sum()
-        pcr = put_volume / call_volume
+    for timestamp, month, year, fut_price, call_volume, put_volume in summary:
+        pcr = float(put_volume) / float(call_volume) if call_volume else None
         x.append(timestamp)
         y1.append(fut_price)
         y2.append(pcr)
@@ -404,56 +376,18 @@ def put_call_ratio(symbol: str, start_date: date = None, data_only: bool = False
     """
     symbol = symbol.upper()
 
-    fut_query = "Select * from %s where symbol='%s' and instrument like 'FUT%%' order by timestamp asc" % (
-        dbc.table_name, symbol)
-    fut_data = dbc.execute_simple_query(fut_query)
-    fut_df = pd.DataFrame(data=fut_data, columns=dbc.columns)
-    if start_date:
-        fut_df = fut_df[fut_df.timestamp >= start_date]
-    low = fut_df.close.min()
-    low = low * 0.95
-    high = fut_df.close.max()
-    high = high * 1.05
-
-    option_query = "Select * from %s where symbol='%s' and instrument like 'OPT%%' order by timestamp asc" % (
-        dbc.table_name, symbol)
-    option_data = dbc.execute_simple_query(option_query)
-    option_df = pd.DataFrame(data=option_data, columns=dbc.columns)
-    if start_date:
-        option_df = option_df[option_df.timestamp >= start_date]
-
-    expiry_dates = fut_df.sort_values('expiry').expiry.unique()
-    call_option = [Keys.call]
-    put_option = [Keys.put]
-    x, y1, y2 = [], [], []
-    init_expiry = None
+    # Near month options of every day from the daily aggregates
+    values = pcr_engine.summary_pcr([symbol], start_date, otm=otm_pcr, near_month_only=True)
+    x = values.timestamp.tolist()
+    y1 = values.underlying.tolist()
+    y2 = []
+    for pcr in values.oi_pcr.tolist():
+        y2.append(pcr if pcr < 1.7 else (y2[-1] if len(y2) > 0 else None))
+    low = numpy.nanmin(values.underlying) * 0.95 if len(values) else 0
+    high = numpy.nanmax(values.underlying) * 1.05 if len(values) else 0
+
     shapes = []
-    for expiry in expiry_dates:
-        if init_expiry is None:
-            init_expiry = date(expiry.year, expiry.month, 1)
-        expiry_data = option_df[option_df.expiry == expiry]
-        month_expiry_data = expiry_data[
-            (expiry_data['timestamp'] >= init_expiry) & (expiry_data['timestamp'] <= expiry)]
-        monthly_timestamps = month_expiry_data.timestamp.unique()
-        for ts in monthly_timestamps:
-            day = [ts]
-            fut_price = fut_df[fut_df.timestamp == ts].close.values[0]
-            call_df = month_expiry_data[
-                month_expiry_data.option_typ.isin(call_option) & month_expiry_data.timestamp.isin(day)]
-            put_df = month_expiry_data[
-                month_expiry_data.option_typ.isin(put_option) & month_expiry_data.timestamp.isin(day)]
-            if otm_pcr:
-                call_df = call_df[call_df.strike >= fut_price]
-                put_df = put_df[put_df.strike <= fut_price]
-            call_volume = call_df.open_int.sum()
-            put_volume = put_df.open_int.sum()
-            pcr = put_volume / call_volume
-            pcr = pcr if pcr < 1.7 else (y2[-1] if len(y2) > 0 else None)
-            x.append(ts)
-            y1.append(fut_price)
-            y2.append(pcr)
-
-        init_expiry = expiry + timedelta(days=1)
+    for expiry in numpy.unique(values.expiry).tolist():
         shapes.append({
             'type': 'line',
             'x0': expiry,
@@ -523,15 +457,9 @@ def max_pain(symbol: str, expiry_month: int, expiry_year: int, start_strike: int
     """
     symbol = symbol.upper()
 
-    fut_query = "Select * from %s where symbol='%s' and instrument like 'FUT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d order by timestamp asc" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    fut_data = dbc.execute_simple_query(fut_query)
-    fut_df = pd.DataFrame(data=fut_data, columns=dbc.columns)
-
-    option_query = "Select * from %s where symbol='%s' and instrument like 'OPT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d order by timestamp asc" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    option_data = dbc.execute_simple_query(option_query)
-    option_df = pd.DataFrame(data=option_data, columns=dbc.columns)
+    fut_df = chain_cache.load(symbol, Instrument.future, expiry_month, expiry_year, fields=['timestamp', 'close'])
+    option_df = chain_cache.load(symbol, Instrument.option, expiry_month, expiry_year,
+                                 fields=['timestamp', 'strike', 'option_typ', 'open_int'])
 
     start_date = start_date if start_date else date(expiry_year, expiry_month, 1)
     fut_df = fut_df[fut_df.timestamp >= start_date]
@@ -554,49 +482,24 @@ def max_pain(symbol: str, expiry_month: int, expiry_year: int, start_strike: int
         fut_df = fut_df[fut_df.timestamp == timestamp]
         option_df = option_df[option_df.timestamp == timestamp]
 
-    days_arr = fut_df.timestamp.unique()
-    timestamp_values = []
-    table_ts, table_underlying, table_max_pain_strikes, table_strikes_avg = [], [], [], []
-    for ts in days_arr:
-        call_df = option_df[(option_df.timestamp == ts) & (option_df.option_typ == Keys.call)]
-        put_df = option_df[(option_df.timestamp == ts) & (option_df.option_typ == Keys.put)]
-        call_strikes = call_df.strike.unique()
-        put_strikes = put_df.strike.unique()
-        strikes = list(set(call_strikes).intersection(set(put_strikes)))
-        strikes.sort()
-
-        if strikes:
-            timestamp_values = []
-            for i in range(len(strikes)):
-                diff_call, diff_put = [], []
-                for strike in strikes:
-                    call_loss = strikes[i] - strike
-                    diff_call.append(call_loss if call_loss > 0 else 0)
-                    put_loss = strike - strikes[i]
-                    diff_put.append(put_loss if put_loss > 0 else 0)
-                call_oi = call_df.open_int.values
-                put_oi = put_df.open_int.values
-                call_money = sum([value for value in (map(lambda x, y: x * y, diff_call, call_oi))])
-                put_money = sum([value for value in (map(lambda x, y: x * y, diff_put, put_oi))])
-                total_money = call_money + put_money
-                timestamp_values.append([strikes[i], total_money])
-
-            values = timestamp_values.copy()
-            values.sort(key=lambda x: x[1])
-            values = values[:5]
-            max_pain_strikes = [item[0] for item in values]
-            max_pain_strikes.sort()
-            underlying = fut_df[fut_df.timestamp == ts].close.values[0]
-            average = int(sum(max_pain_strikes) / len(max_pain_strikes))
-            table_ts.append(ts)
-            table_underlying.append(underlying)
-            table_max_pain_strikes.append(max_pain_strikes)
-            table_strikes_avg.append(average)
+    # Pain of all the days and strikes is found at once, days without the futures are left out
+    values = max_pain_engine.max_pain(option_df.timestamp.values, option_df.strike.values,
+                                      option_df.option_typ.values, option_df.open_int.values)
+    underlying = pd.Series(fut_df.close.values, index=numpy.array(fut_df.timestamp.values, dtype='datetime64[D]'))
+    underlying = underlying[~underlying.index.duplicated()]
+    has_underlying = numpy.isin(values.days, underlying.index.values)
+    table_ts = values.days[has_underlying].tolist()
+    table_underlying = underlying.loc[values.days[has_underlying]].tolist()
+    table_max_pain_strikes = [[int(strike) for strike in strikes if strike == strike] for strikes in
+                              values.top_strikes[has_underlying]]
+    table_strikes_avg = values.average[has_underlying].astype(int).tolist()
 
     x, y = [], []
-    for value in timestamp_values:
-        x.append(value[0])
-        y.append(value[1])
+    if has_underlying.any():
+        # Pain curve of the last day
+        pain = values.pain[numpy.flatnonzero(has_underlying)[-1]]
+        listed = numpy.isfinite(pain)
+        x, y = values.strikes[listed].tolist(), pain[listed].tolist()
 
     head_title = "%s Max Pain for " % symbol
     title = head_title + str(timestamp) if timestamp else head_title + "%s,%s" % (expiry_month, expiry_year)
@@ -2,12 +2,12 @@ import logging
 from datetime import date
 
 import matplotlib.pyplot as plt
-import numpy
 import plotly.offline as py
 import plotly.tools as tls
 
 from constants import Keys
-import option_greeks
+from model import StrikeEntry
+import payoff_engine
 
 _logger = logging.getLogger("payoff_charts")
 
@@ -26,13 +26,10 @@ def _get_payoff_values(spot, strike: int, option_type: str, premium: float, sign
     :return: list
             Contains payoff values corresponding to the spot vales
     """
-    payoff = []
-    for underlying in spot:
-        value = (max(0, (underlying - strike) if option_type == Keys.call else (strike - underlying))) - premium
-        if signal == Keys.sell:
-            value *= -1
-        payoff.append(value)
-    return payoff
+    payoff = payoff_engine.intrinsic(spot, strike, option_type == Keys.call) - premium
+    if signal == Keys.sell:
+        payoff = -payoff
+    return payoff.tolist()
 
 
 def _get_greeks_payoff_values(spot, strike: int, expiry_date: date, calculation_date: date, option_type: str,
@@ -54,21 +51,67 @@ def _get_greeks_payoff_values(spot, strike: int, expiry_date: date, calculation_
     :return: tuple(list, list, list, list, list)
             Returns values for delta, gamma, theta, vega, rho for corresponding spot in list
     """
-    delta_list, gamma_list, theta_list, vega_list, rho_list = [], [], [], [], []
-
-    for underlying in spot:
-        # print(underlying)
-        delta, gamma, theta, vega, rho = option_greeks.get_option_greeks(underlying, strike, expiry_date,
-                                                                         option_type, volatility, calculation_date, )
-        delta_list.append(delta)
-        gamma_list.append(gamma)
-        theta_list.append(theta)
-        vega_list.append(vega)
-        rho_list.append(rho)
-
+    greeks = payoff_engine.greeks_profile(spot, [StrikeEntry(strike, option_type, Keys.buy)], expiry_date,
+                                          calculation_date, volatility / 100)
+    delta_list, gamma_list, theta_list, vega_list, rho_list = [value.tolist() for value in greeks]
     return delta_list, gamma_list, theta_list, vega_list, rho_list
 
 
+def _plot_greeks_charts(spot: list, payoff_list: list, greeks: tuple, name: str):
+    """
+    Helper function for plotting the payoff and the greeks against the spot values
+    :param spot: list
+            Underlying Values
+    :param payoff_list: list
+            Payoff values corresponding to the spot values
+    :param greeks: tuple(list, list, list, list, list)
+            Values for delta, gamma, theta, vega, rho corresponding to the spot values
+    :param name: str
+            Name of the position for the title and the file
+    :return: None
+            Displays payoff charts in the browser.
+    """
+    delta_list, gamma_list, theta_list, vega_list, rho_list = greeks
+    fig = plt.figure()
+
+    if payoff_list is not None:
+        ax1 = fig.add_subplot(321)
+        ax1.plot(spot, payoff_list, )
+        ax1.set_title('Payoff')
+
+    if delta_list:
+        ax2 = fig.add_subplot(322)
+        ax2.plot(spot, delta_list, )
+        ax2.set_title('Delta')
+
+        ax3 = fig.add_subplot(323)
+        ax3.plot(spot, gamma_list, )
+        ax3.set_title('Gamma')
+
+        ax4 = fig.add_subplot(324)
+        ax4.plot(spot, theta_list, )
+        ax4.set_title('Theta')
+
+        ax5 = fig.add_subplot(325)
+        ax5.plot(spot, vega_list, )
+        ax5.set_title('Vega')
+
+        ax6 = fig.add_subplot(326)
+        ax6.plot(spot, rho_list, )
+        ax6.set_title('Rho')
+
+    plt.tight_layout()
+    fig = plt.gcf()
+
+    plotly_fig = tls.mpl_to_plotly(fig)
+    plotly_fig['layout']['title'] = 'Greeks Payoff Charts for %s' % name
+    plotly_fig['layout']['margin'].update({'t': 80})
+    plotly_fig['layout']['height'] = 720
+    plotly_fig['layout']['width'] = 1024
+
+    py.plot(plotly_fig, filename="%s.html" % name)
+
+
 def payoff_charts(spot: list, strike: int, option_type: str, option_price: float, calculation_date: date,
                   expiry_date: date, volatility: float):
     """
@@ -90,57 +133,41 @@ def payoff_charts(spot: list, strike: int, option_type: str, option_price: float
     :return: None
             Displays payoff charts in the browser.
     """
-    spot = numpy.arange(min(spot), max(spot), 100, dtype=numpy.int64).tolist()
+    spot = payoff_engine.spot_grid(spot).tolist()
 
     if option_type in [Keys.call, Keys.put]:
         payoff_list = _get_payoff_values(spot, strike, option_type, option_price)
-        delta_list, gamma_list, theta_list, vega_list, rho_list = _get_greeks_payoff_values(spot, strike, expiry_date,
-                                                                                            calculation_date,
-                                                                                            option_type,
-                                                                                            volatility)
-
-        fig = plt.figure()
-
-        if payoff_list is not None:
-            ax1 = fig.add_subplot(321)
-            ax1.plot(spot, payoff_list, )
-            ax1.set_title('Payoff')
-
-        if delta_list:
-            ax2 = fig.add_subplot(322)
-            ax2.plot(spot, delta_list, )
-            ax2.set_title('Delta')
-
-            ax3 = fig.add_subplot(323)
-            ax3.plot(spot, gamma_list, )
-            ax3.set_title('Gamma')
-
-            ax4 = fig.add_subplot(324)
-            ax4.plot(spot, theta_list, )
-            ax4.set_title('Theta')
-
-            ax5 = fig.add_subplot(325)
-            ax5.plot(spot, vega_list, )
-            ax5.set_title('Vega')
-
-            ax6 = fig.add_subplot(326)
-            ax6.plot(spot, rho_list, )
-            ax6.set_title('Rho')
-
-        plt.tight_layout()
-        fig = plt.gcf()
-
+        greeks = _get_greeks_payoff_values(spot, strike, expiry_date, calculation_date, option_type, volatility)
         name = '%s %s %s' % (
             strike, option_type, expiry_date.strftime("%d%b%Y"))
-
-        plotly_fig = tls.mpl_to_plotly(fig)
-        plotly_fig['layout']['title'] = 'Greeks Payoff Charts for %s' % name
-        plotly_fig['layout']['margin'].update({'t': 80})
-        plotly_fig['layout']['height'] = 720
-        plotly_fig['layout']['width'] = 1024
-
-        py.plot(plotly_fig, filename="%s.html" % name)
+        _plot_greeks_charts(spot, payoff_list, greeks, name)
 
     else:
         _logger.warning("Option can be either CE or PE")
         _logger.info("Couldn't plot payoffs")
+
+
+def strategy_greeks_charts(spot: list, strike_data: list, calculation_date: date, expiry_date: date,
+                           volatility: float, strategy_name: str = None):
+    """
+    It is used to display the payoff and greeks charts of a multi-leg position
+    :param spot: list
+            Range of underlying values for which evaluation is required
+    :param strike_data: list[StrikeEntry]
+            Legs of the position. Legs without premium are taken at 0.
+    :param calculation_date: date
+            Observation date for the calculations
+    :param expiry_date: date
+            Date of expiry of the options
+    :param volatility: float
+            Volatility for the options, same for all the legs
+    :param strategy_name: str
+            Name of the strategy
+    :return: None
+            Displays payoff charts in the browser.
+    """
+    spot = payoff_engine.spot_grid(spot)
+    payoff, _ = payoff_engine.expiry_payoff(spot, strike_data)
+    greeks = payoff_engine.greeks_profile(spot, strike_data, expiry_date, calculation_date, volatility / 100)
+    name = '%s %s' % (strategy_name if strategy_name else 'Strategy', expiry_date.strftime("%d%b%Y"))
+    _plot_greeks_charts(spot.tolist(), payoff.tolist(), [value.tolist() for value in greeks], name)
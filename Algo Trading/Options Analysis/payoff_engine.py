@@ -0,0 +1,163 @@
+import numpy
+
+import black_scholes
+from constants import Keys
+
+"""
+Definitions written in this file are used to find the payoff and the model value of option strategies with NumPy.
+Legs of a strategy are kept as arrays, so the payoff over a whole grid of spot values is one broadcast evaluation
+instead of a loop over the spot values and the legs. Model value before expiry is Black-Scholes (Black-76 for futures)
+from black_scholes, broadcast over valuation dates and volatilities as well.
+"""
+
+# Number of spot values in a grid made by spot_grid
+spot_points = 501
+
+
+def spot_grid(spot: list, points: int = None):
+    """
+    It makes an evenly spaced grid of spot values over a range.
+    :param spot: list
+            Range of spot values, only the lowest and highest are taken
+    :param points: int
+            Number of spot values. Defaults to spot_points.
+    :return: array
+    """
+    return numpy.linspace(min(spot), max(spot), points if points else spot_points)
+
+
+def legs(strike_data: list, default_premium: float = 0.0):
+    """
+    It converts StrikeEntry legs to arrays. A leg is bought unless its signal is sell.
+    :param strike_data: list[StrikeEntry]
+            Legs of the strategy
+    :param default_premium: float
+            Premium of the legs which don't have one
+    :return: tuple(array, array, array, array)
+            Strike, True for calls, signed quantity and premium of each leg
+    """
+    strike = numpy.array([leg.strike for leg in strike_data], dtype=numpy.float64)
+    call = black_scholes.is_call([leg.option_type for leg in strike_data])
+    quantity = numpy.array([(-1 if leg.signal == Keys.sell else 1) * (leg.quantity if leg.quantity is not None else 1)
+                            for leg in strike_data], dtype=numpy.float64)
+    premium = numpy.array([leg.premium if leg.premium is not None else default_premium for leg in strike_data],
+                          dtype=numpy.float64)
+    return strike, call, quantity, premium
+
+
+def intrinsic(spot, strike, call):
+    """
+    It returns the value of the options at expiry.
+    :param spot: array
+            Spot at expiry
+    :param strike: array
+            Strike price
+    :param call: array
+            True for calls and False for puts
+    :return: array
+    """
+    spot, strike = numpy.asarray(spot, dtype=numpy.float64), numpy.asarray(strike, dtype=numpy.float64)
+    return numpy.where(call, numpy.maximum(spot - strike, 0), numpy.maximum(strike - spot, 0))
+
+
+def expiry_payoff(spot, strike_data: list, default_premium: float = 0.0):
+    """
+    It evaluates the payoff at expiry of a strategy over the spot values.
+    :param spot: array
+            Spot values at expiry
+    :param strike_data: list[StrikeEntry]
+            Legs of the strategy
+    :param default_premium: float
+            Premium of the legs which don't have one
+    :return: tuple(array, array)
+            Payoff of the strategy for each spot and (spot x legs) payoff of each leg
+    """
+    strike, call, quantity, premium = legs(strike_data, default_premium)
+    spot = numpy.asarray(spot, dtype=numpy.float64)
+    leg_payoff = (intrinsic(spot[:, None], strike, call) - premium) * quantity
+    return leg_payoff.sum(axis=1), leg_payoff
+
+
+def model_value(spot, strike_data: list, expiry_date, valuation_date, vol, rate: float = 0.0, futures: bool = False,
+                default_premium: float = 0.0):
+    """
+    It evaluates the P&L of a strategy at the model value of its legs over a grid of valuation dates, volatilities and
+    spot values. Legs are valued at their intrinsic value on and after expiry.
+    :param spot: array
+            (S) Spot or futures values
+    :param strike_data: list[StrikeEntry]
+            Legs of the strategy
+    :param expiry_date: date
+            Date of expiry of the options
+    :param valuation_date: date or array
+            (D) Observation dates. date objects or datetime64 values.
+    :param vol: float or array
+            (V) Annualised volatility in decimals, same for all the legs
+    :param rate: float
+            Risk free interest rate in decimals
+    :param futures: bool
+            If True, spot is a futures price and Black-76 is used
+    :param default_premium: float
+            Premium of the legs which don't have one
+    :return: array
+            (dates x volatilities x spot) P&L, axes of scalar inputs are dropped
+    """
+    strike, call, quantity, premium = legs(strike_data, default_premium)
+    given = [numpy.ndim(value) > 0 for value in (valuation_date, vol, spot)]
+    tau = numpy.atleast_1d(black_scholes.year_fraction(expiry_date, valuation_date))
+    vol = numpy.atleast_1d(numpy.asarray(vol, dtype=numpy.float64))
+    spot = numpy.atleast_1d(numpy.asarray(spot, dtype=numpy.float64))
+    grid_tau, grid_vol, grid_spot = tau[:, None, None], vol[None, :, None], spot[None, None, :]
+
+    value = numpy.zeros((len(tau), len(vol), len(spot)))
+    live = grid_tau > 0
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        # Legs are added one at a time, so the memory taken does not grow with the number of legs
+        for leg in range(len(strike)):
+            leg_value = numpy.where(live, black_scholes.price(grid_spot, strike[leg], numpy.maximum(grid_tau, 0),
+                                                              grid_vol, call[leg], rate, futures),
+                                    intrinsic(grid_spot, strike[leg], call[leg]))
+            value += (leg_value - premium[leg]) * quantity[leg]
+    return value.reshape([length for length, axis in zip(value.shape, given) if axis])
+
+
+def greeks_profile(spot, strike_data: list, expiry_date, valuation_date, vol, rate: float = 0.0,
+                   futures: bool = False):
+    """
+    It evaluates the greeks of a position over a grid of valuation dates and spot values. Greeks of the legs are
+    added with their signed quantities. Units are same as option_greeks.get_option_greeks i.e. theta is per day and
+    vega, rho are for a change of 1.0. On and after expiry, delta is that of the payoff and the rest are 0.
+    :param spot: array
+            (S) Spot or futures values
+    :param strike_data: list[StrikeEntry]
+            Legs of the position
+    :param expiry_date: date
+            Date of expiry of the options
+    :param valuation_date: date or array
+            (D) Observation dates. date objects or datetime64 values.
+    :param vol: float
+            Annualised volatility in decimals, same for all the legs
+    :param rate: float
+            Risk free interest rate in decimals
+    :param futures: bool
+            If True, spot is a futures price and Black-76 is used
+    :return: tuple(array, array, array, array, array)
+            (dates x spot) delta, gamma, theta, vega, rho, date axis is dropped for a single date
+    """
+    strike, call, quantity, _ = legs(strike_data)
+    dates_given = numpy.ndim(valuation_date) > 0
+    tau = numpy.atleast_1d(black_scholes.year_fraction(expiry_date, valuation_date))[:, None]
+    spot = numpy.atleast_1d(numpy.asarray(spot, dtype=numpy.float64))[None, :]
+
+    profile = [numpy.zeros((tau.shape[0], spot.shape[1])) for _ in range(5)]
+    live = tau > 0
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        for leg in range(len(strike)):
+            leg_greeks = black_scholes.greeks(spot, strike[leg], numpy.maximum(tau, 0), vol, call[leg], rate, futures)
+            # Payoff at expiry moves one for one with the spot when in the money
+            expired_delta = numpy.where(call[leg], 1.0 * (spot > strike[leg]), -1.0 * (spot < strike[leg]))
+            for i, value in enumerate(leg_greeks):
+                if i == 2:
+                    value = value / black_scholes.days_in_year
+                profile[i] += numpy.where(live, value, expired_delta if i == 0 else 0.0) * quantity[leg]
+    return tuple(value if dates_given else value[0] for value in profile)
@@ -0,0 +1,200 @@
+from datetime import date
+
+import numpy
+import pandas as pd
+
+import chain_summary
+import database_connection as dbc
+from constants import Instrument, Keys
+from model import PCRValues
+
+"""
+Definitions written in this file are used to find the put call ratio (PCR) of option chains with NumPy.
+Open interest and contracts traded of the calls and puts are summed for every symbol, day and expiry in one grouped
+pass with bincount, so the time taken grows linearly with the history instead of once per day and expiry.
+Close of the near month future of the symbol on the day is taken as the underlying, same as put_call_ratio did.
+"""
+
+option_fields = ['symbol', 'timestamp', 'expiry', 'strike', 'option_typ', 'open_int', 'contracts']
+future_fields = ['symbol', 'timestamp', 'expiry', 'close']
+# Days after 1970 fit in these many bits of the integer keys
+day_bits = 20
+
+
+def _factorize(values):
+    """
+    It numbers the distinct values of an array by hashing, which is faster than sorting strings.
+    :param values: array
+    :return: tuple(array, array)
+            Distinct values in ascending order and index of each value in them
+    """
+    codes, uniques = pd.factorize(values)
+    order = numpy.argsort(uniques)
+    rank = numpy.empty(len(uniques), dtype=numpy.int64)
+    rank[order] = numpy.arange(len(uniques))
+    return numpy.asarray(uniques)[order], rank[codes]
+
+
+def _ratio(numerator, denominator):
+    """
+    It divides the sums of the puts by the sums of the calls.
+    :return: array
+            NaN where the calls sum to 0
+    """
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(denominator > 0, numerator / denominator, numpy.nan)
+
+
+def _day_key(symbol_index, timestamp):
+    """
+    It makes one integer key out of a symbol and a day. Keys sort on symbol and then on day.
+    :param symbol_index: array
+            Index of the symbol in the list of symbols
+    :param timestamp: array
+            Day, datetime64[D] after 1970
+    :return: array
+    """
+    return (symbol_index.astype(numpy.int64) << day_bits) + timestamp.astype('datetime64[D]').astype(numpy.int64)
+
+
+def near_month(symbol_index, timestamp, expiry, close):
+    """
+    It finds the near month future of every symbol and day.
+    :param symbol_index: array
+            Index of the symbol of each future
+    :param timestamp: array
+            Day of each future, datetime64[D]
+    :param expiry: array
+            Expiry of each future, datetime64[D]
+    :param close: array
+            Close of each future
+    :return: tuple(array, array, array)
+            Day keys in ascending order (as made by _day_key), expiry and close of the near month future
+    """
+    keys = _day_key(symbol_index, timestamp)
+    # Future with the earliest expiry comes first in each day
+    order = numpy.lexsort((expiry, keys))
+    keys, first = numpy.unique(keys[order], return_index=True)
+    return keys, expiry[order][first], numpy.asarray(close, dtype=numpy.float64)[order][first]
+
+
+def pcr(options: dict, futures: dict, otm: bool = False, near_month_only: bool = False):
+    """
+    It finds the PCR of every symbol, day and expiry.
+    :param options: dict
+            Arrays of option_fields, as returned by database_connection.fetch with arrays=True
+    :param futures: dict
+            Arrays of future_fields, as returned by database_connection.fetch with arrays=True
+    :param otm: bool
+            If True, only Out of Money options are taken i.e. calls with strike at or above the underlying and puts
+            with strike at or below the underlying. Days without the underlying are left out.
+    :param near_month_only: bool
+            If True, only options of the near month expiry are taken i.e. one expiry for each symbol and day.
+            Otherwise every expiry, weekly ones included, has its own PCR.
+    :return: PCRValues
+    """
+    symbols, symbol_index = _factorize(numpy.concatenate([options['symbol'], futures['symbol']]))
+    option_symbol, future_symbol = symbol_index[:len(options['symbol'])], symbol_index[len(options['symbol']):]
+    timestamp = options['timestamp'].astype('datetime64[D]')
+    expiry = options['expiry'].astype('datetime64[D]')
+
+    # Near month future of the day of each option
+    future_keys, future_expiry, future_close = near_month(future_symbol, futures['timestamp'].astype('datetime64[D]'),
+                                                          futures['expiry'].astype('datetime64[D]'), futures['close'])
+    day_keys = _day_key(option_symbol, timestamp)
+    position = numpy.minimum(numpy.searchsorted(future_keys, day_keys), max(len(future_keys) - 1, 0))
+    found = future_keys[position] == day_keys if len(future_keys) else numpy.zeros(len(day_keys), dtype=bool)
+    underlying = numpy.where(found, future_close[position] if len(future_keys) else 0, numpy.nan)
+
+    call = options['option_typ'] == Keys.call
+    put = options['option_typ'] == Keys.put
+    taken = call | put
+    if near_month_only:
+        taken &= found & (expiry == (future_expiry[position] if len(future_keys) else expiry))
+    if otm:
+        # Comparisons with NaN are False, so days without the underlying are left out
+        strike = options['strike']
+        taken &= (call & (strike >= underlying)) | (put & (strike <= underlying))
+
+    # Symbol, day and expiry make one integer key
+    keys = (day_keys[taken] << day_bits) + expiry[taken].astype(numpy.int64)
+    groups, group_index = numpy.unique(keys, return_inverse=True)
+    group_index = group_index.ravel()
+    call, put = call[taken], put[taken]
+    open_int = options['open_int'][taken].astype(numpy.float64)
+    contracts = options['contracts'][taken].astype(numpy.float64)
+    call_oi = numpy.bincount(group_index[call], weights=open_int[call], minlength=len(groups))
+    put_oi = numpy.bincount(group_index[put], weights=open_int[put], minlength=len(groups))
+    call_volume = numpy.bincount(group_index[call], weights=contracts[call], minlength=len(groups))
+    put_volume = numpy.bincount(group_index[put], weights=contracts[put], minlength=len(groups))
+    # Underlying is same for all the options of a day, any one of the group is taken
+    group_underlying = numpy.full(len(groups), numpy.nan)
+    group_underlying[group_index] = underlying[taken]
+
+    day_mask = (1 << day_bits) - 1
+    return PCRValues(symbols[groups >> (2 * day_bits)], ((groups >> day_bits) & day_mask).astype('datetime64[D]'),
+                     (groups & day_mask).astype('datetime64[D]'), group_underlying, call_oi, put_oi, call_volume,
+                     put_volume, _ratio(put_oi, call_oi), _ratio(put_volume, call_volume))
+
+
+def load_pcr(symbols: list, start_date: date = None, end_date: date = None, otm: bool = False,
+             near_month_only: bool = False):
+    """
+    It finds the PCR of a number of symbols from the database. Only the columns needed are fetched.
+    :param symbols: list
+            Symbols e.g. ['NIFTY', 'BANKNIFTY']
+    :param start_date: date
+            First day to be taken
+    :param end_date: date
+            Last day to be taken
+    :param otm: bool
+            If True, only Out of Money options are taken
+    :param near_month_only: bool
+            If True, only options of the near month expiry are taken
+    :return: PCRValues
+    """
+    options, futures = {}, {}
+    for symbol in symbols:
+        for data, instrument, fields in ((options, Instrument.option, option_fields),
+                                         (futures, Instrument.future, future_fields)):
+            arrays = dbc.fetch(symbol.upper(), instrument, fields, start_date=start_date, end_date=end_date,
+                               arrays=True)
+            for field in fields:
+                data.setdefault(field, []).append(arrays[field])
+    options = {field: numpy.concatenate(options[field]) for field in option_fields}
+    futures = {field: numpy.concatenate(futures[field]) for field in future_fields}
+    return pcr(options, futures, otm, near_month_only)
+
+
+def summary_pcr(symbols: list, start_date: date = None, end_date: date = None, otm: bool = False,
+                near_month_only: bool = False):
+    """
+    It finds the PCR of a number of symbols from the daily aggregates kept by chain_summary, without reading the
+    FO table. Parameters are same as load_pcr.
+    Underlying is the close of the future of the expiry month, which is the near month future for the near month
+    expiry and its weekly expiries.
+    :return: PCRValues
+    """
+    keys = ['symbol', 'timestamp', 'expiry']
+    df = pd.concat([chain_summary.load_summary(symbol, start_date=start_date, end_date=end_date) for symbol in symbols],
+                   ignore_index=True)
+    if near_month_only:
+        # Earliest expiry with a future on the day
+        near = df[df.fut_close.notna()].groupby(keys[:2]).expiry.min().rename('near_expiry')
+        df = df.join(near, on=keys[:2])
+        df = df[df.expiry == df.near_expiry]
+    # Expiries with only the future have no options
+    df = df[df.call_oi.notna()].sort_values(keys)
+
+    prefix = 'otm_' if otm else ''
+    call_oi, put_oi = df[prefix + 'call_oi'].values, df[prefix + 'put_oi'].values
+    call_volume, put_volume = df[prefix + 'call_volume'].values, df[prefix + 'put_volume'].values
+    if otm:
+        # Days without the underlying have no Out of Money options
+        has_underlying = df.underlying.notna().values
+        df, call_oi, put_oi = df[has_underlying], call_oi[has_underlying], put_oi[has_underlying]
+        call_volume, put_volume = call_volume[has_underlying], put_volume[has_underlying]
+    return PCRValues(df.symbol.values.astype(str), numpy.array(df.timestamp.tolist(), dtype='datetime64[D]'),
+                     numpy.array(df.expiry.tolist(), dtype='datetime64[D]'), df.underlying.values.astype(float),
+                     call_oi, put_oi, call_volume, put_volume, _ratio(put_oi, call_oi),
+                     _ratio(put_volume, call_volume))
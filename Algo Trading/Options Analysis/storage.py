@@ -0,0 +1,429 @@
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import date
+
+import mysql.connector
+from mysql.connector import pooling
+
+"""
+Storage backends of the FO data. database_connection uses one backend for all the queries, see
+database_connection.set_backend.
+MySQLBackend keeps the data in a MySQL server. SQLiteBackend keeps it in a local file, it needs no server, so the
+analytics can run offline.
+Queries are written with %s placeholders and in the SQL understood by both, backends hold the statements which differ.
+"""
+
+# Dates are kept as ISO text in SQLite. Columns declared as date are converted back to date objects.
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_converter('date', lambda value: date.fromisoformat(value.decode()))
+
+
+class StorageBackend(ABC):
+    """
+    Base class of the storage backends. Backends implement the abstract methods, a backend missing any of them can't
+    be created.
+    """
+    name = None
+    # Backend can load a csv file on the server i.e. IngestMode.infile
+    supports_infile = False
+    # Backend supports partitioning the table by year
+    supports_partitions = False
+    # Generated columns of the FO table and their definitions. Analytics filter on instrument_class.
+    generated_columns = {}
+
+    @abstractmethod
+    @contextmanager
+    def connection(self):
+        """
+        Context manager for a connection to the database.
+        :return: Connection
+        """
+
+    @contextmanager
+    def cursor(self, commit: bool = False):
+        """
+        Context manager for a cursor.
+        :param commit: bool
+                If True, the transaction is committed on exit. It is rolled back if an exception is raised.
+        :return: Cursor
+        """
+        with self.connection() as conn:
+            cur = self._cursor(conn)
+            try:
+                yield cur
+                if commit:
+                    conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def _cursor(self, conn):
+        return conn.cursor()
+
+    def configure_pool(self, size: int = None, name: str = None):
+        """
+        It configures the connection pool. Backends without a pool ignore it.
+        :return: None
+        """
+        pass
+
+    @abstractmethod
+    def check_database(self):
+        """
+        This checks for the database. If not present then it creates the database.
+        :return: None
+        """
+
+    @abstractmethod
+    def has_table(self, cur, table: str):
+        """
+        It checks if the table is present in the database.
+        :param cur: Cursor
+        :param table: str
+                Name of the table
+        :return: bool
+        """
+
+    @abstractmethod
+    def has_column(self, cur, table: str, column: str):
+        """
+        It checks if the column is present in the table.
+        :param cur: Cursor
+        :param table: str
+                Name of the table
+        :param column: str
+                Name of the column
+        :return: bool
+        """
+
+    @abstractmethod
+    def index_names(self, cur, table: str):
+        """
+        It returns the names of the indexes of the table.
+        :param cur: Cursor
+        :param table: str
+                Name of the table
+        :return: set
+        """
+
+    @abstractmethod
+    def fo_table_query(self, table: str, generated: str, keys: dict):
+        """
+        It returns the query creating the FO table.
+        :param table: str
+                Name of the table
+        :param generated: str
+                Definitions of the generated columns, each starting with a comma
+        :param keys: dict
+                Name of the index and its columns
+        :return: List[str]
+                Queries to be executed in order
+        """
+
+    def add_index_query(self, table: str, index: str, definition: str):
+        """
+        It returns the query adding an index.
+        :return: str
+        """
+        return "CREATE INDEX %s ON %s %s" % (index, table, definition)
+
+    def truncate_query(self, table: str):
+        """
+        It returns the query removing all the rows of a table.
+        :return: str
+        """
+        return "TRUNCATE TABLE %s" % table
+
+    @abstractmethod
+    def upsert_query(self, table: str, insert_columns: list, key_columns: list, updates: dict):
+        """
+        It returns a parameterized query which inserts a row, or updates it if the key is already present.
+        :param table: str
+                Name of the table
+        :param insert_columns: list
+                Columns of the inserted row, in the order of the values
+        :param key_columns: list
+                Columns of the primary key
+        :param updates: dict
+                Column to be updated and its new value. Values can use inserted(column) and greatest(a, b).
+        :return: str
+        """
+
+    @abstractmethod
+    def inserted(self, column: str):
+        """
+        It returns the expression for the value of a column in the row being inserted by upsert_query.
+        :return: str
+        """
+
+    def greatest(self, first: str, second: str):
+        """
+        It returns the expression for the larger of two values.
+        :return: str
+        """
+        return "GREATEST(%s, %s)" % (first, second)
+
+
+class MySQLBackend(StorageBackend):
+    """
+    Backend on a MySQL server, connections are taken from a pool.
+    Connections can't be shared with forked processes, each process creates its own pool.
+    """
+    name = 'mysql'
+    supports_infile = True
+    supports_partitions = True
+    generated_columns = {
+        'instrument_class': "char(3) AS (LEFT(instrument, 3)) STORED",
+        'expiry_month': "tinyint AS (MONTH(expiry)) VIRTUAL",
+        'expiry_year': "smallint AS (YEAR(expiry)) VIRTUAL",
+    }
+
+    def __init__(self, host: str, user: str, password: str, database: str, pool_name: str = 'fo_pool',
+                 pool_size: int = 5, ping_attempts: int = 3):
+        """
+        :param host: str
+                Host of the MySQL server
+        :param user: str
+        :param password: str
+        :param database: str
+                Name of the database
+        :param pool_name: str
+                Name of the connection pool
+        :param pool_size: int
+                Number of connections kept in the pool
+        :param ping_attempts: int
+                Attempts for reconnecting a pooled connection which failed the health check
+        """
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.pool_name = pool_name
+        self.pool_size = pool_size
+        self.ping_attempts = ping_attempts
+        self._pool = None
+        # Process id the pool was created for
+        self._pool_pid = None
+
+    def configure_pool(self, size: int = None, name: str = None):
+        """
+        It configures the connection pool. The pool is created again on the next use.
+        :param size: int
+                Number of connections kept in the pool.
+        :param name: str
+                Name of the pool.
+        :return: None
+        """
+        self.pool_size = size if size else self.pool_size
+        self.pool_name = name if name else self.pool_name
+        self._pool = None
+        self._pool_pid = None
+
+    def _get_pool(self):
+        """
+        It returns the connection pool for the current process.
+        :return: MySQLConnectionPool
+        """
+        if self._pool is None or self._pool_pid != os.getpid():
+            self._pool = pooling.MySQLConnectionPool(pool_name=self.pool_name, pool_size=self.pool_size,
+                                                     pool_reset_session=True, host=self.host, user=self.user,
+                                                     password=self.password, database=self.database,
+                                                     allow_local_infile=True)
+            self._pool_pid = os.getpid()
+        return self._pool
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager for a pooled connection. The connection is returned to the pool on exit.
+        A health check is done before the connection is handed out, it is reconnected if the server dropped it.
+        :return: PooledMySQLConnection
+        """
+        conn = self._get_pool().get_connection()
+        try:
+            conn.ping(reconnect=True, attempts=self.ping_attempts, delay=1)
+            yield conn
+        finally:
+            conn.close()
+
+    def check_database(self):
+        """
+        This checks for the for the database present in the MySQL server. If not then it creates the database.
+        It doesn't use the connection pool as the pool connections are opened on the database.
+        :return: None
+        """
+        conn = mysql.connector.connect(host=self.host, user=self.user, password=self.password)
+        cursor = conn.cursor()
+        query = "SELECT SCHEMA_NAME FROM INFORMATION_SCHEMA.SCHEMATA WHERE SCHEMA_NAME = '%s'" % self.database
+        cursor.execute(query)
+        result = cursor.fetchall()
+        if len(result) == 0:
+            query = "CREATE DATABASE IF NOT EXISTS %s" % self.database
+            cursor.execute(query)
+            print("Database created: %s" % self.database)
+        else:
+            print("Database already present")
+
+        cursor.close()
+        conn.close()
+
+    def has_table(self, cur, table: str):
+        query = "SELECT table_name FROM information_schema.tables WHERE TABLE_SCHEMA = '%s' AND table_name = '%s'" % (
+            self.database, table)
+        cur.execute(query)
+        return len(cur.fetchall()) > 0
+
+    def has_column(self, cur, table: str, column: str):
+        query = "SELECT * FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = '%s' AND TABLE_NAME = '%s' AND " \
+                "COLUMN_NAME LIKE '%s'" % (self.database, table, column)
+        cur.execute(query)
+        return len(cur.fetchall()) > 0
+
+    def index_names(self, cur, table: str):
+        cur.execute("SHOW INDEX FROM %s" % table)
+        return set(row[2] for row in cur.fetchall())
+
+    def fo_table_query(self, table: str, generated: str, keys: dict):
+        keys = "".join(", KEY %s %s" % (index, definition) for index, definition in keys.items())
+        return ["CREATE TABLE %s (id int NOT NULL AUTO_INCREMENT,instrument varchar(8) ,symbol varchar(30) ,"
+                "expiry date,strike int, option_typ varchar(5), open float, high float, low float, close double, "
+                "settle_pr float, contracts int, val float, open_int int, chg_in_oi int, timestamp date, "
+                "iv float, theta float, gamma float, delta float, vega float, greeks_close double%s, "
+                "PRIMARY KEY (id)%s)" % (table, generated, keys)]
+
+    def upsert_query(self, table: str, insert_columns: list, key_columns: list, updates: dict):
+        return "INSERT INTO %s (%s) VALUES (%s) ON DUPLICATE KEY UPDATE %s" % (
+            table, ", ".join(insert_columns), ", ".join(["%s"] * len(insert_columns)),
+            ", ".join("%s = %s" % (column, value) for column, value in updates.items()))
+
+    def inserted(self, column: str):
+        return "VALUES(%s)" % column
+
+
+class _SQLiteCursor:
+    """
+    Cursor of SQLiteBackend. It takes queries with %s placeholders like the MySQL cursor.
+    Placeholders are only replaced when parameters are given, so queries with literal % (e.g. LIKE) work unchanged.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query: str, params=None):
+        if params is None:
+            return self._cursor.execute(query)
+        return self._cursor.execute(query.replace('%s', '?'), params)
+
+    def executemany(self, query: str, rows):
+        return self._cursor.executemany(query.replace('%s', '?'), rows)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def close(self):
+        self._cursor.close()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Backend on a local SQLite file. It needs no server, so the analytics and the ingestion can run offline.
+    A connection is kept for each process and thread. The file is opened in WAL mode so that readers don't block
+    the writer, writers wait for each other up to timeout.
+    """
+    name = 'sqlite'
+    generated_columns = {
+        'instrument_class': "TEXT GENERATED ALWAYS AS (substr(instrument, 1, 3)) VIRTUAL",
+        'expiry_month': "INTEGER GENERATED ALWAYS AS (CAST(strftime('%m', expiry) AS INTEGER)) VIRTUAL",
+        'expiry_year': "INTEGER GENERATED ALWAYS AS (CAST(strftime('%Y', expiry) AS INTEGER)) VIRTUAL",
+    }
+
+    def __init__(self, path: str = 'fo.sqlite', timeout: float = 60.0):
+        """
+        :param path: str
+                Path to the database file. It is created if not present.
+        :param timeout: float
+                Seconds to wait for a lock held by another connection
+        """
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager for the connection of the current process and thread.
+        :return: sqlite3.Connection
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, detect_types=sqlite3.PARSE_DECLTYPES)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        yield conn
+
+    def _cursor(self, conn):
+        return _SQLiteCursor(conn.cursor())
+
+    def check_database(self):
+        """
+        This checks for the database file. SQLite creates the file on the first connection.
+        :return: None
+        """
+        if os.path.isfile(self.path):
+            print("Database already present")
+        else:
+            with self.connection():
+                print("Database created: %s" % self.path)
+
+    def has_table(self, cur, table: str):
+        cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = '%s'" % table)
+        return len(cur.fetchall()) > 0
+
+    def has_column(self, cur, table: str, column: str):
+        # Generated columns are only listed by table_xinfo
+        cur.execute("PRAGMA table_xinfo(%s)" % table)
+        return any(row[1] == column for row in cur.fetchall())
+
+    def index_names(self, cur, table: str):
+        cur.execute("PRAGMA index_list(%s)" % table)
+        return set(row[1] for row in cur.fetchall())
+
+    def fo_table_query(self, table: str, generated: str, keys: dict):
+        queries = ["CREATE TABLE %s (id INTEGER PRIMARY KEY AUTOINCREMENT, instrument varchar(8), symbol varchar(30), "
+                   "expiry date, strike int, option_typ varchar(5), open float, high float, low float, close double, "
+                   "settle_pr float, contracts int, val float, open_int int, chg_in_oi int, timestamp date, "
+                   "iv float, theta float, gamma float, delta float, vega float, greeks_close double%s)" % (
+                       table, generated)]
+        queries += [self.add_index_query(table, index, definition) for index, definition in keys.items()]
+        return queries
+
+    def truncate_query(self, table: str):
+        return "DELETE FROM %s" % table
+
+    def upsert_query(self, table: str, insert_columns: list, key_columns: list, updates: dict):
+        return "INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO UPDATE SET %s" % (
+            table, ", ".join(insert_columns), ", ".join(["%s"] * len(insert_columns)), ", ".join(key_columns),
+            ", ".join("%s = %s" % (column, value) for column, value in updates.items()))
+
+    def inserted(self, column: str):
+        return "excluded.%s" % column
+
+    def greatest(self, first: str, second: str):
+        return "MAX(%s, %s)" % (first, second)
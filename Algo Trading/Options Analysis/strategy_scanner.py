@@ -0,0 +1,218 @@
+from datetime import date
+
+import numpy
+import pandas as pd
+
+import backtest_engine
+import chain_cache
+from constants import Instrument, Keys
+from model import PriceMatrix, StrikeEntry
+
+"""
+Definitions written in this file are used to scan the standard option structures of an expiry with NumPy.
+Every structure is a list of legs whose strikes are steps on the grid of strikes of the expiry, so all the candidates
+of a structure are made at once by adding the widths and offsets to every strike on the grid. Candidates are then
+evaluated in chunks by gathering the change in price of their legs from the price matrix of backtest_engine.
+Each structure is scanned both bought (legs as given) and sold (legs reversed).
+"""
+
+# Legs of each structure as (option type, width steps, offset steps, quantity). Strike of a leg is the base strike
+# moved up the strike grid by width steps * width + offset steps * offset.
+structures = {
+    'straddle': [(Keys.call, 0, 0, 1), (Keys.put, 0, 0, 1)],
+    'strangle': [(Keys.put, 0, 0, 1), (Keys.call, 1, 0, 1)],
+    'call_spread': [(Keys.call, 0, 0, 1), (Keys.call, 1, 0, -1)],
+    'put_spread': [(Keys.put, 1, 0, 1), (Keys.put, 0, 0, -1)],
+    'butterfly': [(Keys.call, 0, 0, 1), (Keys.call, 1, 0, -2), (Keys.call, 2, 0, 1)],
+    'iron_condor': [(Keys.put, 0, 0, 1), (Keys.put, 1, 0, -1), (Keys.call, 1, 1, -1), (Keys.call, 2, 1, 1)],
+}
+default_widths = range(1, 11)
+default_offsets = range(0, 11)
+# Spot is moved these many times the underlying on either side for the margin proxy
+margin_move = 0.1
+# Candidates evaluated at a time, which bounds the memory taken by the (days x candidates) arrays
+chunk_size = 50000
+max_legs = max(len(legs) for legs in structures.values())
+result_columns = ['structure', 'signal'] + ['strike_%d' % (leg + 1) for leg in range(max_legs)] + [
+    'pl', 'drawdown', 'margin', 'pl_margin']
+
+
+def candidates(strikes, legs: list, widths=default_widths, offsets=default_offsets):
+    """
+    It makes all the candidates of a structure on a grid of strikes.
+    :param strikes: array
+            Strikes in ascending order
+    :param legs: list
+            Legs of the structure as in structures
+    :param widths: list
+            Widths in steps of the strike grid. Taken only if a leg has width steps.
+    :param offsets: list
+            Offsets in steps of the strike grid. Taken only if a leg has offset steps.
+    :return: array
+            (candidates x legs) strikes
+    """
+    steps = numpy.array([[leg[1], leg[2]] for leg in legs])
+    widths = list(widths) if steps[:, 0].any() else [0]
+    offsets = list(offsets) if steps[:, 1].any() else [0]
+    width, offset = [grid.ravel() for grid in numpy.meshgrid(widths, offsets)]
+    # (base strikes x widths and offsets x legs) positions on the grid
+    moves = width[:, None] * steps[None, :, 0] + offset[:, None] * steps[None, :, 1]
+    position = (numpy.arange(len(strikes))[:, None, None] + moves[None, :, :]).reshape(-1, len(legs))
+    position = position[(position < len(strikes)).all(axis=1)]
+    # Same legs are made by more than one width and offset if a step count is 0, e.g. an offset of 0
+    position = numpy.unique(position, axis=0)
+    return numpy.asarray(strikes)[position]
+
+
+def _drawdown(pl):
+    """
+    It finds the worst fall of the P&L from its running high, the entry (P&L 0) included.
+    :param pl: array
+            (days x candidates) P&L
+    :return: array
+    """
+    high = numpy.maximum(numpy.maximum.accumulate(pl, axis=0), 0)
+    return (high - pl).max(axis=0, initial=0)
+
+
+def _fill(prices):
+    """
+    It carries the last close of every contract forward to the days it is not traded.
+    :param prices: array
+            (days x contracts) prices
+    :return: array
+    """
+    traded = numpy.isfinite(prices)
+    last = numpy.where(traded, numpy.arange(len(prices))[:, None], 0)
+    numpy.maximum.accumulate(last, axis=0, out=last)
+    return prices[last, numpy.arange(prices.shape[1])[None, :]]
+
+
+def scan(matrix: PriceMatrix, start_date: date, underlying: float = None, names: list = None,
+         widths=default_widths, offsets=default_offsets):
+    """
+    It evaluates every candidate of the structures entered on the start date till the last day of the matrix.
+    Contracts not traded on a day are valued at their last close. Candidates with a leg not traded on the start
+    date are left out.
+    :param matrix: PriceMatrix
+    :param start_date: date
+            Day the candidates are entered at the close
+    :param underlying: float
+            Underlying on the start date. If None, margin proxy is taken over the range of the strikes.
+    :param names: list
+            Structures to be scanned, keys of structures. If None, all of them are scanned.
+    :param widths: list
+            Widths in steps of the strike grid
+    :param offsets: list
+            Offsets in steps of the strike grid
+    :return: DataFrame
+            One row for each candidate and signal with columns result_columns. pl is the P&L on the last day,
+            drawdown is the worst fall of the P&L from its high and margin is the worst loss at expiry for the spot
+            within margin_move of the underlying.
+    """
+    days, prices, entry = backtest_engine.from_start(matrix, start_date)
+    change = _fill(prices) - entry
+    strikes = numpy.unique(matrix.strikes)
+    if underlying is not None:
+        low, high = underlying * (1 - margin_move), underlying * (1 + margin_move)
+    else:
+        low, high = (strikes.min(), strikes.max()) if len(strikes) else (0, 0)
+    # Payoff at expiry is linear between the strikes, so its extremes are at the strikes or the ends of the range
+    spot = numpy.unique(numpy.concatenate([strikes[(strikes > low) & (strikes < high)], [low, high]]))
+    intrinsic = numpy.where(matrix.option_types == Keys.call, numpy.maximum(spot[:, None] - matrix.strikes, 0),
+                            numpy.maximum(matrix.strikes - spot[:, None], 0))
+    expiry_pl = intrinsic - entry
+
+    frames = []
+    for name in (names if names else structures):
+        legs = structures[name]
+        leg_strikes = candidates(strikes, legs, widths, offsets)
+        columns = backtest_engine.contract_columns(matrix, leg_strikes, [leg[0] for leg in legs])
+        taken = (columns >= 0).all(axis=1)
+        if len(entry):
+            taken &= numpy.isfinite(entry[columns.clip(0)]).all(axis=1)
+        leg_strikes, columns = leg_strikes[taken], columns[taken]
+        quantity = numpy.array([leg[3] for leg in legs], dtype=numpy.float64)
+
+        values = numpy.empty((len(columns), 5))
+        for chunk in range(0, len(columns), chunk_size):
+            chunk_columns = columns[chunk:chunk + chunk_size]
+            pl = sum(change[:, chunk_columns[:, leg]] * quantity[leg] for leg in range(len(legs)))
+            payoff = sum(expiry_pl[:, chunk_columns[:, leg]] * quantity[leg] for leg in range(len(legs)))
+            rows = slice(chunk, chunk + len(chunk_columns))
+            values[rows, 0] = pl[-1]
+            values[rows, 1] = _drawdown(pl)
+            values[rows, 2] = _drawdown(-pl)
+            # Worst loss at expiry, bought and sold
+            values[rows, 3] = numpy.maximum(-payoff.min(axis=0), 0)
+            values[rows, 4] = numpy.maximum(payoff.max(axis=0), 0)
+
+        for signal, sign, drawdown, margin in ((Keys.buy, 1, 1, 3), (Keys.sell, -1, 2, 4)):
+            df = pd.DataFrame({'structure': name, 'signal': signal}, index=numpy.arange(len(columns)))
+            for leg in range(max_legs):
+                df['strike_%d' % (leg + 1)] = leg_strikes[:, leg] if leg < len(legs) else numpy.nan
+            df['pl'] = sign * values[:, 0]
+            df['drawdown'] = values[:, drawdown]
+            df['margin'] = values[:, margin]
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                df['pl_margin'] = numpy.where(df.margin.values > 0, df.pl.values / df.margin.values, numpy.nan)
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=result_columns)
+    return pd.concat(frames, ignore_index=True)[result_columns]
+
+
+def rank(df: pd.DataFrame, rank_by: str = 'pl', top: int = None):
+    """
+    It sorts the scanned candidates. Higher is better for pl and pl_margin, lower is better for drawdown and margin.
+    :param df: DataFrame
+            As returned by scan
+    :param rank_by: str
+            Column to be ranked on. Possible values: pl, drawdown, margin, pl_margin
+    :param top: int
+            Number of candidates to be returned. If None, all of them are returned.
+    :return: DataFrame
+    """
+    if rank_by not in ['pl', 'drawdown', 'margin', 'pl_margin']:
+        raise ValueError("Candidates can not be ranked by %s" % rank_by)
+    df = df.sort_values(rank_by, ascending=rank_by in ['drawdown', 'margin'], kind='stable', na_position='last')
+    return (df.head(top) if top is not None else df).reset_index(drop=True)
+
+
+def strike_entries(row):
+    """
+    It converts a scanned candidate to the legs taken by option_strategy.options_strategy.
+    :param row: Series
+            Row of the DataFrame returned by scan
+    :return: List[StrikeEntry]
+    """
+    entries = []
+    for leg, (option_type, _, _, quantity) in enumerate(structures[row.structure]):
+        sign = quantity if row.signal == Keys.buy else -quantity
+        entries.append(StrikeEntry(row['strike_%d' % (leg + 1)], option_type, Keys.buy if sign > 0 else Keys.sell,
+                                   quantity=abs(sign)))
+    return entries
+
+
+def scan_expiry(symbol: str, expiry_month: int, expiry_year: int, start_date: date, names: list = None,
+                widths=default_widths, offsets=default_offsets, rank_by: str = 'pl', top: int = None):
+    """
+    It scans the structures of an expiry of a symbol from the cache. Parameters are same as scan and rank.
+    Close of the future of the expiry month on the start date is taken as the underlying.
+    :param symbol: str
+            Symbol e.g. NIFTY
+    :param expiry_month: int
+            Expiry month
+    :param expiry_year: int
+            Year of the expiry month
+    :return: DataFrame
+    """
+    symbol = symbol.upper()
+    option_df = chain_cache.load(symbol, Instrument.option, expiry_month, expiry_year,
+                                 fields=['timestamp', 'strike', 'option_typ', 'close'])
+    fut_df = chain_cache.load(symbol, Instrument.future, expiry_month, expiry_year, fields=['timestamp', 'close'])
+    fut_close = fut_df[fut_df.timestamp == start_date].close.values
+    matrix = backtest_engine.price_matrix(option_df.timestamp.values, option_df.strike.values,
+                                          option_df.option_typ.values, option_df.close.values)
+    df = scan(matrix, start_date, float(fut_close[0]) if len(fut_close) else None, names, widths, offsets)
+    return rank(df, rank_by, top)
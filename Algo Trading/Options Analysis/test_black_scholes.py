@@ -0,0 +1,132 @@
+from datetime import date
+
+import mibian
+import numpy
+import pytest
+
+import black_scholes
+import option_greeks
+from constants import Keys
+
+"""
+Tests written in this file check the vectorized formulas of black_scholes against QuantLib (through option_greeks)
+and mibian, on a fixed chain of calls and puts priced at known volatilities.
+Run with pytest from this directory.
+"""
+
+calculation_date = date(2018, 10, 3)
+expiry_date = date(2018, 10, 25)
+spot = 11000.0
+rate = 0.07
+strikes = numpy.arange(10000.0, 12001.0, 250.0)
+# Every strike as a call and a put, with a smile around the spot
+chain_strike = numpy.concatenate([strikes, strikes])
+chain_type = numpy.array([Keys.call] * len(strikes) + [Keys.put] * len(strikes))
+chain_vol = 0.12 + 0.5 * numpy.log(chain_strike / spot) ** 2
+tau = black_scholes.year_fraction(expiry_date, calculation_date)
+days = (expiry_date - calculation_date).days
+
+
+def _chain_price():
+    return black_scholes.price(spot, chain_strike, tau, chain_vol, black_scholes.is_call(chain_type), rate)
+
+
+def _quantlib_option(strike, option_type, vol):
+    """
+    It returns the QuantLib option of a contract of the chain with the spot and volatility set.
+    :return: tuple(QuantLibPricer, Date, EuropeanOption)
+    """
+    pricer = option_greeks.QuantLibPricer(rate)
+    ql_calculation_date = option_greeks._ql_date(calculation_date)
+    spot_quote, vol_quote, bs_process, option = pricer._option(strike, option_greeks._ql_date(expiry_date),
+                                                               option_type, ql_calculation_date)
+    spot_quote.setValue(spot)
+    vol_quote.setValue(float(vol))
+    return pricer, ql_calculation_date, option
+
+
+def test_price_against_quantlib():
+    prices = _chain_price()
+    for strike, option_type, vol, value in zip(chain_strike, chain_type, chain_vol, prices):
+        pricer, ql_calculation_date, option = _quantlib_option(strike, option_type, vol)
+        assert value == pytest.approx(pricer._evaluate(ql_calculation_date, option.NPV), rel=1e-9, abs=1e-9)
+
+
+def test_price_against_mibian():
+    prices = _chain_price()
+    for strike, option_type, vol, value in zip(chain_strike, chain_type, chain_vol, prices):
+        bs = mibian.BS([spot, strike, rate * 100, days], volatility=vol * 100)
+        expected = bs.callPrice if option_type == Keys.call else bs.putPrice
+        assert value == pytest.approx(expected, rel=1e-7, abs=1e-7)
+
+
+def test_greeks_against_quantlib():
+    delta, gamma, theta, vega, rho = black_scholes.greeks(spot, chain_strike, tau, chain_vol,
+                                                          black_scholes.is_call(chain_type), rate)
+    for i, (strike, option_type, vol) in enumerate(zip(chain_strike, chain_type, chain_vol)):
+        expected = option_greeks.QuantLibPricer(rate).greeks(spot, strike, expiry_date, option_type, vol,
+                                                             calculation_date)
+        assert delta[i] == pytest.approx(expected[0], rel=1e-9, abs=1e-12)
+        assert gamma[i] == pytest.approx(expected[1], rel=1e-9, abs=1e-12)
+        assert theta[i] / black_scholes.days_in_year == pytest.approx(expected[2], rel=1e-9, abs=1e-9)
+        assert vega[i] == pytest.approx(expected[3], rel=1e-9, abs=1e-9)
+        assert rho[i] == pytest.approx(expected[4], rel=1e-9, abs=1e-9)
+
+
+def test_greeks_against_mibian():
+    delta, gamma, theta, vega, rho = black_scholes.greeks(spot, chain_strike, tau, chain_vol,
+                                                          black_scholes.is_call(chain_type), rate)
+    for i, (strike, option_type, vol) in enumerate(zip(chain_strike, chain_type, chain_vol)):
+        bs = mibian.BS([spot, strike, rate * 100, days], volatility=vol * 100)
+        call = option_type == Keys.call
+        # mibian gives theta per day, vega and rho for a change of 1%
+        assert delta[i] == pytest.approx(bs.callDelta if call else bs.putDelta, rel=1e-7, abs=1e-9)
+        assert gamma[i] == pytest.approx(bs.gamma, rel=1e-7, abs=1e-12)
+        assert theta[i] / black_scholes.days_in_year == pytest.approx(bs.callTheta if call else bs.putTheta,
+                                                                      rel=1e-7, abs=1e-7)
+        assert vega[i] / 100 == pytest.approx(bs.vega, rel=1e-7, abs=1e-7)
+        assert rho[i] / 100 == pytest.approx(bs.callRho if call else bs.putRho, rel=1e-7, abs=1e-7)
+
+
+def test_implied_vol_recovers_volatility():
+    iv = black_scholes.implied_vol(_chain_price(), spot, chain_strike, tau, black_scholes.is_call(chain_type), rate)
+    numpy.testing.assert_allclose(iv, chain_vol, rtol=1e-6)
+
+
+def test_implied_vol_against_quantlib():
+    prices = _chain_price()
+    iv = black_scholes.implied_vol(prices, spot, chain_strike, tau, black_scholes.is_call(chain_type), rate)
+    for i, (strike, option_type, value) in enumerate(zip(chain_strike, chain_type, prices)):
+        expected = option_greeks.QuantLibPricer(rate).implied_greeks(spot, strike, expiry_date, option_type, value,
+                                                                     calculation_date, 0.2)
+        # QuantLib solves to an accuracy of 1e-4 in the volatility
+        assert iv[i] * 100 == pytest.approx(expected[0], abs=1e-2)
+
+
+def test_implied_vol_below_intrinsic_is_nan():
+    call = black_scholes.is_call(chain_type)
+    floor = black_scholes.price(spot, chain_strike, tau, black_scholes.min_vol, call, rate)
+    in_money = numpy.where(call, chain_strike < spot, chain_strike > spot)
+    iv = black_scholes.implied_vol(floor - 1.0, spot, chain_strike, tau, call, rate)
+    assert numpy.isnan(iv[in_money]).all()
+    # QuantLib fails to solve them as well
+    for strike, option_type, value in zip(chain_strike[in_money], chain_type[in_money], floor[in_money] - 1.0):
+        expected = option_greeks.QuantLibPricer(rate).implied_greeks(spot, strike, expiry_date, option_type, value,
+                                                                     calculation_date, 0.2)
+        assert expected[0] == "''"
+
+
+def test_implied_vol_at_min_vol_price():
+    call = black_scholes.is_call(chain_type)
+    floor = black_scholes.price(spot, chain_strike, tau, black_scholes.min_vol, call, rate)
+    iv = black_scholes.implied_vol(floor, spot, chain_strike, tau, call, rate)
+    numpy.testing.assert_array_equal(iv, black_scholes.min_vol)
+
+
+def test_chain_greeks_units():
+    iv, theta, gamma, delta, vega, rho = black_scholes.chain_greeks(spot, chain_strike, expiry_date, chain_type,
+                                                                   _chain_price(), calculation_date, rate)
+    numpy.testing.assert_allclose(iv, chain_vol * 100, rtol=1e-6)
+    expected = black_scholes.greeks(spot, chain_strike, tau, chain_vol, black_scholes.is_call(chain_type), rate)
+    numpy.testing.assert_allclose(theta, expected[2] / black_scholes.days_in_year, rtol=1e-5)
+    numpy.testing.assert_allclose(delta, expected[0], rtol=1e-5, atol=1e-9)
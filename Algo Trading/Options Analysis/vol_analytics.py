@@ -1,10 +1,11 @@
 from datetime import date
 from typing import List
 
-from constants import Keys
+import numpy
+
+from constants import Instrument, Keys
 from model import StrikeEntry
-import database_connection as dbc
-import pandas as pd
+import chain_cache, delta_iv, iv_surface
 
 import plotly.offline as py
 import plotly.graph_objs as go
@@ -31,15 +32,9 @@ def strike_vol_analysis(symbol: str, strike_data: List[StrikeEntry], expiry_mont
                 Plots the underlying and strikes IV for the expiry.
     """
     symbol = symbol.upper()
-    fut_query = "Select * from %s where symbol='%s' and instrument like 'FUT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    fut_data = dbc.execute_simple_query(fut_query)
-    fut_df = pd.DataFrame(data=fut_data, columns=dbc.columns)
-
-    option_query = "Select * from %s where symbol='%s' and instrument like 'OPT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    option_data = dbc.execute_simple_query(option_query)
-    option_df = pd.DataFrame(data=option_data, columns=dbc.columns)
+    fut_df = chain_cache.load(symbol, Instrument.future, expiry_month, expiry_year, fields=['timestamp', 'close'])
+    option_df = chain_cache.load(symbol, Instrument.option, expiry_month, expiry_year,
+                                 fields=['timestamp', 'strike', 'option_typ', 'iv'])
 
     start_date = start_date if start_date else date(expiry_year, expiry_month, 1)
     traces = []
@@ -80,8 +75,8 @@ def strike_vol_analysis(symbol: str, strike_data: List[StrikeEntry], expiry_mont
     py.plot(fig, filename='strike_iv_analysis.html')
 
 
-def delta_iv_analysis(symbol: str, expiry_month: int, expiry_year: int, delta: float, delta_dev: float = 0.05,
-                      start_date: date = None):
+def delta_iv_analysis(symbol: str, expiry_month: int, expiry_year: int, delta, delta_dev: float = 0.05,
+                      start_date: date = None, interpolate: bool = False):
     """
     Used in the delta IV analysis of a symbol options for the expiry.
     :param symbol: str
@@ -92,72 +87,42 @@ def delta_iv_analysis(symbol: str, expiry_month: int, expiry_year: int, delta: f
     :param expiry_year: int
                 Year of the expiry month. This is included in case if database expands over multiple years.
                 For e.g. 2018
-    :param delta: float
-                Delta of the options for which IV is required to be plotted.
-                Ranges from 0 to 1. For eg. 0.5
+    :param delta: float or list
+                Delta of the options for which IV is required to be plotted. A list plots all of them at once.
+                Ranges from 0 to 1. For eg. 0.5 or [0.25, 0.5]
     :param delta_dev: float
-                Deviation from the delta value given. Range is taken as (delta - delta_dev) and (delta + delta_dev)
-                Defaults to 0.05
+                Deviation from the delta value given. Option with the delta nearest to the given value is taken if
+                it is within (delta - delta_dev) and (delta + delta_dev). Defaults to 0.05
     :param start_date: date
                 Start date for the analysis. If none given, first of month is taken.
+    :param interpolate: bool
+                If True, IV is interpolated between the options on either side of the delta value.
     :return: None
                 Plots the graph between IV and Timestamp at constant delta.
     """
     symbol = symbol.upper()
-    fut_query = "Select * from %s where symbol='%s' and instrument like 'FUT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    fut_data = dbc.execute_simple_query(fut_query)
-    fut_df = pd.DataFrame(data=fut_data, columns=dbc.columns)
-
-    option_query = "Select * from %s where symbol='%s' and instrument like 'OPT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    option_data = dbc.execute_simple_query(option_query)
-    option_df = pd.DataFrame(data=option_data, columns=dbc.columns)
-
+    targets = list(delta) if isinstance(delta, (list, tuple)) else [delta]
     start_date = start_date if start_date else date(expiry_year, expiry_month, 1)
-    fut_df = fut_df[fut_df.timestamp >= start_date].sort_values('timestamp')
-    option_df = option_df[option_df.timestamp >= start_date].sort_values('timestamp')
-
-    delta_lower = delta - delta_dev
-    delta_upper = delta + delta_dev
+    fut_df = chain_cache.load(symbol, Instrument.future, expiry_month, expiry_year, fields=['timestamp', 'close'])
+    fut_df = fut_df[fut_df.timestamp >= start_date].sort_values('timestamp').drop_duplicates('timestamp')
+    # All the days and deltas at once, the days are the chains
+    values = delta_iv.load_delta_iv(symbol, targets, expiry_month, expiry_year, start_date, interpolate,
+                                    None if interpolate else delta_dev)
+    days = values.timestamp.tolist()
 
-    timestamps_list = fut_df.timestamp.unique()
-    fut_ts, fut_price = [], []
-    call_ts, call_iv, call_text, = [], [], []
-    put_ts, put_iv, put_text, = [], [], []
-    for ts in timestamps_list:
-        option_day_df = option_df[option_df.timestamp == ts]
-        call_df = option_day_df[option_day_df.option_typ == Keys.call]
-        put_df = option_day_df[option_day_df.option_typ == Keys.put]
-        call_data = call_df[(call_df.delta >= delta_lower) & (call_df.delta <= delta_upper)].sort_values('delta',
-                                                                                                         ascending=True)
-        put_data = put_df[(put_df.delta >= -1 * delta_upper) & (put_df.delta <= -1 * delta_lower)].sort_values('delta',
-                                                                                                               ascending=False)
-        if len(call_data) > 0:
-            data = call_data.iloc[0]
-            iv = data.iv
-            text = "%s%s %s" % (data.strike, data.option_typ, data.delta)
-            call_ts.append(ts)
-            call_iv.append(iv)
-            call_text.append(text)
-
-        if len(put_data) > 0:
-            data = put_data.iloc[0]
-            iv = data.iv
-            text = "%s%s %s" % (data.strike, data.option_typ, data.delta)
-            put_ts.append(ts)
-            put_iv.append(iv)
-            put_text.append(text)
-
-        fut_close = fut_df[fut_df.timestamp == ts].iloc[0].close
-        fut_ts.append(ts)
-        fut_price.append(fut_close)
-
-    call_trace = go.Scatter(x=call_ts, y=call_iv, text=call_text, name='CE')
-    put_trace = go.Scatter(x=put_ts, y=put_iv, text=put_text, name='PE')
-    fut_trace = go.Scatter(x=fut_ts, y=fut_price, name=symbol, yaxis='y2')
-
-    traces = [call_trace, put_trace, fut_trace]
+    traces = []
+    for column, target in enumerate(targets):
+        for option_type, iv, strike, option_delta in (
+                (Keys.call, values.call_iv, values.call_strike, values.call_delta),
+                (Keys.put, values.put_iv, values.put_strike, values.put_delta)):
+            found = numpy.isfinite(iv[:, column])
+            strikes, deltas = strike[found, column].tolist(), option_delta[found, column].tolist()
+            text = ["%s%s %s" % (int(round(strike_value)), option_type, round(delta_value, 4)) for
+                    strike_value, delta_value in zip(strikes, deltas)]
+            name = option_type if len(targets) == 1 else "%s %s" % (target, option_type)
+            traces.append(go.Scatter(x=[day for day, taken in zip(days, found.tolist()) if taken],
+                                     y=iv[found, column].tolist(), text=text, name=name))
+    traces.append(go.Scatter(x=fut_df.timestamp.tolist(), y=fut_df.close.tolist(), name=symbol, yaxis='y2'))
 
     layout = go.Layout(
         title='Delta IV Analysis',
@@ -178,7 +143,7 @@ def delta_iv_analysis(symbol: str, expiry_month: int, expiry_year: int, delta: f
 def iv_surface_analysis(symbol, expiry_month, expiry_year, start_strike, end_strike, gap: int = None,
                         start_date: date = None):
     """
-    IV surface for the expiry for the given symbol.
+    IV surface for the expiry for the given symbol, from the smiles fitted by iv_surface.update_surface.
     :param symbol: str
                 Symbol for which analysis is to be done.
     :param expiry_month: int
@@ -199,37 +164,32 @@ def iv_surface_analysis(symbol, expiry_month, expiry_year, start_strike, end_str
                 Plots a 3D surface for the IV vs Strike vs Timestamp
     """
     symbol = symbol.upper()
-    option_query = "Select * from %s where symbol='%s' and instrument like 'OPT%%' and MONTH(expiry)=%d and YEAR(expiry)=%d" % (
-        dbc.table_name, symbol, expiry_month, expiry_year)
-    option_data = dbc.execute_simple_query(option_query)
-    opt_df = pd.DataFrame(option_data, columns=dbc.columns)
-
     start_strike = int(start_strike) if start_strike is not None else None
     end_strike = int(end_strike) if end_strike is not None else None
     start_date = start_date if start_date else date(expiry_year, expiry_month, 1)
 
-    opt_df = opt_df[
-        (opt_df.strike >= start_strike) & (opt_df.strike <= end_strike) & (opt_df.timestamp >= start_date) & (
-                    opt_df.iv <= 35.0)]
-    # opt_df = opt_df[(opt_df.strike >= start_strike) & (opt_df.strike <= end_strike) & (opt_df.timestamp >= start_date)]
+    # Smiles fitted by iv_surface, the monthly expiry is the last one of the month
+    surface = iv_surface.load_surface(symbol, start_date)
+    month_expiries = numpy.unique(surface.expiry[surface.expiry.astype('datetime64[M]') == numpy.datetime64(
+        date(expiry_year, expiry_month, 1), 'M')])
+    if len(month_expiries) == 0:
+        print("IV surface is not fitted for %s %s/%s" % (symbol, expiry_month, expiry_year))
+        return
+    expiry = month_expiries[-1]
+    days = numpy.unique(surface.timestamp[surface.expiry == expiry])
 
     if gap is not None:
-        opt_df = opt_df[opt_df.strike % gap == 0]
+        strikes = numpy.arange(start_strike, end_strike + 1, gap)
+    else:
+        strike_df = chain_cache.load(symbol, Instrument.option, expiry_month, expiry_year, fields=['strike'])
+        strikes = numpy.unique(strike_df.strike.values)
+        strikes = strikes[(strikes >= start_strike) & (strikes <= end_strike)]
 
-    x = opt_df['strike'].values
-    y = opt_df['timestamp'].values
-    z = opt_df['iv'].values
-    z[z == 0] = None
+    z = surface.iv(strikes[None, :], days[:, None], expiry)
     # colorscale -> ['Greys', 'YlGnBu', 'Greens', 'YlOrRd', 'Bluered', 'RdBu',
     #  'Reds', 'Blues', 'Picnic', 'Rainbow', 'Portland', 'Jet',
     #  'Hot', 'Blackbody', 'Earth', 'Electric', 'Viridis', 'Cividis']
-    trace = go.Scatter3d(x=x, y=y, z=z,
-                         marker=dict(
-                             size=2,
-                             color=z,
-                             colorscale='Viridis',
-                             opacity=1
-                         ))
+    trace = go.Surface(x=strikes.tolist(), y=days.tolist(), z=z.tolist(), colorscale='Viridis')
     data = [trace]
     layout = go.Layout(
         title='IV Surface',